@@ -0,0 +1,23 @@
+from django.db.models import Count, F, Sum
+
+from .models import OrderItem, OrderItemBead
+
+
+def units_sold(since, limit=20):
+    # Units sold and revenue per product since the given time, best sellers first
+    return list(
+        OrderItem.objects.filter(created_at__gte=since, product__isnull=False)
+        .values("product_id", "product__name", "product__category")
+        .annotate(units=Sum("quantity"), revenue=Sum(F("quantity") * F("price")))
+        .order_by("-units", "product_id")[:limit]
+    )
+
+
+def popular_beads(since, limit=20):
+    # Number of beads used in customized bracelets ordered since the given time, most used first
+    return list(
+        OrderItemBead.objects.filter(created_at__gte=since, bead__isnull=False)
+        .values("bead_id", "bead__name")
+        .annotate(units=Sum("quantity"), bracelets=Count("order_item", distinct=True))
+        .order_by("-units", "bead_id")[:limit]
+    )
@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class NamasConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'namas'
+
+    def ready(self):
+        # Register the signal handlers
+        from . import signals  # noqa: F401
+        # Time the queries of every database connection for the request metrics and profiles
+        from . import metrics, profiling  # noqa: F401
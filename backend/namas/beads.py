@@ -0,0 +1,91 @@
+import threading
+import time
+from collections import namedtuple
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+
+from .models import Product
+
+# Number of beads on a customized bracelet
+BRACELET_BEAD_COUNT = 12
+# Key of the counter bumped whenever a bead changes, so every process reloads its registry
+BEADS_VERSION_KEY = "beads:version"
+
+Bead = namedtuple("Bead", ["bead_id", "name", "price", "image"])
+
+
+class BeadRegistry:
+    """In-process catalog of the bead products used to build customized bracelets"""
+
+    def __init__(self):
+        self._beads = None
+        self._version = None
+        self._lock = threading.Lock()
+
+    def _current_version(self):
+        version = cache.get(BEADS_VERSION_KEY)
+        if version is None:
+            cache.add(BEADS_VERSION_KEY, time.time_ns(), timeout=None)
+            version = cache.get(BEADS_VERSION_KEY)
+        return version
+
+    def all(self):
+        # Return the beads keyed by their product id, loading them with one query when stale
+        version = self._current_version()
+        beads = self._beads
+        if beads is None or self._version != version:
+            with self._lock:
+                if self._beads is not None and self._version == version:
+                    return self._beads  # Another thread reloaded it meanwhile
+                beads = {}
+                for product in Product.objects.filter(category=Product.BEAD):
+                    beads[str(product.product_id)] = Bead(
+                        bead_id=str(product.product_id),
+                        name=product.name,
+                        price=product.price,
+                        image=product.primary_image or None,
+                    )
+                self._beads, self._version = beads, version
+        return beads
+
+    def contains(self, bead_id):
+        # Check whether a bead is in the loaded registry, without loading it
+        return self._beads is not None and str(bead_id) in self._beads
+
+    def invalidate(self):
+        # Make every process reload its beads on next use
+        self._beads = None
+        cache.set(BEADS_VERSION_KEY, time.time_ns(), timeout=None)
+
+    def resolve(self, beads):
+        # Look up the beads of a customized bracelet, raising ValidationError if any is invalid
+        if not beads or len(beads) != BRACELET_BEAD_COUNT:
+            raise ValidationError({'beads': f"Customized bracelets must have exactly {BRACELET_BEAD_COUNT} beads."})
+        registry = self.all()
+        resolved = []
+        for bead_info in beads:
+            bead_id = bead_info.get('bead_id') if isinstance(bead_info, dict) else None
+            bead = registry.get(str(bead_id))
+            if bead is None:
+                raise ValidationError({'beads': f"Bead with ID {bead_id} does not exist or is not a valid bead."})
+            resolved.append(bead)
+        return resolved
+
+    def validate(self, beads):
+        self.resolve(beads)
+
+    def price(self, beads):
+        # The price of a customized bracelet is the sum of its bead prices
+        return sum((bead.price for bead in self.resolve(beads)), Decimal("0"))
+
+    def render(self, beads):
+        # The bead list stored on a customized bracelet, with names and images from the catalog
+        return [
+            {"bead_id": bead.bead_id, "name": bead.name, "imgPath": bead.image}
+            for bead in self.resolve(beads)
+        ]
+
+
+bead_registry = BeadRegistry()
@@ -0,0 +1,94 @@
+import asyncio
+import math
+import time
+
+
+async def asgi_request(app, path, method="GET", query_string="", headers=(), body=b""):
+    # Drive one HTTP request through an ASGI application in-process.
+    # Returns the status code, response headers, response body and elapsed seconds.
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query_string.encode(),
+        "root_path": "",
+        "headers": [(b"host", b"localhost")] + [
+            (name.lower().encode(), value.encode()) for name, value in headers
+        ],
+        "client": ("127.0.0.1", 50000),
+        "server": ("localhost", 80),
+    }
+    request_sent = False
+    response = {"status": None, "headers": [], "body": []}
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        # Keep the connection open until the application is done with it
+        await asyncio.Future()
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+            response["headers"] = message.get("headers", [])
+        elif message["type"] == "http.response.body":
+            response["body"].append(message.get("body", b""))
+
+    start = time.perf_counter()
+    await app(scope, receive, send)
+    elapsed = time.perf_counter() - start
+    return response["status"], response["headers"], b"".join(response["body"]), elapsed
+
+
+def percentile(sorted_values, pct):
+    # Nearest-rank percentile of an already sorted list
+    if not sorted_values:
+        return None
+    rank = max(math.ceil(pct / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies, statuses, duration, concurrency):
+    # Aggregate the latencies (in seconds) of one load run into a JSON-friendly summary
+    latencies = sorted(latencies)
+
+    def to_ms(value):
+        return round(value * 1000, 3) if value is not None else None
+
+    counts = {}
+    for status in statuses:
+        counts[str(status)] = counts.get(str(status), 0) + 1
+    return {
+        "requests": len(latencies),
+        "concurrency": concurrency,
+        "duration_s": round(duration, 4),
+        "throughput_rps": round(len(latencies) / duration, 2) if duration else None,
+        "p50_ms": to_ms(percentile(latencies, 50)),
+        "p95_ms": to_ms(percentile(latencies, 95)),
+        "p99_ms": to_ms(percentile(latencies, 99)),
+        "max_ms": to_ms(latencies[-1] if latencies else None),
+        "statuses": counts,
+    }
+
+
+async def run_load(app, requests, concurrency):
+    # Send the requests (dicts of asgi_request keyword arguments) with at most
+    # `concurrency` of them in flight, and summarize the run
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, statuses = [], []
+
+    async def one(request):
+        async with semaphore:
+            status, _, _, elapsed = await asgi_request(app, **request)
+        latencies.append(elapsed)
+        statuses.append(status)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(request) for request in requests))
+    return summarize(latencies, statuses, time.perf_counter() - start, concurrency)
@@ -0,0 +1,216 @@
+import hashlib
+import threading
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max, Min, Q
+
+from .models import Product
+
+# Key of the counter bumped whenever the catalog changes; every cached catalog read embeds it
+CATALOG_VERSION_KEY = "catalog:version"
+# Key present while the read replicas may still miss the last catalog change
+CATALOG_CHANGED_KEY = "catalog:changed"
+# Cached catalog reads never go stale thanks to the version, so the timeout only bounds memory use
+CATALOG_CACHE_TIMEOUT = 60 * 60
+# Categories hidden from the listing when no type is requested
+HIDDEN_CATEGORIES = [Product.CUSTOMIZED_BRACELET, Product.BEAD]
+# Categories offered as facets; customized bracelets are never browsed
+FACET_CATEGORIES = [category for category, _ in Product.CATEGORY_CHOICES if category != Product.CUSTOMIZED_BRACELET]
+# Lower edges of the price histogram bands; the last band is open-ended
+PRICE_BANDS = (0, 25, 50, 100, 200)
+# Part of every catalog ETag; changed whenever the same data is encoded into different bytes
+RESPONSE_FORMAT = 2
+
+
+def get_catalog_version():
+    # Start from the current time so a counter lost from the cache never reuses an old version
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        cache.add(CATALOG_VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+
+def bump_catalog_version():
+    # Invalidate every cached catalog read at once
+    if settings.DATABASE_REPLICAS:
+        cache.set(CATALOG_CHANGED_KEY, True, settings.DATABASE_REPLICA_PIN_SECONDS)
+    try:
+        cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        get_catalog_version()
+
+
+def catalog_recently_changed():
+    # Catalog reads stay on the primary meanwhile, or a lagging replica would fill the new version's cache entries
+    return cache.get(CATALOG_CHANGED_KEY) is not None
+
+
+# In-process hit and miss counters of the catalog read cache
+_cache_stats = {"hits": 0, "misses": 0}
+_cache_stats_lock = threading.Lock()
+
+
+def _record(outcome):
+    with _cache_stats_lock:
+        _cache_stats[outcome] += 1
+
+
+def get_catalog_cache_stats():
+    with _cache_stats_lock:
+        stats = dict(_cache_stats)
+    stats["version"] = get_catalog_version()
+    return stats
+
+
+def catalog_cache_key(kind, *parts):
+    # Embed the catalog version so entries written before a catalog change are never read again.
+    # The parts come from the request, so they are hashed into a short key without spaces or
+    # control characters, which backends other than locmem (e.g. memcached) reject.
+    digest = hashlib.sha256(repr(tuple(str(part) for part in parts)).encode()).hexdigest()
+    return "catalog:{}:{}:{}".format(get_catalog_version(), kind, digest)
+
+
+def cached_catalog_read(key, build):
+    # Return the cached payload for the key, building and caching it on a miss.
+    # A build returning None (e.g. product not found) is not cached.
+    payload = cache.get(key)
+    if payload is not None:
+        _record("hits")
+        return payload
+    _record("misses")
+    payload = build()
+    if payload is not None:
+        cache.set(key, payload, CATALOG_CACHE_TIMEOUT)
+    return payload
+
+
+async def acached_catalog_read(key, build):
+    # Async variant of cached_catalog_read for a coroutine-returning build.
+    # The cache calls stay synchronous: the local-memory and file backends don't touch the database
+    # and are cheaper to call inline than through a thread.
+    payload = cache.get(key)
+    if payload is not None:
+        _record("hits")
+        return payload
+    _record("misses")
+    payload = await build()
+    if payload is not None:
+        cache.set(key, payload, CATALOG_CACHE_TIMEOUT)
+    return payload
+
+
+def parse_filters(query):
+    # Normalize the filter parameters of a listing request so equivalent requests share cache entries
+    filters = {"type": query.get("type") or None}
+    for name in ("price_min", "price_max"):
+        value = query.get(name) or None
+        if value is not None:
+            try:
+                value = Decimal(value)
+            except InvalidOperation:
+                raise ValueError(f"Invalid {name}.")
+            if not value.is_finite():
+                raise ValueError(f"Invalid {name}.")
+            value = value.normalize()
+        filters[name] = value
+    return filters
+
+
+def filter_products(filters, queryset=None):
+    # Build the filter chain shared by every listing endpoint
+    products = Product.objects.all() if queryset is None else queryset
+    if filters["type"]:
+        products = products.filter(category=filters["type"])
+    else:
+        # Exclude customized_bracelet and bead products when the type is not specified
+        products = products.exclude(category__in=HIDDEN_CATEGORIES)
+    if filters["price_min"] is not None:
+        products = products.filter(price__gte=filters["price_min"])
+    if filters["price_max"] is not None:
+        products = products.filter(price__lte=filters["price_max"])
+    # Discard products with inventory 0
+    return products.filter(inventory__gt=0)
+
+
+def _count_key(filters):
+    return catalog_cache_key("count", filters["type"], filters["price_min"], filters["price_max"])
+
+
+def get_cached_count(filters):
+    # Return the cached number of products matching the filters, or None
+    total = cache.get(_count_key(filters))
+    _record("misses" if total is None else "hits")
+    return total
+
+
+def set_cached_count(filters, total):
+    cache.set(_count_key(filters), total, timeout=None)
+
+
+async def acatalog_validators(products, *parts):
+    # Derive a strong ETag and the Last-Modified time of a catalog response from the newest
+    # updated_at and the number of the products it covers, plus the response format and request parts
+    stats = await products.aaggregate(last_modified=Max("updated_at"), count=Count("product_id"))
+    digest = hashlib.sha256(
+        repr((RESPONSE_FORMAT, stats["last_modified"], stats["count"], parts)).encode()
+    ).hexdigest()[:32]
+    return f'"{digest}"', stats["last_modified"]
+
+
+async def acatalog_facets(filters):
+    """Compute the facets of a listing in one aggregate query of conditional counts:
+    the listed and total products per category for the price filter, and the price range
+    and histogram of the listed products for the type filter. Each facet ignores its own
+    filter so the other options stay visible."""
+    in_stock = Q(inventory__gt=0)
+    if filters["type"]:
+        type_filter = Q(category=filters["type"])
+    else:
+        type_filter = ~Q(category__in=HIDDEN_CATEGORIES)
+    price_filter = Q()
+    if filters["price_min"] is not None:
+        price_filter &= Q(price__gte=filters["price_min"])
+    if filters["price_max"] is not None:
+        price_filter &= Q(price__lte=filters["price_max"])
+
+    aggregates = {
+        "total": Count("product_id", filter=type_filter & price_filter & in_stock),
+        "price_min": Min("price", filter=type_filter & in_stock),
+        "price_max": Max("price", filter=type_filter & in_stock),
+    }
+    for category in FACET_CATEGORIES:
+        aggregates[f"{category}_listed"] = Count("product_id", filter=Q(category=category) & price_filter & in_stock)
+        aggregates[f"{category}_total"] = Count("product_id", filter=Q(category=category) & price_filter)
+    bands = list(zip(PRICE_BANDS, PRICE_BANDS[1:] + (None,)))
+    for index, (low, high) in enumerate(bands):
+        band = Q(price__gte=low) if high is None else Q(price__gte=low, price__lt=high)
+        aggregates[f"band_{index}"] = Count("product_id", filter=type_filter & in_stock & band)
+
+    stats = await Product.objects.exclude(category=Product.CUSTOMIZED_BRACELET).aaggregate(**aggregates)
+    labels = dict(Product.CATEGORY_CHOICES)
+    # Some databases return aggregated decimals without their scale
+    for name in ("price_min", "price_max"):
+        if stats[name] is not None:
+            stats[name] = stats[name].quantize(Decimal("0.01"))
+    return {
+        "success": True,
+        "total": stats["total"],
+        "categories": [
+            {
+                "category": category,
+                "label": labels[category],
+                "count": stats[f"{category}_listed"],
+                "total": stats[f"{category}_total"],
+            }
+            for category in FACET_CATEGORIES
+        ],
+        "price": {"min": stats["price_min"], "max": stats["price_max"]},
+        "price_histogram": [
+            {"min": low, "max": high, "count": stats[f"band_{index}"]}
+            for index, (low, high) in enumerate(bands)
+        ],
+    }
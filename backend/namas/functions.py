@@ -0,0 +1,14 @@
+from django.db.models import Func, IntegerField
+
+
+class JSONArrayLength(Func):
+    """Number of elements of a JSON array column, computed by the database"""
+
+    function = "JSON_ARRAY_LENGTH"
+    output_field = IntegerField()
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        return super().as_sql(compiler, connection, function="JSON_LENGTH", **extra_context)
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return super().as_sql(compiler, connection, function="JSONB_ARRAY_LENGTH", **extra_context)
@@ -0,0 +1,173 @@
+import logging
+import threading
+import time
+
+import stripe
+from django.conf import settings
+
+from .metrics import record
+
+logger = logging.getLogger(__name__)
+
+
+class GatewayUnavailable(Exception):
+    """Raised without calling the payment provider when its circuit is open or too many calls are in flight"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        # Seconds after which the call may succeed
+        self.retry_after = retry_after
+
+
+# Errors that say the provider is unhealthy, as opposed to a rejected request
+PROVIDER_ERRORS = (stripe.APIConnectionError, stripe.APIError, stripe.RateLimitError)
+
+
+class CircuitBreaker:
+    """Fails fast after `failure_threshold` consecutive provider errors. After `reset_timeout`
+    seconds one trial call is let through: success closes the circuit, failure reopens it."""
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                return True
+            # Open, or half open with the trial call still in flight
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning("Payment gateway circuit opened after %s failures", self.failures)
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def release(self):
+        # A trial call ended without saying anything about the provider's health
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+
+
+class PaymentGateway:
+    """The single way out to the payment provider: one configured Stripe client with bounded
+    timeouts, at most PAYMENT_GATEWAY_MAX_CONCURRENCY calls in flight, a circuit breaker and
+    latency and error counters"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        # Rebuild the client, limits and counters from the current settings
+        with self._lock:
+            self._client = None
+            self._slots = threading.BoundedSemaphore(settings.PAYMENT_GATEWAY_MAX_CONCURRENCY)
+            self.breaker = CircuitBreaker(
+                settings.PAYMENT_GATEWAY_FAILURE_THRESHOLD, settings.PAYMENT_GATEWAY_RESET_TIMEOUT
+            )
+            self._stats = {
+                "calls": 0, "successes": 0, "errors": 0, "provider_errors": 0,
+                "rejected_open": 0, "rejected_busy": 0, "in_flight": 0,
+                "latency_total_ms": 0.0, "latency_max_ms": 0.0,
+            }
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                self._client = stripe.StripeClient(
+                    settings.STRIPE_SECRET_KEY,
+                    base_addresses={"api": settings.STRIPE_API_BASE},
+                    max_network_retries=settings.STRIPE_MAX_NETWORK_RETRIES,
+                    http_client=stripe.RequestsClient(
+                        timeout=(settings.STRIPE_CONNECT_TIMEOUT, settings.STRIPE_READ_TIMEOUT)
+                    ),
+                )
+            return self._client
+
+    def _count(self, **deltas):
+        with self._lock:
+            for name, delta in deltas.items():
+                self._stats[name] += delta
+
+    def call(self, operation, *args, **kwargs):
+        """Run operation(client, *args, **kwargs) under the concurrency limit and circuit breaker.
+        Raises GatewayUnavailable without calling the provider when either refuses the call."""
+        if not self.breaker.allow():
+            self._count(rejected_open=1)
+            raise GatewayUnavailable(
+                "The payment provider is failing, try again later.", self.breaker.reset_timeout
+            )
+        if not self._slots.acquire(timeout=settings.PAYMENT_GATEWAY_QUEUE_TIMEOUT):
+            self.breaker.release()
+            self._count(rejected_busy=1)
+            raise GatewayUnavailable("Too many payment requests in progress, try again later.", 1)
+
+        self._count(calls=1, in_flight=1)
+        start = time.perf_counter()
+        try:
+            result = operation(self.client, *args, **kwargs)
+        except PROVIDER_ERRORS:
+            self.breaker.record_failure()
+            self._count(errors=1, provider_errors=1)
+            raise
+        except Exception:
+            # The provider answered, e.g. rejected the request, so it is healthy
+            self.breaker.record_success()
+            self._count(errors=1)
+            raise
+        else:
+            self.breaker.record_success()
+            self._count(successes=1)
+            return result
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            self._slots.release()
+            record("payment", elapsed / 1000)
+            with self._lock:
+                self._stats["in_flight"] -= 1
+                self._stats["latency_total_ms"] += elapsed
+                self._stats["latency_max_ms"] = max(self._stats["latency_max_ms"], elapsed)
+
+    def create_payment_intent(self, params, idempotency_key):
+        return self.call(lambda client: client.payment_intents.create(
+            params, {"idempotency_key": idempotency_key}
+        ))
+
+    def update_payment_intent(self, intent_id, params, idempotency_key):
+        return self.call(lambda client: client.payment_intents.update(
+            intent_id, params, {"idempotency_key": idempotency_key}
+        ))
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        finished = stats["successes"] + stats["errors"]
+        stats["latency_avg_ms"] = round(stats["latency_total_ms"] / finished, 2) if finished else None
+        stats["latency_total_ms"] = round(stats["latency_total_ms"], 2)
+        stats["latency_max_ms"] = round(stats["latency_max_ms"], 2)
+        stats["circuit"] = self.breaker.state
+        return stats
+
+
+payment_gateway = PaymentGateway()
@@ -0,0 +1,59 @@
+from django.contrib.auth import HASH_SESSION_KEY, SESSION_KEY
+from django.core.cache import cache
+
+# Seconds a user payload stays cached; saving or deleting the user drops it sooner
+USER_CACHE_TIMEOUT = 60 * 5
+
+
+def user_cache_key(user_id):
+    return f"identity:user:{user_id}"
+
+
+def user_payload(user):
+    # The few user fields the API needs, plus the session hash that ties sessions to the password
+    return {
+        "id": user.id,
+        "email": user.email,
+        "first_name": user.first_name,
+        "last_name": user.last_name,
+        "is_staff": user.is_staff,
+        "session_hash": user.get_session_auth_hash(),
+    }
+
+
+def invalidate_user(user_id):
+    cache.delete(user_cache_key(user_id))
+
+
+def _cached_payload(user_id, session_hash):
+    # Return the cached payload of the session's user if the session is still valid for it
+    if user_id is None:
+        return None
+    payload = cache.get(user_cache_key(user_id))
+    if payload is not None and payload["session_hash"] == session_hash:
+        return payload
+    return None
+
+
+def get_identity(request):
+    """Return the cached payload of the logged-in user, or None for anonymous requests.
+    On a hit neither the User row nor, with the cached_db session engine, the session
+    row is read. On a miss request.user does the full check, including the session hash."""
+    payload = _cached_payload(request.session.get(SESSION_KEY), request.session.get(HASH_SESSION_KEY))
+    if payload is None and request.user.is_authenticated:
+        payload = user_payload(request.user)
+        cache.set(user_cache_key(request.user.id), payload, USER_CACHE_TIMEOUT)
+    return payload
+
+
+async def aget_identity(request):
+    # Async variant of get_identity
+    payload = _cached_payload(
+        await request.session.aget(SESSION_KEY), await request.session.aget(HASH_SESSION_KEY)
+    )
+    if payload is None:
+        user = await request.auser()
+        if user.is_authenticated:
+            payload = user_payload(user)
+            cache.set(user_cache_key(user.id), payload, USER_CACHE_TIMEOUT)
+    return payload
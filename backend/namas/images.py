@@ -0,0 +1,143 @@
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from .catalog import bump_catalog_version
+from .models import Product, ProductImage
+
+logger = logging.getLogger(__name__)
+
+# Widths of the resized copies generated for every product image
+VARIANT_WIDTHS = (240, 480, 960)
+# Formats of the resized copies: file extension -> Pillow format and save options
+VARIANT_FORMATS = {
+    "webp": ("WEBP", {"quality": 80, "method": 4}),
+    "jpeg": ("JPEG", {"quality": 82, "optimize": True, "progressive": True}),
+}
+# Directory, relative to MEDIA_ROOT, holding the resized copies
+VARIANT_DIR = "product_images/variants"
+# EXIF tag holding the camera orientation
+ORIENTATION_TAG = 0x0112
+
+
+def variant_name(name, width, extension):
+    # Storage name of one resized copy of an image, e.g. product_images/variants/Amethyst_png_240.webp
+    base = os.path.basename(name).replace(".", "_")
+    return f"{VARIANT_DIR}/{base}_{width}.{extension}"
+
+
+def variants_match(image):
+    # Whether the stored variants of a ProductImage were generated from its current file
+    expected = variant_name(image.image.name, VARIANT_WIDTHS[0], "webp")
+    return image.variants.get("webp", {}).get(str(VARIANT_WIDTHS[0])) == expected
+
+
+def generate_variants(name, media_root, force=False):
+    """Write the resized copies of the image stored under `name` and return them as
+    {extension: {width: storage name}}. Copies newer than the original are kept.
+    Runs without Django so it can be used in a process pool."""
+    source = os.path.join(media_root, name)
+    try:
+        with Image.open(source) as original:
+            # Size after applying the camera orientation, read without decoding the image
+            width, height = original.size
+            if original.getexif().get(ORIENTATION_TAG) in (5, 6, 7, 8):
+                width, height = height, width
+            # Never upscale: skip the widths above the original, but always keep the smallest one
+            widths = [variant for variant in VARIANT_WIDTHS if variant <= width] or VARIANT_WIDTHS[:1]
+
+            image = None
+            variants = {}
+            for variant in widths:
+                resized = None
+                for extension, (image_format, options) in VARIANT_FORMATS.items():
+                    target_name = variant_name(name, variant, extension)
+                    target = os.path.join(media_root, target_name)
+                    up_to_date = os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(source)
+                    if force or not up_to_date:
+                        if image is None:
+                            image = ImageOps.exif_transpose(original)
+                        if resized is None:
+                            target_width = min(variant, width)
+                            resized = image.resize(
+                                (target_width, round(height * target_width / width)), Image.Resampling.LANCZOS
+                            )
+                        os.makedirs(os.path.dirname(target), exist_ok=True)
+                        # JPEG has no transparency
+                        converted = resized.convert("RGB") if image_format == "JPEG" else resized
+                        converted.save(target, image_format, **options)
+                    variants.setdefault(extension, {})[str(variant)] = target_name
+            return variants
+    except (OSError, UnidentifiedImageError) as e:
+        logger.warning("Could not generate variants of %s: %s", name, e)
+        return {}
+
+
+def refresh_variants(images, workers=None, force=False):
+    """Generate the resized copies of the given ProductImage instances, in parallel when
+    `workers` is more than 1, and store them on the instances. Returns the number updated."""
+    images = [image for image in images if image.image]
+    names = [image.image.name for image in images]
+    if workers and workers > 1 and len(names) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(
+                generate_variants, names, [settings.MEDIA_ROOT] * len(names), [force] * len(names)
+            ))
+    else:
+        results = [generate_variants(name, settings.MEDIA_ROOT, force) for name in names]
+
+    changed = []
+    for image, variants in zip(images, results):
+        if variants != image.variants:
+            image.variants = variants
+            changed.append(image)
+    if changed:
+        # Bulk writes skip the model signals, so refresh the manifests and invalidate the catalog here
+        ProductImage.objects.bulk_update(changed, ["variants"])
+        refresh_image_manifests({image.product_id for image in changed})
+        bump_catalog_version()
+    return len(changed)
+
+
+def image_manifest(images):
+    # The manifest stored on Product.image_manifest, from its ProductImage rows in upload order
+    return [{"url": image.image.url, "variants": image.variants} for image in images if image.image]
+
+
+def refresh_image_manifests(product_ids):
+    """Rebuild the primary image and image manifest of the given products from their
+    ProductImage rows, and touch their updated_at. Costs two queries whatever the count."""
+    images = {product_id: [] for product_id in product_ids}
+    if not images:
+        return
+    for image in ProductImage.objects.filter(product_id__in=images).order_by("pk"):
+        images[image.product_id].append(image)
+
+    now = timezone.now()
+    products = []
+    for product_id, product_images in images.items():
+        manifest = image_manifest(product_images)
+        products.append(Product(
+            pk=product_id,
+            primary_image=manifest[0]["url"] if manifest else "",
+            image_manifest=manifest,
+            updated_at=now,
+        ))
+    Product.objects.bulk_update(products, ["primary_image", "image_manifest", "updated_at"])
+
+
+def srcset(variants):
+    # Turn stored variants into srcset strings keyed by format, e.g.
+    # {"webp": "/media/..._240.webp 240w, /media/..._480.webp 480w"}
+    return {
+        extension: ", ".join(
+            f"{default_storage.url(name)} {width}w"
+            for width, name in sorted(by_width.items(), key=lambda item: int(item[0]))
+        )
+        for extension, by_width in variants.items()
+    }
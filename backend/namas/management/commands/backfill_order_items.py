@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+
+from namas.models import Order, OrderItem
+from namas.orders import write_order_lines
+
+
+class Command(BaseCommand):
+    help = "Write the normalized order lines of the orders placed before they were recorded at checkout"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=500, help="Orders read and written per transaction")
+
+    def handle(self, *args, **options):
+        # Walk the orders in primary key order, one chunk per transaction, so the
+        # command can be interrupted and resumed without writing any line twice
+        has_lines = Exists(OrderItem.objects.filter(order=OuterRef("pk")))
+        orders = Order.objects.filter(~has_lines).order_by("pk")
+        last_pk, order_count, line_count = None, 0, 0
+        while True:
+            chunk = orders if last_pk is None else orders.filter(pk__gt=last_pk)
+            with transaction.atomic():
+                chunk = list(chunk[:options["chunk_size"]])
+                if not chunk:
+                    break
+                line_count += write_order_lines(chunk)
+            order_count += len(chunk)
+            last_pk = chunk[-1].pk
+            self.stderr.write(f"{order_count} orders, {line_count} lines")
+
+        self.stdout.write(self.style.SUCCESS(f"Backfilled {line_count} lines of {order_count} orders."))
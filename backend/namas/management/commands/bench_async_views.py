@@ -0,0 +1,119 @@
+import asyncio
+import json
+import time
+import types
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from django.db.backends.signals import connection_created
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import path
+
+from namas import views
+from namas.benchmark import run_load
+
+# The read endpoints served by async views, with the view behind each route
+READ_ENDPOINTS = [
+    ("products", views.get_products_action, ""),
+    ("products/page-count", views.get_page_count_action, ""),
+    ("orders", views.get_orders_action, ""),
+    ("account/user", views.get_curr_user_action, ""),
+]
+
+
+def _as_sync_view(view):
+    # Serve an async view the way the sync views were served before: Django runs the
+    # wrapper in its sync thread, which stays blocked until the whole request is done
+    def inner(request, *args, **kwargs):
+        return async_to_sync(view)(request, *args, **kwargs)
+
+    return inner
+
+
+def _latency_wrapper(seconds):
+    # Execute wrapper adding a fixed round-trip time to every query, to model a remote database
+    def wrapper(execute, sql, params, many, context):
+        time.sleep(seconds)
+        return execute(sql, params, many, context)
+
+    return wrapper
+
+
+def _urlconf(mode):
+    urlconf = types.ModuleType(f"bench_async_views_{mode}")
+    urlconf.urlpatterns = [
+        path(route, view if mode == "async" else _as_sync_view(view))
+        for route, view, _ in READ_ENDPOINTS
+    ]
+    return urlconf
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the throughput and latency of the read endpoints served as async views "
+        "against the same views run through Django's sync thread adapter, at increasing concurrency"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=500, help="Requests per endpoint and concurrency level")
+        parser.add_argument("--concurrency", default="1,10,50,100", help="Comma-separated concurrency levels")
+        parser.add_argument("--user", help="Email of an existing user to authenticate /orders and /account/user")
+        parser.add_argument(
+            "--db-latency-ms", type=float, default=0,
+            help="Simulated round-trip time added to every query, e.g. 1 for a database on another host",
+        )
+        parser.add_argument("--output", help="Write the JSON report to this file instead of stdout")
+
+    def handle(self, *args, **options):
+        try:
+            levels = [int(level) for level in options["concurrency"].split(",")]
+        except ValueError:
+            raise CommandError("--concurrency must be a comma-separated list of integers.")
+
+        headers = []
+        if options["user"]:
+            try:
+                user = User.objects.get(username=options["user"])
+            except User.DoesNotExist:
+                raise CommandError(f"User {options['user']} does not exist.")
+            client = Client()
+            client.force_login(user, backend="django.contrib.auth.backends.ModelBackend")
+            session = client.cookies[settings.SESSION_COOKIE_NAME].value
+            headers.append(("cookie", f"{settings.SESSION_COOKIE_NAME}={session}"))
+
+        if options["db_latency_ms"]:
+            wrapper = _latency_wrapper(options["db_latency_ms"] / 1000)
+
+            def add_latency(sender, connection, **kwargs):
+                if wrapper not in connection.execute_wrappers:
+                    connection.execute_wrappers.append(wrapper)
+
+            connection_created.connect(add_latency, weak=False)
+
+        app = get_asgi_application()
+        report = {}
+        for mode in ("sync", "async"):
+            report[mode] = {}
+            with override_settings(ROOT_URLCONF=_urlconf(mode)):
+                for route, _, query_string in READ_ENDPOINTS:
+                    request = {"path": f"/{route}", "query_string": query_string, "headers": headers}
+                    report[mode][route] = [
+                        asyncio.run(run_load(app, [request] * options["requests"], level))
+                        for level in levels
+                    ]
+                    for run in report[mode][route]:
+                        self.stderr.write(
+                            f"{mode:5} /{route:20} c={run['concurrency']:<4} "
+                            f"{run['throughput_rps']:>9} req/s  p50={run['p50_ms']}ms  p99={run['p99_ms']}ms"
+                        )
+
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
@@ -0,0 +1,286 @@
+import asyncio
+import json
+import platform
+import threading
+import uuid
+from collections import namedtuple
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.test import Client
+from django.test.utils import override_settings
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+
+from namas import urls
+from namas.benchmark import asgi_request, run_load
+from namas.catalog import HIDDEN_CATEGORIES
+from namas.gateway import payment_gateway
+from namas.models import Cart, Order, Product
+from namas.profiling import PROFILE_HEADER
+from namas.seed import SEED_PASSWORD, SEED_STAFF_EMAIL, SEED_USER_EMAIL, STONES
+from namas.stripe_stub import StubStripeServer
+from namas.throttling import auth_account_limiter, auth_ip_limiter
+
+# One benchmarked request type. `build(i, data)` returns the path, query string and JSON body of
+# the i-th request; `session` is the account it runs as: "user" (the first seeded user, who has
+# the longest order history), "staff", "cart" (a different seeded user with a filled cart per
+# request) or None. Reads come first, so the writes can't change what they measure.
+Endpoint = namedtuple("Endpoint", ["label", "route", "method", "session", "build"])
+
+CATEGORIES = [Product.BRACELET, Product.NECKLACE, Product.RING]
+
+ENDPOINTS = [
+    Endpoint("products", "products", "GET", None, lambda i, data: ("/products", f"page={i % 20 + 1}", None)),
+    Endpoint(
+        "products (detail)", "products", "GET", None,
+        lambda i, data: ("/products", f"product_id={data['products'][i % len(data['products'])]}", None),
+    ),
+    Endpoint(
+        "products/page-count", "products/page-count", "GET", None,
+        lambda i, data: ("/products/page-count", f"type={CATEGORIES[i % 3]}", None),
+    ),
+    Endpoint(
+        "products/listing", "products/listing", "GET", None,
+        lambda i, data: ("/products/listing", f"type={CATEGORIES[i % 3]}&page={i % 10 + 1}&sort_by=price", None),
+    ),
+    Endpoint(
+        "products/search", "products/search", "GET", None,
+        lambda i, data: ("/products/search", f"q={STONES[i % len(STONES)].split()[0]}", None),
+    ),
+    Endpoint(
+        "products/facets", "products/facets", "GET", None,
+        lambda i, data: ("/products/facets", f"type={CATEGORIES[i % 3]}", None),
+    ),
+    Endpoint("products/cache-stats", "products/cache-stats", "GET", "staff", lambda i, data: ("/products/cache-stats", "", None)),
+    Endpoint("account/user", "account/user", "GET", "user", lambda i, data: ("/account/user", "", None)),
+    Endpoint("account/throttle-stats", "account/throttle-stats", "GET", "staff", lambda i, data: ("/account/throttle-stats", "", None)),
+    Endpoint("checkout/gateway-stats", "checkout/gateway-stats", "GET", "staff", lambda i, data: ("/checkout/gateway-stats", "", None)),
+    Endpoint("cart", "cart", "GET", "user", lambda i, data: ("/cart", "", None)),
+    Endpoint("orders", "orders", "GET", "user", lambda i, data: ("/orders", "", None)),
+    Endpoint("orders (summary)", "orders", "GET", "user", lambda i, data: ("/orders", "summary=1&limit=50", None)),
+    Endpoint(
+        "orders/<id>", "orders/<uuid:order_id>", "GET", "user",
+        lambda i, data: (f"/orders/{data['orders'][i % len(data['orders'])]}", "", None),
+    ),
+    Endpoint("orders/analytics", "orders/analytics", "GET", "staff", lambda i, data: ("/orders/analytics", "days=365", None)),
+    Endpoint("metrics", "metrics", "GET", "staff", lambda i, data: ("/metrics", "", None)),
+    Endpoint("profiles", "profiles", "GET", "staff", lambda i, data: ("/profiles", "", None)),
+    Endpoint(
+        "profiles/<id>", "profiles/<str:capture_id>", "GET", "staff",
+        lambda i, data: (f"/profiles/{data['profile']}", "", None),
+    ),
+    Endpoint(
+        "checkout/create-payment", "checkout/create-payment", "POST", "user",
+        lambda i, data: ("/checkout/create-payment", "", {}),
+    ),
+    Endpoint(
+        "cart (update)", "cart", "POST", "user",
+        lambda i, data: ("/cart", "", {"cart_items": [
+            {"product_id": data["products"][(i + offset) % len(data["products"])], "quantity": 1} for offset in range(3)
+        ]}),
+    ),
+    Endpoint(
+        "account/login", "account/login", "POST", None,
+        lambda i, data: ("/account/login", "", {"email": data["email"], "password": SEED_PASSWORD}),
+    ),
+    Endpoint(
+        "account/register", "account/register", "POST", None,
+        lambda i, data: ("/account/register", "", {
+            "first_name": "Bench", "last_name": "User", "email": f"seed-bench-{data['run']}-{i}@example.com",
+            "password": SEED_PASSWORD, "confirm_password": SEED_PASSWORD,
+        }),
+    ),
+    Endpoint("account/logout", "account/logout", "POST", None, lambda i, data: ("/account/logout", "", {})),
+    Endpoint("checkout", "checkout", "POST", "cart", lambda i, data: ("/checkout", "", {"shipping_address": "1 Bench Street"})),
+]
+
+
+def uncovered_routes():
+    # Routes of namas/urls.py without a benchmarked request
+    covered = {endpoint.route for endpoint in ENDPOINTS}
+    return [str(pattern.pattern) for pattern in urls.urlpatterns if str(pattern.pattern) not in covered]
+
+
+class QueryCounter:
+    # Counts the queries of every connection, whichever thread runs them
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def install(self, sender, connection, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+
+def _session_cookie(user):
+    client = Client()
+    client.force_login(user, backend="django.contrib.auth.backends.ModelBackend")
+    return client.cookies[settings.SESSION_COOKIE_NAME].value
+
+
+def _compare(current, baseline):
+    # Relative change of every timing and of the query count, per endpoint and concurrency level
+    changes = {}
+    for label, runs in current.items():
+        previous = {run["concurrency"]: run for run in baseline.get(label, [])}
+        for run in runs:
+            before = previous.get(run["concurrency"])
+            if before is None:
+                continue
+            changes.setdefault(label, []).append({
+                "concurrency": run["concurrency"],
+                **{
+                    f"{key}_change_pct": round((run[key] - before[key]) / before[key] * 100, 1)
+                    for key in ("p50_ms", "p95_ms", "p99_ms", "throughput_rps", "queries_per_request")
+                    if run.get(key) is not None and before.get(key)
+                },
+            })
+    return changes
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive every endpoint of namas/urls.py through the ASGI application in-process against seeded "
+        "data (see seed_data) and report latency percentiles, throughput and queries per request as JSON"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200, help="Requests per endpoint and concurrency level")
+        parser.add_argument("--concurrency", default="1,10", help="Comma-separated concurrency levels")
+        parser.add_argument("--only", help="Comma-separated labels or label prefixes of the endpoints to run")
+        parser.add_argument("--skip-writes", action="store_true", help="Only run the GET endpoints")
+        parser.add_argument("--baseline", help="A previous report to compare this run with")
+        parser.add_argument("--output", help="Write the JSON report to this file instead of stdout")
+
+    def handle(self, *args, **options):
+        try:
+            levels = [int(level) for level in options["concurrency"].split(",")]
+        except ValueError:
+            raise CommandError("--concurrency must be a comma-separated list of integers.")
+        missing = uncovered_routes()
+        if missing:
+            self.stderr.write(f"Routes without a benchmark: {', '.join(missing)}")
+
+        endpoints = ENDPOINTS
+        if options["only"]:
+            prefixes = options["only"].split(",")
+            endpoints = [e for e in endpoints if any(e.label.startswith(prefix) for prefix in prefixes)]
+        if options["skip_writes"]:
+            endpoints = [e for e in endpoints if e.method == "GET"]
+
+        try:
+            user = User.objects.get(username=SEED_USER_EMAIL.format(0))
+            staff = User.objects.get(username=SEED_STAFF_EMAIL)
+        except User.DoesNotExist:
+            raise CommandError("No seeded data, run python3 manage.py seed_data first.")
+        data = {
+            "run": uuid.uuid4().hex[:8],
+            "email": user.email,
+            "products": [
+                str(pk) for pk in Product.objects.exclude(category__in=HIDDEN_CATEGORIES)
+                .filter(inventory__gt=0).order_by("pk").values_list("pk", flat=True)[:500]
+            ],
+            "orders": [str(pk) for pk in Order.objects.filter(user=user).order_by("pk").values_list("pk", flat=True)[:500]],
+        }
+        cookies = {"user": _session_cookie(user), "staff": _session_cookie(staff)}
+        # Checkouts empty their cart, so each one runs as another user with a filled cart
+        runs_needed = options["requests"] * len(levels)
+        cart_cookies = []
+        if any(endpoint.session == "cart" for endpoint in endpoints):
+            cart_users = User.objects.filter(cart__items__isnull=False).exclude(pk=user.pk).distinct().order_by("pk")
+            cart_cookies = [_session_cookie(cart_user) for cart_user in cart_users[:runs_needed]]
+        csrf_token = get_random_string(32)
+
+        def build_request(endpoint, i):
+            path, query_string, body = endpoint.build(i, data)
+            cookie = f"{settings.CSRF_COOKIE_NAME}={csrf_token}"
+            session = None
+            if endpoint.session == "cart":
+                session = cart_cookies[i % len(cart_cookies)] if cart_cookies else None
+            elif endpoint.session:
+                session = cookies[endpoint.session]
+            if session:
+                cookie += f"; {settings.SESSION_COOKIE_NAME}={session}"
+            headers = [("cookie", cookie), ("x-csrftoken", csrf_token)]
+            request = {"path": path, "method": endpoint.method, "query_string": query_string, "headers": headers}
+            if body is not None:
+                headers.append(("content-type", "application/json"))
+                request["body"] = json.dumps(body).encode()
+            return request
+
+        counter = QueryCounter()
+        connection_created.connect(counter.install, weak=False)
+        counter.install(None, connection)
+        stripe = StubStripeServer().start()
+        # Let every login and registration through: the benchmark measures the views, not the throttle
+        bursts = (auth_ip_limiter.burst, auth_account_limiter.burst)
+        auth_ip_limiter.burst = auth_account_limiter.burst = float("inf")
+        app = get_asgi_application()
+        report = {}
+        try:
+            if any(endpoint.route == "profiles/<str:capture_id>" for endpoint in endpoints):
+                # Profile one request, for the profile download to fetch
+                request = build_request(ENDPOINTS[0]._replace(session="staff"), 0)
+                request["headers"].append((PROFILE_HEADER, "1"))
+                headers = dict(asyncio.run(asgi_request(app, **request))[1])
+                data["profile"] = headers[b"X-Profile-Id"].decode()
+            with override_settings(STRIPE_SECRET_KEY="sk_test_stub", STRIPE_API_BASE=stripe.url):
+                payment_gateway.reset()
+                for endpoint in endpoints:
+                    report[endpoint.label] = []
+                    offset = 0
+                    for level in levels:
+                        requests = [build_request(endpoint, offset + i) for i in range(options["requests"])]
+                        offset += options["requests"]
+                        counter.count = 0
+                        run = asyncio.run(run_load(app, requests, level))
+                        run["queries_per_request"] = round(counter.count / options["requests"], 2)
+                        report[endpoint.label].append(run)
+                        self.stderr.write(
+                            f"{endpoint.method:4} {endpoint.label:26} c={level:<4} {run['throughput_rps']:>9} req/s  "
+                            f"p50={run['p50_ms']}ms  p99={run['p99_ms']}ms  {run['queries_per_request']} queries  "
+                            f"{run['statuses']}"
+                        )
+        finally:
+            auth_ip_limiter.burst, auth_account_limiter.burst = bursts
+            auth_ip_limiter.reset()
+            auth_account_limiter.reset()
+            payment_gateway.reset()
+            stripe.stop()
+            connection_created.disconnect(counter.install)
+
+        result = {
+            "meta": {
+                "created_at": timezone.now().isoformat(),
+                "requests": options["requests"],
+                "concurrency": levels,
+                "database": connection.vendor,
+                "python": platform.python_version(),
+                "data": {
+                    "products": Product.objects.count(),
+                    "users": User.objects.count(),
+                    "carts": Cart.objects.count(),
+                    "orders": Order.objects.count(),
+                },
+            },
+            "endpoints": report,
+        }
+        if options["baseline"]:
+            with open(options["baseline"]) as f:
+                result["comparison"] = _compare(report, json.load(f)["endpoints"])
+        output = json.dumps(result, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
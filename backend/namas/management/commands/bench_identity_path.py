@@ -0,0 +1,81 @@
+import json
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from namas.benchmark import summarize
+from namas.identity import invalidate_user
+
+# The authenticated endpoints that only need the session user's id or profile
+ENDPOINTS = ["/account/user", "/orders", "/orders?summary=1", "/cart"]
+
+# Sessions and users read from the database on every request, as before the identity cache,
+# against sessions read from the cache and the cached user payload
+MODES = {
+    "db": "django.contrib.sessions.backends.db",
+    "cached": "django.contrib.sessions.backends.cached_db",
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the queries and latency per request of the authenticated endpoints with database "
+        "sessions and no identity cache, against cached sessions and the cached user payload"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", required=True, help="Email of an existing user to log in as")
+        parser.add_argument("--requests", type=int, default=200, help="Requests per endpoint and mode")
+        parser.add_argument("--output", help="Write the JSON report to this file instead of stdout")
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options["user"])
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['user']} does not exist.")
+
+        report = {}
+        for mode, engine in MODES.items():
+            report[mode] = {}
+            with override_settings(SESSION_ENGINE=engine):
+                client = Client()
+                client.force_login(user, backend="django.contrib.auth.backends.ModelBackend")
+                for endpoint in ENDPOINTS:
+                    # Warm up the session, identity and query caches
+                    client.get(endpoint)
+                    latencies, statuses, queries = [], [], 0
+                    start = time.perf_counter()
+                    for _ in range(options["requests"]):
+                        if mode == "db":
+                            invalidate_user(user.pk)
+                        with CaptureQueriesContext(connection) as captured:
+                            request_start = time.perf_counter()
+                            response = client.get(endpoint)
+                            latencies.append(time.perf_counter() - request_start)
+                        statuses.append(response.status_code)
+                        queries += len(captured)
+                    run = summarize(latencies, statuses, time.perf_counter() - start, 1)
+                    run["queries_per_request"] = round(queries / options["requests"], 2)
+                    report[mode][endpoint] = run
+                    self.stderr.write(
+                        f"{mode:6} {endpoint:20} {run['queries_per_request']:>5} queries/req  "
+                        f"p50={run['p50_ms']}ms  p99={run['p99_ms']}ms"
+                    )
+                client.logout()
+
+        report["queries_saved_per_request"] = {
+            endpoint: round(
+                report["db"][endpoint]["queries_per_request"] - report["cached"][endpoint]["queries_per_request"], 2
+            )
+            for endpoint in ENDPOINTS
+        }
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
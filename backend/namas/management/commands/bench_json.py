@@ -0,0 +1,119 @@
+import json
+import platform
+import timeit
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from rest_framework import serializers
+
+from namas.analytics import popular_beads, units_sold
+from namas.catalog import HIDDEN_CATEGORIES, acatalog_facets, parse_filters
+from namas.functions import JSONArrayLength
+from namas.models import CartItem, Order, Product
+from namas.responses import dumps, orjson
+from namas.seed import SEED_USER_EMAIL
+from namas.serializers import CartItemSerializer, OrderSerializer, OrderSummarySerializer, ProductSerializer
+from namas.views import ORDER_MAX_PAGE_SIZE, PAGE_SIZE
+
+
+def _drf_representation(serializer_class, objects):
+    # The objects rendered by DRF's own Serializer.to_representation, as before FastRepresentationMixin
+    serializer = serializer_class()
+    return [serializers.Serializer.to_representation(serializer, obj) for obj in objects]
+
+
+class Command(BaseCommand):
+    help = (
+        "Time rendering and JSON-encoding the main response payloads against seeded data (see "
+        "seed_data): DRF's to_representation against the serializers' fast path, and Django's "
+        "JsonResponse encoding against the json and orjson backends of namas.responses"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=200, help="Runs per timing; the best of 5 is kept")
+        parser.add_argument("--output", help="Write the JSON report to this file instead of stdout")
+
+    def payloads(self):
+        # (label, serializer class, objects, wrap): `wrap` builds the response payload from the
+        # rendered objects, as the view does. Payloads without a serializer have no objects.
+        user = User.objects.filter(username=SEED_USER_EMAIL.format(0)).first()
+        if user is None:
+            raise CommandError("No seeded data, run python3 manage.py seed_data first.")
+        listed = Product.objects.exclude(category__in=HIDDEN_CATEGORIES).order_by("-created_at", "product_id")
+        custom = Product.objects.filter(category=Product.CUSTOMIZED_BRACELET).order_by("product_id")
+        orders = Order.objects.filter(user=user).order_by("-created_at", "-order_id")[:ORDER_MAX_PAGE_SIZE]
+        summaries = orders.values("order_id", "amount", "status", "created_at").annotate(item_count=JSONArrayLength("items"))
+        cart_items = CartItem.objects.filter(cart__user__username__startswith="seed-user-").with_product()[:20]
+        since = timezone.now() - timedelta(days=365)
+        return [
+            ("products page", ProductSerializer, list(listed[:PAGE_SIZE]),
+             lambda data: {"success": True, "products": data, "next_cursor": None, "total": 1000, "pages": 100}),
+            ("custom bracelets", ProductSerializer, list(custom[:50]),
+             lambda data: {"success": True, "products": data, "next_cursor": None}),
+            ("cart", CartItemSerializer, list(cart_items), lambda data: {"success": True, "cart_items": data}),
+            ("order history", OrderSerializer, list(orders),
+             lambda data: {"success": True, "orders": data, "next_cursor": None}),
+            ("order summaries", OrderSummarySerializer, list(summaries),
+             lambda data: {"success": True, "orders": data, "next_cursor": None}),
+            ("facets", None, None, lambda data: async_to_sync(acatalog_facets)(parse_filters({}))),
+            ("analytics", None, None, lambda data: {"success": True, "products": units_sold(since), "beads": popular_beads(since)}),
+        ]
+
+    def best(self, function, iterations):
+        # Microseconds per call, best of 5 runs
+        return round(min(timeit.repeat(function, number=iterations, repeat=5)) / iterations * 1e6, 1)
+
+    def handle(self, *args, **options):
+        iterations = options["iterations"]
+        report = {}
+        for label, serializer_class, objects, wrap in self.payloads():
+            run = {}
+            if serializer_class is not None:
+                rendered = serializer_class(objects, many=True).data
+                run["objects"] = len(objects)
+                run["same_representation"] = list(rendered) == _drf_representation(serializer_class, objects)
+                run["render_drf_us"] = self.best(lambda: _drf_representation(serializer_class, objects), iterations)
+                run["render_us"] = self.best(lambda: serializer_class(objects, many=True).data, iterations)
+            else:
+                rendered = None
+            # Evaluated once: the timings cover the encoding only
+            payload = wrap(rendered)
+
+            django_bytes = json.dumps(payload, cls=DjangoJSONEncoder).encode()
+            run["django_bytes"] = len(django_bytes)
+            run["bytes"] = len(dumps(payload, backend="json"))
+            # What Django's JsonResponse wrote, against both backends of namas.responses
+            run["encode_django_us"] = self.best(lambda: json.dumps(payload, cls=DjangoJSONEncoder).encode(), iterations)
+            run["encode_json_us"] = self.best(lambda: dumps(payload, backend="json"), iterations)
+            if orjson is not None:
+                run["encode_orjson_us"] = self.best(lambda: dumps(payload, backend="orjson"), iterations)
+                run["same_bytes"] = dumps(payload, backend="orjson") == dumps(payload, backend="json")
+                # Django's output with whitespace and \\u escapes, parsed back to the same values
+                run["same_values"] = json.loads(dumps(payload, backend="orjson")) == json.loads(django_bytes)
+            report[label] = run
+            self.stderr.write(
+                f"{label:17} {run['bytes']:>8} bytes  "
+                + (f"render {run['render_drf_us']}us -> {run['render_us']}us  " if "render_us" in run else "")
+                + f"encode {run['encode_django_us']}us -> json {run['encode_json_us']}us"
+                + (f", orjson {run['encode_orjson_us']}us" if "encode_orjson_us" in run else "")
+            )
+
+        result = {
+            "meta": {
+                "created_at": timezone.now().isoformat(),
+                "iterations": iterations,
+                "python": platform.python_version(),
+                "orjson": orjson.__version__ if orjson is not None else None,
+            },
+            "payloads": report,
+        }
+        output = json.dumps(result, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
@@ -0,0 +1,33 @@
+import os
+
+from django.core.management.base import BaseCommand
+
+from namas.images import refresh_variants, variants_match
+from namas.models import ProductImage
+
+
+class Command(BaseCommand):
+    help = "Generate the resized WebP/JPEG copies of the product images that are missing them"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers", type=int, default=os.cpu_count(),
+            help="Number of processes resizing images in parallel (default: one per CPU)",
+        )
+        parser.add_argument("--batch-size", type=int, default=200, help="Images handed to the process pool at once")
+        parser.add_argument("--force", action="store_true", help="Regenerate every copy, even the up-to-date ones")
+
+    def handle(self, *args, **options):
+        batch, updated, seen = [], 0, 0
+        for image in ProductImage.objects.exclude(image="").order_by("pk").iterator(chunk_size=options["batch_size"]):
+            if options["force"] or not variants_match(image):
+                batch.append(image)
+            if len(batch) >= options["batch_size"]:
+                seen += len(batch)
+                updated += refresh_variants(batch, workers=options["workers"], force=options["force"])
+                batch = []
+        if batch:
+            seen += len(batch)
+            updated += refresh_variants(batch, workers=options["workers"], force=options["force"])
+
+        self.stdout.write(self.style.SUCCESS(f"Processed {seen} images, updated the variants of {updated}."))
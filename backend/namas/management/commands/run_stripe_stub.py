@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from namas.stripe_stub import StubStripeServer
+
+
+class Command(BaseCommand):
+    help = "Serve a local stub of the Stripe PaymentIntent API; point STRIPE_API_BASE at it"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=12111)
+        parser.add_argument("--latency-ms", type=float, default=0, help="Delay added before every answer")
+        parser.add_argument("--error-rate", type=float, default=0, help="Share of requests answered with a 500 error")
+
+    def handle(self, *args, **options):
+        server = StubStripeServer(
+            options["host"], options["port"],
+            latency=options["latency_ms"] / 1000, error_rate=options["error_rate"],
+        )
+        self.stdout.write(f"Stub Stripe API listening on {server.url}, set STRIPE_API_BASE={server.url}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.stop()
@@ -0,0 +1,53 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from namas.seed import SEED_PASSWORD, SEED_STAFF_EMAIL, SEED_USER_EMAIL, Seeder, flush, seeded_users_exist
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a deterministic synthetic catalog with images, users, carts and orders at a configurable "
+        "scale, for load tests and benchmarks. Seeded accounts log in with the password "
+        f"{SEED_PASSWORD}: {SEED_USER_EMAIL.format('N')} and the staff account {SEED_STAFF_EMAIL}."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products-per-category", type=int, default=1000, help="Bracelets, necklaces and rings each")
+        parser.add_argument("--beads", type=int, default=60)
+        parser.add_argument("--custom-bracelets", type=int, default=100)
+        parser.add_argument("--images-per-product", type=int, default=2)
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument("--carts", type=int, default=1000, help="Users, from the first, with a filled cart")
+        parser.add_argument("--orders-per-user", type=int, default=3)
+        parser.add_argument("--heavy-users", type=int, default=5, help="Users, from the first, with a long order history")
+        parser.add_argument("--heavy-user-orders", type=int, default=300)
+        parser.add_argument("--seed", type=int, default=0, help="Random seed; the same seed gives the same data")
+        parser.add_argument(
+            "--flush", action="store_true",
+            help="Delete the whole catalog, every cart and order, and the seeded accounts first",
+        )
+
+    def handle(self, *args, **options):
+        if options["flush"]:
+            flush()
+        elif seeded_users_exist():
+            raise CommandError("The database is already seeded, pass --flush to seed it again.")
+        if options["heavy_users"] > options["users"] or options["carts"] > options["users"]:
+            raise CommandError("--heavy-users and --carts can't exceed --users.")
+
+        start = time.perf_counter()
+        counts = Seeder(options["seed"], log=self.stderr.write).run(
+            products_per_category=options["products_per_category"],
+            beads=options["beads"],
+            custom_bracelets=options["custom_bracelets"],
+            images_per_product=options["images_per_product"],
+            users=options["users"],
+            carts=options["carts"],
+            orders_per_user=options["orders_per_user"],
+            heavy_users=options["heavy_users"],
+            heavy_user_orders=options["heavy_user_orders"],
+        )
+        counts["seconds"] = round(time.perf_counter() - start, 2)
+        self.stdout.write(json.dumps(counts))
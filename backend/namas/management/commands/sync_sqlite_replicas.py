@@ -0,0 +1,47 @@
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy the SQLite primary database into the SQLite read replicas listed in DJANGO_DB_REPLICAS, "
+        "once or every --interval seconds, to stand in for replication when developing locally"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--interval", type=float, default=0,
+            help="Copy again every this many seconds, simulating replication lag; 0 copies once",
+        )
+
+    def handle(self, *args, **options):
+        if not settings.DATABASE_REPLICAS:
+            raise CommandError("No read replicas configured, set DJANGO_DB_REPLICAS.")
+        for alias in ["default", *settings.DATABASE_REPLICAS]:
+            if connections[alias].vendor != "sqlite":
+                raise CommandError(f"Database {alias} is not SQLite.")
+
+        while True:
+            start = time.perf_counter()
+            # The backup API copies a consistent snapshot, even while the primary is being written to
+            primary = sqlite3.connect(connections["default"].settings_dict["NAME"])
+            try:
+                for alias in settings.DATABASE_REPLICAS:
+                    replica = sqlite3.connect(connections[alias].settings_dict["NAME"])
+                    try:
+                        primary.backup(replica)
+                    finally:
+                        replica.close()
+            finally:
+                primary.close()
+            self.stderr.write(
+                f"Copied the primary to {len(settings.DATABASE_REPLICAS)} replicas "
+                f"in {(time.perf_counter() - start) * 1000:.1f}ms"
+            )
+            if not options["interval"]:
+                break
+            time.sleep(options["interval"])
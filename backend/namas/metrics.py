@@ -0,0 +1,257 @@
+import contextvars
+import threading
+import time
+from bisect import bisect_left
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.utils.decorators import sync_and_async_middleware
+
+# Upper bounds of the histogram buckets: request duration in seconds and queries per request
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+# Time spent in each component of a request, in seconds, besides the database
+COMPONENTS = ("serialize", "payment")
+
+# Timings of the current request. Async ORM calls and sync_to_async run with a copy of the
+# context, which shares the same dict.
+_timings = contextvars.ContextVar("namas_timings", default=None)
+
+
+def _new_timings():
+    return {"db": 0.0, "queries": 0, **{component: 0.0 for component in COMPONENTS}, "_active": set()}
+
+
+def record(component, seconds):
+    # Add time to a component of the current request, if it is being measured
+    timings = _timings.get()
+    if timings is not None:
+        timings[component] += seconds
+
+
+class timed:
+    """Context manager timing a block as part of a component of the current request. Nested
+    blocks of the same component, e.g. a serializer rendering its nested serializers, are
+    counted once. A class rather than a generator: it runs once per serialized object."""
+
+    __slots__ = ("component", "timings", "start")
+
+    def __init__(self, component):
+        self.component = component
+        self.timings = None
+
+    def __enter__(self):
+        timings = _timings.get()
+        if timings is not None and self.component not in timings["_active"]:
+            timings["_active"].add(self.component)
+            self.timings = timings
+            self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        if self.timings is not None:
+            self.timings[self.component] += time.perf_counter() - self.start
+            self.timings["_active"].discard(self.component)
+
+
+def _time_query(execute, sql, params, many, context):
+    timings = _timings.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings["db"] += time.perf_counter() - start
+        timings["queries"] += 1
+
+
+def _install_query_timer(sender, connection, **kwargs):
+    if _time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_time_query)
+
+
+# Every connection is opened on the thread that uses it, so wrap each one as it is opened
+connection_created.connect(_install_query_timer)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # One count per bucket plus the +Inf bucket, not cumulative
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class EndpointStats:
+    def __init__(self):
+        self.duration = Histogram(DURATION_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.statuses = {}
+        self.db_seconds = 0.0
+        self.component_seconds = {component: 0.0 for component in COMPONENTS}
+        self.response_bytes = 0
+
+
+class MetricsRegistry:
+    """In-process aggregates of the measured requests, per endpoint (URL route) and method"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def observe(self, endpoint, method, status, duration, timings, size):
+        with self._lock:
+            stats = self._endpoints.get((endpoint, method))
+            if stats is None:
+                stats = self._endpoints[(endpoint, method)] = EndpointStats()
+            stats.duration.observe(duration)
+            stats.queries.observe(timings["queries"])
+            stats.statuses[status] = stats.statuses.get(status, 0) + 1
+            stats.db_seconds += timings["db"]
+            for component in COMPONENTS:
+                stats.component_seconds[component] += timings[component]
+            stats.response_bytes += size
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+
+    def snapshot(self):
+        # Copies of the aggregates, taken under the lock so rendering doesn't block requests
+        with self._lock:
+            return [
+                (endpoint, method, {
+                    "duration": (list(stats.duration.counts), stats.duration.sum),
+                    "queries": (list(stats.queries.counts), stats.queries.sum),
+                    "statuses": dict(stats.statuses),
+                    "db_seconds": stats.db_seconds,
+                    "component_seconds": dict(stats.component_seconds),
+                    "response_bytes": stats.response_bytes,
+                })
+                for (endpoint, method), stats in sorted(self._endpoints.items())
+            ]
+
+
+registry = MetricsRegistry()
+
+
+def _endpoint(request):
+    # The URL route rather than the path, so ids in paths don't create a series each
+    match = getattr(request, "resolver_match", None)
+    return match.route if match is not None else "unmatched"
+
+
+def _server_timing(timings, duration):
+    entries = [f'db;dur={timings["db"] * 1000:.2f};desc="{timings["queries"]} queries"']
+    entries += [
+        f"{component};dur={timings[component] * 1000:.2f}" for component in COMPONENTS if timings[component]
+    ]
+    entries.append(f"total;dur={duration * 1000:.2f}")
+    return ", ".join(entries)
+
+
+@sync_and_async_middleware
+def metrics_middleware(get_response):
+    """Measure every request: its duration, database queries and time, serialization and payment
+    provider time and response size. Adds a Server-Timing header and feeds the /metrics registry."""
+
+    def finish(request, response, timings, start):
+        duration = time.perf_counter() - start
+        size = 0 if response.streaming else len(response.content)
+        registry.observe(_endpoint(request), request.method, response.status_code, duration, timings, size)
+        if settings.METRICS_SERVER_TIMING:
+            response["Server-Timing"] = _server_timing(timings, duration)
+        return response
+
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            timings = _new_timings()
+            token = _timings.set(timings)
+            start = time.perf_counter()
+            try:
+                response = await get_response(request)
+            finally:
+                _timings.reset(token)
+            return finish(request, response, timings, start)
+    else:
+        def middleware(request):
+            timings = _new_timings()
+            token = _timings.set(timings)
+            start = time.perf_counter()
+            try:
+                response = get_response(request)
+            finally:
+                _timings.reset(token)
+            return finish(request, response, timings, start)
+
+    return middleware
+
+
+def _labels(**labels):
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def _histogram_lines(name, buckets, counts, total, labels):
+    lines = []
+    cumulative = 0
+    for bound, count in zip((*buckets, "+Inf"), counts):
+        cumulative += count
+        lines.append(f"{name}_bucket{_labels(**labels, le=bound)} {cumulative}")
+    lines.append(f"{name}_sum{_labels(**labels)} {total}")
+    lines.append(f"{name}_count{_labels(**labels)} {cumulative}")
+    return lines
+
+
+def _metric(lines, name, kind, help_text):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} {kind}")
+
+
+def render_metrics(extra=None):
+    """The registry in the Prometheus text exposition format. `extra` maps metric names to
+    (help, {label value: value}) gauges, e.g. from the payment gateway and cache counters."""
+    snapshot = registry.snapshot()
+    lines = []
+
+    _metric(lines, "namas_request_duration_seconds", "histogram", "Request duration, by endpoint.")
+    for endpoint, method, stats in snapshot:
+        counts, total = stats["duration"]
+        lines += _histogram_lines(
+            "namas_request_duration_seconds", DURATION_BUCKETS, counts, total, {"endpoint": endpoint, "method": method}
+        )
+    _metric(lines, "namas_request_queries", "histogram", "Database queries per request, by endpoint.")
+    for endpoint, method, stats in snapshot:
+        counts, total = stats["queries"]
+        lines += _histogram_lines(
+            "namas_request_queries", QUERY_BUCKETS, counts, total, {"endpoint": endpoint, "method": method}
+        )
+    _metric(lines, "namas_requests_total", "counter", "Requests, by endpoint and status code.")
+    for endpoint, method, stats in snapshot:
+        for status, count in sorted(stats["statuses"].items()):
+            lines.append(f"namas_requests_total{_labels(endpoint=endpoint, method=method, status=status)} {count}")
+    _metric(lines, "namas_request_db_seconds_total", "counter", "Time spent in database queries, by endpoint.")
+    for endpoint, method, stats in snapshot:
+        lines.append(f"namas_request_db_seconds_total{_labels(endpoint=endpoint, method=method)} {stats['db_seconds']}")
+    for component in COMPONENTS:
+        name = f"namas_request_{component}_seconds_total"
+        _metric(lines, name, "counter", f"Time spent in {component}, by endpoint.")
+        for endpoint, method, stats in snapshot:
+            lines.append(f"{name}{_labels(endpoint=endpoint, method=method)} {stats['component_seconds'][component]}")
+    _metric(lines, "namas_response_bytes_total", "counter", "Response body bytes, by endpoint.")
+    for endpoint, method, stats in snapshot:
+        lines.append(f"namas_response_bytes_total{_labels(endpoint=endpoint, method=method)} {stats['response_bytes']}")
+
+    for name, (help_text, values) in (extra or {}).items():
+        _metric(lines, name, "gauge", help_text)
+        for label, value in values.items():
+            if value is not None:
+                lines.append(f"{name}{_labels(stat=label)} {value}")
+    return "\n".join(lines) + "\n"
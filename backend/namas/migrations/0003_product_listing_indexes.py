@@ -0,0 +1,40 @@
+# Generated by Django 5.1.3 on 2026-10-18 10:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("namas", "0002_order_items_alter_order_shipping_address_and_more"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(
+                fields=["category", "inventory", "price", "product_id"],
+                name="product_cat_inv_price_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(
+                fields=["category", "inventory", "rating", "product_id"],
+                name="product_cat_inv_rating_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(
+                fields=["category", "inventory", "sales_count", "product_id"],
+                name="product_cat_inv_sales_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(
+                fields=["category", "inventory", "created_at", "product_id"],
+                name="product_cat_inv_created_idx",
+            ),
+        ),
+    ]
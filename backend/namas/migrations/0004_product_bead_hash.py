@@ -0,0 +1,68 @@
+# Generated by Django 5.1.3 on 2026-10-18 11:14
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def bead_sequence_hash(beads):
+    # Frozen copy of namas.models.bead_sequence_hash
+    sequence = "|".join(
+        str(bead_info.get("bead_id") if isinstance(bead_info, dict) else bead_info) for bead_info in beads
+    )
+    return hashlib.sha256(sequence.encode()).hexdigest()
+
+
+def merge_duplicate_bracelets(apps, schema_editor):
+    # Keep the oldest customized bracelet of each bead sequence, move the cart items of its
+    # duplicates onto it and delete the duplicates (their images are deleted with them)
+    Product = apps.get_model("namas", "Product")
+    CartItem = apps.get_model("namas", "CartItem")
+
+    groups = {}
+    bracelets = Product.objects.filter(category="customized_bracelet").order_by("created_at", "pk")
+    for product in bracelets.iterator():
+        if product.beads and isinstance(product.beads, list):
+            groups.setdefault(bead_sequence_hash(product.beads), []).append(product)
+
+    for bead_hash, (canonical, *duplicates) in groups.items():
+        if duplicates:
+            duplicate_ids = [product.pk for product in duplicates]
+            cart_items = {
+                item.cart_id: item for item in CartItem.objects.filter(product=canonical)
+            }
+            for item in CartItem.objects.filter(product_id__in=duplicate_ids):
+                existing = cart_items.get(item.cart_id)
+                if existing is None:
+                    item.product = canonical
+                    item.save(update_fields=["product"])
+                    cart_items[item.cart_id] = item
+                else:
+                    existing.quantity += item.quantity
+                    existing.save(update_fields=["quantity"])
+                    item.delete()
+            # Leave room for the largest merged cart item, so no cart holds more than the inventory
+            canonical.inventory = max(
+                sum(product.inventory for product in [canonical, *duplicates]),
+                max((item.quantity for item in cart_items.values()), default=0),
+            )
+            Product.objects.filter(pk__in=duplicate_ids).delete()
+        canonical.bead_hash = bead_hash
+        canonical.save(update_fields=["bead_hash", "inventory"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("namas", "0003_product_listing_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="bead_hash",
+            field=models.CharField(
+                blank=True, editable=False, max_length=64, null=True, unique=True
+            ),
+        ),
+        migrations.RunPython(merge_duplicate_bracelets, migrations.RunPython.noop),
+    ]
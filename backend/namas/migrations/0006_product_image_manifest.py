@@ -0,0 +1,44 @@
+# Generated by Django 5.1.3 on 2026-10-18 11:18
+
+from django.db import migrations, models
+
+
+def backfill_image_manifests(apps, schema_editor):
+    # Copy every product's images, in upload order, onto the product
+    Product = apps.get_model("namas", "Product")
+    ProductImage = apps.get_model("namas", "ProductImage")
+
+    manifests = {}
+    for image in ProductImage.objects.order_by("pk").iterator():
+        if image.image:
+            manifests.setdefault(image.product_id, []).append(
+                {"url": image.image.url, "variants": image.variants}
+            )
+
+    products = [
+        Product(pk=product_id, primary_image=manifest[0]["url"], image_manifest=manifest)
+        for product_id, manifest in manifests.items()
+    ]
+    Product.objects.bulk_update(products, ["primary_image", "image_manifest"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("namas", "0005_productimage_variants"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="image_manifest",
+            field=models.JSONField(blank=True, default=list, editable=False),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="primary_image",
+            field=models.CharField(
+                blank=True, default="", editable=False, max_length=255
+            ),
+        ),
+        migrations.RunPython(backfill_image_manifests, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.1.3 on 2026-10-18 11:19
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("namas", "0006_product_image_manifest"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(
+                fields=["user", "-created_at", "-order_id"],
+                name="order_user_created_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.3 on 2026-10-18 11:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("namas", "0008_orderitem"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="cart",
+            name="payment_intent_client_secret",
+            field=models.CharField(
+                blank=True, default="", editable=False, max_length=255
+            ),
+        ),
+        migrations.AddField(
+            model_name="cart",
+            name="payment_intent_id",
+            field=models.CharField(
+                blank=True, default="", editable=False, max_length=255
+            ),
+        ),
+        migrations.AddField(
+            model_name="cart",
+            name="payment_intent_key",
+            field=models.CharField(
+                blank=True, default="", editable=False, max_length=64
+            ),
+        ),
+    ]
@@ -0,0 +1,55 @@
+from django.db import migrations
+
+# Frozen copies of namas.search.FTS_TABLE and FULLTEXT_INDEX
+FTS_TABLE = "namas_product_fts"
+FULLTEXT_INDEX = "product_name_description_ft"
+
+
+def fts_rowid(product_id):
+    # Frozen copy of namas.search.fts_rowid
+    return product_id.int & ((1 << 63) - 1)
+
+
+def create_search_index(apps, schema_editor):
+    # SQLite: an FTS5 table filled from the existing products.
+    # MySQL: a FULLTEXT index on the product table, maintained by InnoDB.
+    connection = schema_editor.connection
+    if connection.vendor == "sqlite":
+        Product = apps.get_model("namas", "Product")
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+            "product_id UNINDEXED, name, description, tokenize = 'porter unicode61')"
+        )
+        rows = [
+            (fts_rowid(product_id), product_id.hex, name, description or "")
+            for product_id, name, description in Product.objects.values_list(
+                "product_id", "name", "description"
+            ).iterator()
+        ]
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO {FTS_TABLE} (rowid, product_id, name, description) VALUES (%s, %s, %s, %s)",
+                rows,
+            )
+    elif connection.vendor == "mysql":
+        schema_editor.execute(
+            f"CREATE FULLTEXT INDEX {FULLTEXT_INDEX} ON namas_product (name, description)"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == "sqlite":
+        schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+    elif connection.vendor == "mysql":
+        schema_editor.execute(f"DROP INDEX {FULLTEXT_INDEX} ON namas_product")
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("namas", "0009_cart_payment_intent"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,85 @@
+from datetime import datetime, timezone
+
+from django.db import migrations
+
+EMAIL_INDEX = "namas_auth_user_email_idx"
+
+
+def merge_accounts(apps, canonical, duplicate):
+    # Move the orders, cart, profile and social logins of `duplicate` onto `canonical` and delete it
+    Order = apps.get_model("namas", "Order")
+    Cart = apps.get_model("namas", "Cart")
+    CartItem = apps.get_model("namas", "CartItem")
+    Profile = apps.get_model("namas", "Profile")
+    UserSocialAuth = apps.get_model("social_django", "UserSocialAuth")
+
+    Order.objects.filter(user=duplicate).update(user=canonical)
+    UserSocialAuth.objects.filter(user=duplicate).update(user=canonical)
+    if not Profile.objects.filter(user=canonical).exists():
+        Profile.objects.filter(user=duplicate).update(user=canonical)
+    cart = Cart.objects.filter(user=duplicate).first()
+    if cart is not None:
+        target = Cart.objects.filter(user=canonical).first()
+        if target is None:
+            Cart.objects.filter(pk=cart.pk).update(user=canonical)
+        else:
+            existing_items = {item.product_id: item for item in CartItem.objects.filter(cart=target)}
+            for item in CartItem.objects.filter(cart=cart):
+                existing = existing_items.get(item.product_id)
+                if existing is not None:
+                    existing.quantity += item.quantity
+                    existing.save(update_fields=["quantity"])
+                else:
+                    item.cart = target
+                    item.save(update_fields=["cart"])
+    duplicate.delete()
+
+
+def normalize_account_emails(apps, schema_editor):
+    # Lower-case the usernames and emails of existing accounts, so existence checks and logins
+    # can use exact, indexed lookups. Login always lower-cases the email, so accounts differing
+    # only in case are merged into one: the one last logged into, whose password its owner uses,
+    # keeps the orders, cart and social logins of the others.
+    User = apps.get_model("auth", "User")
+    groups = {}
+    for user in User.objects.order_by("pk").iterator():
+        groups.setdefault(user.username.lower(), []).append(user)
+
+    for username, users in groups.items():
+        if len(users) > 1:
+            epoch = datetime.min.replace(tzinfo=timezone.utc)
+            users.sort(key=lambda user: (user.last_login or epoch, user.date_joined), reverse=True)
+            for duplicate in users[1:]:
+                # Reported like the migrate command reports its progress
+                print(f"\n  Merged account {duplicate.username!r} (id {duplicate.pk}) into id {users[0].pk}", end="")
+                merge_accounts(apps, users[0], duplicate)
+        user = users[0]
+        email = user.email.lower()
+        if (username, email) != (user.username, user.email):
+            user.username, user.email = username, email
+            user.save(update_fields=["username", "email"])
+
+
+def create_email_index(apps, schema_editor):
+    # Index auth_user.email for the existence check of accounts created by the social login
+    schema_editor.execute(f"CREATE INDEX {EMAIL_INDEX} ON auth_user (email)")
+
+
+def drop_email_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "mysql":
+        schema_editor.execute(f"DROP INDEX {EMAIL_INDEX} ON auth_user")
+    else:
+        schema_editor.execute(f"DROP INDEX {EMAIL_INDEX}")
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("auth", "0012_alter_user_first_name_max_length"),
+        ("social_django", "0001_initial"),
+        ("namas", "0010_product_search_index"),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_account_emails, migrations.RunPython.noop),
+        migrations.RunPython(create_email_index, drop_email_index),
+    ]
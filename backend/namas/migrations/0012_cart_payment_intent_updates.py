@@ -0,0 +1,18 @@
+# Generated by Django 5.1.3 on 2026-10-18 12:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("namas", "0011_normalize_account_emails"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="cart",
+            name="payment_intent_updates",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
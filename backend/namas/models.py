@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import User
+import hashlib
 import uuid
 from django.core.exceptions import ValidationError
 
@@ -15,6 +16,14 @@ class Profile(models.Model):
     zip_code = models.CharField(max_length=10)
     telephone = models.CharField(max_length=15)
 
+def bead_sequence_hash(beads):
+    """Canonical hash of a customized bracelet's ordered bead sequence"""
+    # Legacy bead entries that aren't dicts are hashed as they are
+    sequence = "|".join(
+        str(bead_info.get('bead_id') if isinstance(bead_info, dict) else bead_info) for bead_info in beads
+    )
+    return hashlib.sha256(sequence.encode()).hexdigest()
+
 class Product(models.Model):
     """Product Table"""
 
@@ -45,6 +54,25 @@ class Product(models.Model):
 
     # Using JSONField to store beads and their order for customization
     beads = models.JSONField(default=list, blank=True)  # Store bead UUIDs and order
+    # Hash of the bead sequence of a customized bracelet, so each design is stored only once
+    bead_hash = models.CharField(max_length=64, unique=True, null=True, blank=True, editable=False)
+
+    # Denormalized copies of the product's images, kept up to date by the ProductImage signals
+    # so reading a product never has to join its images.
+    # URL of the first image
+    primary_image = models.CharField(max_length=255, blank=True, default="", editable=False)
+    # The images in upload order, [{"url": ..., "variants": ...}]
+    image_manifest = models.JSONField(default=list, blank=True, editable=False)
+
+    class Meta:
+        # Composite indexes backing the keyset pagination of the product listing,
+        # one per sort key with product_id as the tie-breaker
+        indexes = [
+            models.Index(fields=["category", "inventory", "price", "product_id"], name="product_cat_inv_price_idx"),
+            models.Index(fields=["category", "inventory", "rating", "product_id"], name="product_cat_inv_rating_idx"),
+            models.Index(fields=["category", "inventory", "sales_count", "product_id"], name="product_cat_inv_sales_idx"),
+            models.Index(fields=["category", "inventory", "created_at", "product_id"], name="product_cat_inv_created_idx"),
+        ]
 
     # make sure price is a number >= 0
     def clean(self):
@@ -52,27 +80,36 @@ class Product(models.Model):
 
         # Check if the product category is "CUSTOMIZE_BRACELET"
         if self.category == Product.CUSTOMIZED_BRACELET:
-            # Ensure that beads are provided and the list has exactly 12 beads
-            if not self.beads or len(self.beads) != 12:
-                raise ValidationError({'beads': "Customized bracelets must have exactly 12 beads."})
-
-            # validate that each bead is valid (i.e., exists in the Bead table)
-            for bead_info in self.beads:
-                try:
-                    bead = Product.objects.get(product_id=bead_info['bead_id'], category=Product.BEAD)
-                except Product.DoesNotExist:
-                    raise ValidationError({'beads': f"Bead with ID {bead_info['bead_id']} does not exist or is not a valid bead."})
+            # Ensure that there are exactly 12 beads and that each one is a valid bead,
+            # using the in-process bead registry instead of one query per bead
+            from .beads import bead_registry
+            bead_registry.validate(self.beads)
 
         # Validate price to be non-negative
         if self.price < 0:
             raise ValidationError({'price': "Price must be a positive number."})
 
+    @property
+    def made_to_order(self):
+        # Customized bracelets are made to order: identical designs share one product, so its
+        # inventory only caps the quantity of a cart item and checkout never decrements it
+        return self.category == Product.CUSTOMIZED_BRACELET
+
     def save(self, *args, **kwargs):
+        # Identify customized bracelets by their bead sequence, recomputed so edited beads never keep a stale hash
+        if self.category == Product.CUSTOMIZED_BRACELET and self.beads:
+            self.bead_hash = bead_sequence_hash(self.beads)
+        else:
+            self.bead_hash = None
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and {"beads", "category"} & set(update_fields):
+            kwargs["update_fields"] = {*update_fields, "bead_hash"}
+
         # Save the product first to ensure it has a product ID
         super().save(*args, **kwargs)
 
         # Check if the product is a CUSTOMIZED_BRACELET and has no images
-        if self.category == Product.CUSTOMIZED_BRACELET and not self.images.exists():
+        if self.category == Product.CUSTOMIZED_BRACELET and not self.image_manifest and not self.images.exists():
             # Add a default image
             ProductImage.objects.create(
                 product=self,
@@ -87,6 +124,8 @@ class ProductImage(models.Model):
     )
     image = models.ImageField(upload_to="product_images/")
     uploaded_at = models.DateTimeField(auto_now_add=True)
+    # Resized copies of the image, {extension: {width: storage name}}, see namas.images
+    variants = models.JSONField(default=dict, blank=True, editable=False)
 
 class Cart(models.Model):
     """Cart Table"""
@@ -97,6 +136,18 @@ class Cart(models.Model):
         related_name="cart", 
         on_delete=models.CASCADE
     )
+    # The Stripe PaymentIntent of the cart, reused until the cart contents change, see namas.payments
+    payment_intent_id = models.CharField(max_length=255, blank=True, default="", editable=False)
+    payment_intent_client_secret = models.CharField(max_length=255, blank=True, default="", editable=False)
+    # Hash of the cart contents the PaymentIntent was created or last updated for
+    payment_intent_key = models.CharField(max_length=64, blank=True, default="", editable=False)
+    # Number of amount updates sent for the PaymentIntent, part of their idempotency keys
+    payment_intent_updates = models.PositiveIntegerField(default=0, editable=False)
+
+class CartItemQuerySet(models.QuerySet):
+    def with_product(self):
+        # Join the product, which carries its image manifest, so serializing a cart costs one query
+        return self.select_related("product")
 
 class CartItem(models.Model):
     """Cart Item Table"""
@@ -105,6 +156,8 @@ class CartItem(models.Model):
         Product, related_name="cart_items", on_delete=models.CASCADE
     )
     quantity = models.IntegerField(default=0)
+
+    objects = CartItemQuerySet.as_manager()
     
 class Order(models.Model):
     """Order Table"""
@@ -127,13 +180,50 @@ class Order(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     items = models.JSONField(default=list)  # Store product ID, name, image, quantity, and price
 
+    class Meta:
+        # Backs the cursor pagination of a user's order history, newest first
+        indexes = [
+            models.Index(fields=["user", "-created_at", "-order_id"], name="order_user_created_idx"),
+        ]
+
+
+class OrderItem(models.Model):
+    """Order Item Table
 
-# class OrderItem(models.Model):
-#     """Order Item Table"""
+    One row per line of Order.items, written at checkout so sales can be aggregated in SQL.
+    The JSON snapshot stays the source for displaying an order."""
 
-#     order = models.ForeignKey(Order, on_delete=models.CASCADE)
-#     product = models.ForeignKey(
-#         Product, related_name="order_items", on_delete=models.CASCADE
-#     )
-#     quantity = models.IntegerField()
-#     price = models.DecimalField(max_digits=10, decimal_places=2)
\ No newline at end of file
+    order_item_id = models.UUIDField(primary_key=True, default=uuid.uuid4)
+    order = models.ForeignKey(Order, related_name="lines", on_delete=models.CASCADE)
+    # Kept when the product is deleted; the name and price are copied from the snapshot
+    product = models.ForeignKey(
+        Product, related_name="order_items", null=True, on_delete=models.SET_NULL
+    )
+    name = models.CharField(max_length=255)
+    quantity = models.IntegerField()
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    # Copied from the order so date-range aggregates don't have to join it
+    created_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["product", "created_at"], name="orderitem_product_created_idx"),
+            models.Index(fields=["created_at"], name="orderitem_created_idx"),
+        ]
+
+class OrderItemBead(models.Model):
+    """Order Item Bead Table, the beads of an ordered customized bracelet in their order"""
+
+    order_item = models.ForeignKey(OrderItem, related_name="beads", on_delete=models.CASCADE)
+    bead = models.ForeignKey(
+        Product, related_name="ordered_as_bead", null=True, on_delete=models.SET_NULL
+    )
+    position = models.PositiveSmallIntegerField()
+    # Copied from the order item for the same reason
+    quantity = models.IntegerField()
+    created_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["bead", "created_at"], name="orderitembead_bead_created_idx"),
+        ]
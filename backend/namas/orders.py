@@ -0,0 +1,56 @@
+import uuid
+from decimal import Decimal, InvalidOperation
+
+from .models import OrderItem, OrderItemBead, Product
+
+
+def _uuid(value):
+    # Parse an id from an order snapshot, or None if it is not a valid UUID
+    try:
+        return uuid.UUID(str(value))
+    except ValueError:
+        return None
+
+
+def write_order_lines(orders):
+    """Write the OrderItem and OrderItemBead rows of the given orders from their items snapshot.
+    Products deleted since the order was placed are stored as NULL. Costs three queries."""
+    snapshots = []
+    referenced = set()
+    for order in orders:
+        for item in order.items or []:
+            product_id = _uuid(item.get("product_id"))
+            bead_ids = [_uuid(bead.get("bead_id")) for bead in item.get("beads") or [] if isinstance(bead, dict)]
+            referenced.add(product_id)
+            referenced.update(bead_ids)
+            snapshots.append((order, item, product_id, bead_ids))
+    referenced.discard(None)
+    existing = set(Product.objects.filter(pk__in=referenced).values_list("pk", flat=True))
+
+    lines, beads = [], []
+    for order, item, product_id, bead_ids in snapshots:
+        try:
+            price = Decimal(str(item.get("price")))
+        except InvalidOperation:
+            price = Decimal("0")
+        line = OrderItem(
+            order=order,
+            product_id=product_id if product_id in existing else None,
+            name=item.get("name") or "",
+            quantity=item.get("quantity") or 0,
+            price=price,
+            created_at=order.created_at,
+        )
+        lines.append(line)
+        for position, bead_id in enumerate(bead_ids):
+            beads.append(OrderItemBead(
+                order_item=line,
+                bead_id=bead_id if bead_id in existing else None,
+                position=position,
+                quantity=line.quantity,
+                created_at=order.created_at,
+            ))
+
+    OrderItem.objects.bulk_create(lines)
+    OrderItemBead.objects.bulk_create(beads)
+    return len(lines)
@@ -0,0 +1,166 @@
+import base64
+import binascii
+import json
+import uuid
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from django.db.models import Q
+
+# Fields the product listing can be sorted by; product_id is always used as the tie-breaker
+SORT_FIELDS = ("price", "rating", "sales_count", "created_at")
+# Sort fields that may hold NULL (sorted first in ascending and last in descending order)
+NULLABLE_SORT_FIELDS = ("rating",)
+
+
+class InvalidCursor(ValueError):
+    """Raised when a cursor cannot be decoded or does not match the requested sort"""
+
+
+def _as_str(value):
+    # Cursor fields are written as strings; anything else in a cursor was tampered with
+    if not isinstance(value, str):
+        raise TypeError("Cursor fields must be strings.")
+    return value
+
+
+def order_products(products, sort_by, order):
+    # Sort by the requested field and break ties with the primary key in the same direction
+    if order == "asc":
+        return products.order_by(sort_by, "product_id")
+    return products.order_by(f"-{sort_by}", "-product_id")
+
+
+def encode_cursor(product, sort_by, order):
+    # Encode the sort key of the last product on a page into an opaque token
+    value = getattr(product, sort_by)
+    if value is not None:
+        value = value.isoformat() if hasattr(value, "isoformat") else str(value)
+    payload = [sort_by, order, value, str(product.product_id)]
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _parse_datetime(value):
+    # A timezone-aware ISO 8601 datetime, as written by isoformat()
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        raise ValueError("Naive datetime.")
+    return parsed
+
+
+def _parse_decimal(value):
+    parsed = Decimal(value)
+    if not parsed.is_finite():
+        raise ValueError("Non-finite decimal.")
+    return parsed
+
+
+# Parse a sort value of a cursor back into the type of its field
+SORT_VALUE_PARSERS = {
+    "price": _parse_decimal,
+    "rating": _parse_decimal,
+    "sales_count": int,
+    "created_at": _parse_datetime,
+}
+
+
+def decode_cursor(cursor, sort_by, order):
+    # Decode a token produced by encode_cursor, checking it belongs to the same sort and
+    # holds a value of the sort field's type and a product UUID
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        cursor_sort_by, cursor_order, value, product_id = json.loads(
+            base64.urlsafe_b64decode(padded.encode())
+        )
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError):
+        raise InvalidCursor("Invalid cursor.")
+    if cursor_sort_by != sort_by or cursor_order != order:
+        raise InvalidCursor("Cursor does not match the requested sort order.")
+    try:
+        if value is None:
+            if sort_by not in NULLABLE_SORT_FIELDS:
+                raise ValueError("Missing sort value.")
+        else:
+            value = SORT_VALUE_PARSERS[sort_by](_as_str(value))
+        product_id = uuid.UUID(_as_str(product_id))
+    except (ValueError, TypeError, InvalidOperation):
+        raise InvalidCursor("Invalid cursor.")
+    return value, product_id
+
+
+def after_cursor(products, sort_by, order, cursor):
+    # Keep only the products that come after the cursor in the given ordering,
+    # so the page is read with an index range scan instead of an OFFSET
+    value, product_id = decode_cursor(cursor, sort_by, order)
+    lookup = "gt" if order == "asc" else "lt"
+    nullable = sort_by in NULLABLE_SORT_FIELDS
+
+    if value is None:
+        # The cursor sits inside the block of NULL values
+        condition = Q(**{f"{sort_by}__isnull": True, f"product_id__{lookup}": product_id})
+        if order == "asc":
+            condition |= Q(**{f"{sort_by}__isnull": False})
+    else:
+        condition = Q(**{f"{sort_by}__{lookup}": value}) | Q(
+            **{sort_by: value, f"product_id__{lookup}": product_id}
+        )
+        if nullable and order != "asc":
+            condition |= Q(**{f"{sort_by}__isnull": True})
+
+    return products.filter(condition)
+
+
+def order_orders(orders):
+    # Newest orders first, with the primary key as the tie-breaker
+    return orders.order_by("-created_at", "-order_id")
+
+
+def encode_order_cursor(created_at, order_id):
+    # Encode the position of the last order on a page of the order history
+    payload = ["orders", created_at.isoformat(), str(order_id)]
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_order_cursor(cursor):
+    # Decode a token produced by encode_order_cursor
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        kind, created_at, order_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError):
+        raise InvalidCursor("Invalid cursor.")
+    if kind != "orders":
+        raise InvalidCursor("Invalid cursor.")
+    try:
+        created_at = _parse_datetime(_as_str(created_at))
+        order_id = uuid.UUID(_as_str(order_id))
+    except (ValueError, TypeError):
+        raise InvalidCursor("Invalid cursor.")
+    return created_at, order_id
+
+
+def after_order_cursor(orders, cursor):
+    # Keep only the orders placed before the cursor, read with a range scan of the (user, created_at) index
+    created_at, order_id = decode_order_cursor(cursor)
+    return orders.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, order_id__lt=order_id))
+
+
+def encode_search_cursor(score, product_id):
+    # Encode the rank of the last product on a page of search results
+    payload = ["search", score, product_id]
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_search_cursor(cursor):
+    # Decode a token produced by encode_search_cursor into (score, product_id)
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        kind, score, product_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        score = float(score)
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError):
+        raise InvalidCursor("Invalid cursor.")
+    if kind != "search" or not isinstance(product_id, str):
+        raise InvalidCursor("Invalid cursor.")
+    return score, product_id
@@ -0,0 +1,89 @@
+import hashlib
+import logging
+
+import stripe
+
+from .gateway import payment_gateway
+from .models import Cart, CartItem
+
+logger = logging.getLogger(__name__)
+
+CURRENCY = "usd"
+
+
+def cart_payment(cart):
+    """Compute the amount in cents and a hash of the contents of a cart in one query,
+    from the server-side prices. Returns (0, None) for an empty cart."""
+    rows = list(
+        CartItem.objects.filter(cart=cart)
+        .order_by("pk")
+        .values_list("pk", "product_id", "quantity", "product__price")
+    )
+    if not rows:
+        return 0, None
+    amount = sum(int(price * 100) * quantity for _, _, quantity, price in rows)
+    # The cart item ids make the hash differ from an earlier, already paid cart with the same products
+    contents = "|".join(
+        f"{pk}:{product_id}:{quantity}:{price}" for pk, product_id, quantity, price in rows
+    )
+    return amount, hashlib.sha256(contents.encode()).hexdigest()
+
+
+def get_or_create_payment_intent(cart):
+    """Return the client secret of the cart's PaymentIntent, creating it on first use and
+    updating its amount when the cart contents changed. Reloading the checkout page with the
+    same cart makes no Stripe call. Raises ValueError for an empty cart, stripe.StripeError
+    when Stripe fails and GatewayUnavailable when the gateway refuses to call it."""
+    amount, key = cart_payment(cart)
+    if key is None:
+        raise ValueError("Cart is empty.")
+    if cart.payment_intent_id and cart.payment_intent_key == key:
+        return cart.payment_intent_client_secret
+
+    intent = None
+    updates = cart.payment_intent_updates
+    if cart.payment_intent_id:
+        # Keyed by the update count too: a cart going back to earlier contents (2 -> 3 -> 2 -> 3)
+        # must send a new update, not have Stripe replay the first one and keep the stale amount.
+        # Concurrent loads of the same cart still share one update.
+        updates += 1
+        try:
+            intent = payment_gateway.update_payment_intent(
+                cart.payment_intent_id,
+                {"amount": amount},
+                f"pi-update-{cart.payment_intent_id}-{updates}-{key}",
+            )
+        except stripe.InvalidRequestError as e:
+            # The intent was paid or canceled meanwhile; start a new one
+            logger.info("Replacing PaymentIntent %s of cart %s: %s", cart.payment_intent_id, cart.pk, e)
+    if intent is None:
+        updates = 0
+        # Keyed by the cart contents, so concurrent loads of the same cart share one intent
+        intent = payment_gateway.create_payment_intent(
+            {
+                "amount": amount,
+                "currency": CURRENCY,
+                "automatic_payment_methods": {"enabled": True},
+                "metadata": {"cart_id": str(cart.pk)},
+            },
+            f"pi-create-{cart.pk}-{key}",
+        )
+
+    cart.payment_intent_id = intent.id
+    cart.payment_intent_client_secret = intent.client_secret
+    cart.payment_intent_key = key
+    cart.payment_intent_updates = updates
+    Cart.objects.filter(pk=cart.pk).update(
+        payment_intent_id=intent.id,
+        payment_intent_client_secret=intent.client_secret,
+        payment_intent_key=key,
+        payment_intent_updates=updates,
+    )
+    return intent.client_secret
+
+
+def clear_payment_intent(cart):
+    # Forget the cart's PaymentIntent once its order is placed, so the next checkout gets a new one
+    Cart.objects.filter(pk=cart.pk).update(
+        payment_intent_id="", payment_intent_client_secret="", payment_intent_key="", payment_intent_updates=0
+    )
@@ -0,0 +1,323 @@
+import contextvars
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import thread
+from functools import lru_cache
+
+from asgiref import current_thread_executor
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.utils import timezone
+from django.utils.decorators import sync_and_async_middleware
+
+from .identity import aget_identity, get_identity
+
+# Staff send this header, with any value but "0", to profile one request
+PROFILE_HEADER = "X-Profile"
+# Queries kept per capture; later ones are only counted
+MAX_QUERIES = 1000
+CAPTURE_ID = re.compile(r"^\d{8}T\d{12}-[0-9a-f]{8}$")
+# Where a sync_to_async thread starts running a function for a request, in its thread pool or in
+# the thread that called async_to_sync, and where the latter waits for the event loop
+_WORK_ITEM_CODES = {thread._WorkItem.run.__code__, current_thread_executor._WorkItem.run.__code__}
+_WAIT_CODE = current_thread_executor.CurrentThreadExecutor.run_until_future.__code__
+
+# The capture of the current request, shared with its sync_to_async threads
+_capture = contextvars.ContextVar("namas_profile_capture", default=None)
+_active_lock = threading.Lock()
+_active_count = 0
+
+
+@lru_cache(maxsize=None)
+def _short_path(filename):
+    # The path relative to the project or to the sys.path entry holding the file
+    for prefix in sorted((str(settings.BASE_DIR), *sys.path), key=len, reverse=True):
+        if prefix and filename.startswith(prefix + os.sep):
+            return filename[len(prefix) + 1:]
+    return filename
+
+
+def _label(frame):
+    code = frame.f_code
+    return f"{code.co_qualname} ({_short_path(code.co_filename)}:{frame.f_lineno})".replace(";", ":")
+
+
+def _stack(frame, root):
+    """The collapsed stack of `frame`, outermost first. On the thread the request entered the
+    middleware on, `root` is the middleware's frame and the stack starts there; None is returned
+    when that frame isn't on the stack, e.g. the event loop is running another request. On a
+    sync_to_async thread `root` is None and the stack starts at the function sync_to_async runs;
+    None is returned while the thread is idle or waiting for the event loop."""
+    labels = []
+    while frame is not None:
+        if root is None:
+            if frame.f_code in _WORK_ITEM_CODES:
+                break
+            if frame.f_code is _WAIT_CODE:
+                return None
+        labels.append(_label(frame))
+        if frame is root:
+            break
+        frame = frame.f_back
+    else:
+        return None
+    return ";".join(reversed(labels)) if labels else None
+
+
+class Capture:
+    """Samples the stacks of the threads serving one request every `interval` seconds from a
+    background thread, and records the SQL the request runs. Samples are wall-clock: time spent
+    waiting on the database or the payment provider shows under the call that waits."""
+
+    def __init__(self, trigger, interval):
+        now = timezone.now()
+        self.id = f"{now:%Y%m%dT%H%M%S%f}-{uuid.uuid4().hex[:8]}"
+        self.created_at = now
+        self.trigger = trigger
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.queries = []
+        self.query_count = 0
+        self.db_seconds = 0.0
+        # Thread id: the root frame of the request on that thread, see _stack
+        self.threads = {}
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, name=f"profiler-{self.id}", daemon=True)
+
+    def add_thread(self, thread_id, root=None):
+        self.threads[thread_id] = root
+
+    def start(self):
+        self.start_time = time.perf_counter()
+        self._sampler.start()
+
+    def stop(self):
+        self.duration = time.perf_counter() - self.start_time
+        self._stop.set()
+        self._sampler.join()
+        # Drop the frames, they hold on to the request's locals
+        self.threads.clear()
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id, root in list(self.threads.items()):
+                frame = frames.get(thread_id)
+                stack = _stack(frame, root) if frame is not None else None
+                if stack:
+                    self.stacks[stack] += 1
+            self.samples += 1
+            del frames
+
+    def add_query(self, sql, many, start, seconds):
+        self.query_count += 1
+        self.db_seconds += seconds
+        if len(self.queries) < MAX_QUERIES:
+            # The statement without its parameters, which may hold emails or password hashes
+            self.queries.append({
+                "sql": sql,
+                "many": many,
+                "at_ms": round((start - self.start_time) * 1000, 3),
+                "ms": round(seconds * 1000, 3),
+            })
+
+    def folded(self):
+        # One "frame;frame;frame count" line per distinct stack, as flamegraph.pl and speedscope read
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def _record_query(execute, sql, params, many, context):
+    capture = _capture.get()
+    if capture is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        capture.add_query(sql, many, start, time.perf_counter() - start)
+
+
+def _install_query_recorder(sender, connection, **kwargs):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+connection_created.connect(_install_query_recorder)
+
+
+def _acquire():
+    # At most PROFILING_MAX_ACTIVE requests are profiled at a time, each costs a sampler thread
+    global _active_count
+    with _active_lock:
+        if _active_count >= settings.PROFILING_MAX_ACTIVE:
+            return False
+        _active_count += 1
+        return True
+
+
+def _release():
+    global _active_count
+    with _active_lock:
+        _active_count -= 1
+
+
+def _wants_identity(request):
+    # The identity, for the staff check, is only loaded when the header asks for a profile
+    return request.headers.get(PROFILE_HEADER, "0") != "0"
+
+
+def _trigger(request, identity):
+    if identity and identity["is_staff"] and _wants_identity(request):
+        return "header"
+    rate = settings.PROFILING_SAMPLE_RATE
+    if rate and random.random() < rate:
+        return "sampled"
+    return None
+
+
+def _metadata(capture, request, response, identity):
+    match = getattr(request, "resolver_match", None)
+    return {
+        "id": capture.id,
+        "created_at": capture.created_at.isoformat(),
+        "trigger": capture.trigger,
+        "method": request.method,
+        "path": request.get_full_path(),
+        "route": match.route if match is not None else None,
+        "status": response.status_code,
+        "user_id": identity["id"] if identity else None,
+        "duration_ms": round(capture.duration * 1000, 3),
+        "interval_ms": capture.interval * 1000,
+        "samples": capture.samples,
+        "stacks": len(capture.stacks),
+        "query_count": capture.query_count,
+        "db_ms": round(capture.db_seconds * 1000, 3),
+    }
+
+
+def _path(capture_id, extension):
+    return os.path.join(settings.PROFILING_DIR, f"{capture_id}.{extension}")
+
+
+def store(capture, metadata):
+    """Write the capture as <id>.folded, the collapsed stacks, and <id>.json, the metadata and
+    the queries, then delete the oldest captures beyond PROFILING_MAX_CAPTURES"""
+    os.makedirs(settings.PROFILING_DIR, exist_ok=True)
+    with open(_path(capture.id, "folded"), "w") as f:
+        f.write(capture.folded())
+    # The metadata last: list_captures only shows captures whose .json exists
+    with open(_path(capture.id, "json"), "w") as f:
+        json.dump({**metadata, "queries": capture.queries}, f)
+    for capture_id in _capture_ids()[settings.PROFILING_MAX_CAPTURES:]:
+        for extension in ("json", "folded"):
+            try:
+                os.remove(_path(capture_id, extension))
+            except FileNotFoundError:
+                pass
+
+
+def _capture_ids():
+    # Newest first; the ids start with their UTC timestamp
+    try:
+        names = os.listdir(settings.PROFILING_DIR)
+    except FileNotFoundError:
+        return []
+    ids = [name[:-5] for name in names if name.endswith(".json") and CAPTURE_ID.match(name[:-5])]
+    return sorted(ids, reverse=True)
+
+
+def list_captures():
+    # The metadata of the stored captures, newest first
+    captures = []
+    for capture_id in _capture_ids():
+        capture = load_capture(capture_id)
+        if capture is not None:
+            capture.pop("queries")
+            captures.append(capture)
+    return captures
+
+
+def load_capture(capture_id):
+    if not CAPTURE_ID.match(capture_id):
+        return None
+    try:
+        with open(_path(capture_id, "json")) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def load_folded(capture_id):
+    if not CAPTURE_ID.match(capture_id):
+        return None
+    try:
+        with open(_path(capture_id, "folded")) as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+@sync_and_async_middleware
+def profiling_middleware(get_response):
+    """Profile a PROFILING_SAMPLE_RATE fraction of requests, and requests of staff users sending
+    the X-Profile header, and store the captures in PROFILING_DIR. The response of a profiled
+    request carries its capture id in X-Profile-Id, for /profiles/<id>."""
+
+    def begin(request, identity):
+        trigger = _trigger(request, identity)
+        if trigger is None or not _acquire():
+            return None, None
+        capture = Capture(trigger, settings.PROFILING_INTERVAL)
+        return capture, _capture.set(capture)
+
+    def end(capture, token):
+        try:
+            capture.stop()
+        finally:
+            _capture.reset(token)
+            _release()
+
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            identity = await aget_identity(request) if _wants_identity(request) else None
+            capture, token = begin(request, identity)
+            if capture is None:
+                return await get_response(request)
+            # The coroutines of the request run on this thread, and its sync code, including sync
+            # views and the async ORM, on the one thread sync_to_async gives this request
+            capture.add_thread(threading.get_ident(), sys._getframe())
+            capture.add_thread(await sync_to_async(threading.get_ident)())
+            capture.start()
+            try:
+                response = await get_response(request)
+            finally:
+                end(capture, token)
+            response["X-Profile-Id"] = capture.id
+            await sync_to_async(store)(capture, _metadata(capture, request, response, identity))
+            return response
+    else:
+        def middleware(request):
+            identity = get_identity(request) if _wants_identity(request) else None
+            capture, token = begin(request, identity)
+            if capture is None:
+                return get_response(request)
+            capture.add_thread(threading.get_ident(), sys._getframe())
+            capture.start()
+            try:
+                response = get_response(request)
+            finally:
+                end(capture, token)
+            response["X-Profile-Id"] = capture.id
+            store(capture, _metadata(capture, request, response, identity))
+            return response
+
+    return middleware
@@ -0,0 +1,108 @@
+import contextvars
+import random
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.utils.decorators import sync_and_async_middleware
+
+# Cookie keeping a client's reads on the primary for a while after it wrote, so it sees its own writes
+PIN_COOKIE = "namas_primary"
+# Apps always read from the primary: a session or user missing from a lagging replica would log the user out
+PRIMARY_APPS = {"auth", "sessions"}
+
+# Routing state of the current request: whether its view may read from a replica and whether it wrote.
+# Async ORM calls and sync_to_async run with a copy of the context, which shares the same dict.
+_routing = contextvars.ContextVar("namas_routing", default=None)
+
+
+class ReplicaRouter:
+    """Sends the reads of views marked with replica_reads to one of the DATABASE_REPLICAS and every
+    other query, including every write, to the primary"""
+
+    def db_for_read(self, model, **hints):
+        state = _routing.get()
+        if state is None or not state["replica"] or not settings.DATABASE_REPLICAS:
+            return None
+        if model._meta.app_label in PRIMARY_APPS:
+            return None
+        # Follow relations from the database the instance was loaded from
+        instance = hints.get("instance")
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        state = _routing.get()
+        if state is not None:
+            state["wrote"] = True
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replicas get their schema from the primary
+        return db not in settings.DATABASE_REPLICAS
+
+
+@sync_and_async_middleware
+def replica_routing_middleware(get_response):
+    """Track the routing state of each request and pin a client that wrote to the primary for
+    DATABASE_REPLICA_PIN_SECONDS"""
+
+    def start(request):
+        state = {"replica": False, "pinned": PIN_COOKIE in request.COOKIES, "wrote": False}
+        return _routing.set(state), state
+
+    def pin(state, response):
+        if state["wrote"] and settings.DATABASE_REPLICAS:
+            response.set_cookie(
+                PIN_COOKIE, "1", max_age=settings.DATABASE_REPLICA_PIN_SECONDS, httponly=True, samesite="Lax"
+            )
+        return response
+
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            token, state = start(request)
+            try:
+                response = await get_response(request)
+            finally:
+                _routing.reset(token)
+            return pin(state, response)
+    else:
+        def middleware(request):
+            token, state = start(request)
+            try:
+                response = get_response(request)
+            finally:
+                _routing.reset(token)
+            return pin(state, response)
+
+    return middleware
+
+
+def replica_reads(unless=None):
+    """Let a read-only view read from the replicas, unless its client wrote recently or
+    unless() returns True, e.g. while the replicas may still miss a change"""
+
+    def use_replica():
+        state = _routing.get()
+        if state is not None and not state["pinned"] and not (unless and unless()):
+            state["replica"] = True
+
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def inner(request, *args, **kwargs):
+                use_replica()
+                return await view(request, *args, **kwargs)
+        else:
+            @wraps(view)
+            def inner(request, *args, **kwargs):
+                use_replica()
+                return view(request, *args, **kwargs)
+        return inner
+
+    return decorator
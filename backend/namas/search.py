@@ -0,0 +1,95 @@
+import re
+
+from django.db import connection, connections, router
+
+from .catalog import HIDDEN_CATEGORIES
+from .models import Product
+
+# SQLite FTS5 table indexing the product names and descriptions. Its rowid is derived from
+# the product id so a product's row can be replaced without scanning the index.
+FTS_TABLE = "namas_product_fts"
+# MySQL FULLTEXT index over the same columns of the product table
+FULLTEXT_INDEX = "product_name_description_ft"
+# Matches in the name weigh this much more than matches in the description
+NAME_WEIGHT = 10.0
+# Longest search accepted, in words
+MAX_SEARCH_TERMS = 8
+
+
+def search_terms(query):
+    # Split a search into lower-case words, dropping punctuation and FTS operators
+    return re.findall(r"\w+", (query or "").lower())[:MAX_SEARCH_TERMS]
+
+
+def fts_rowid(product_id):
+    # A positive 63-bit integer derived from the product UUID
+    return product_id.int & ((1 << 63) - 1)
+
+
+def index_product(product):
+    index_products([product])
+
+
+def index_products(products):
+    # Add or replace products in the SQLite index; MySQL maintains its FULLTEXT index itself
+    if connection.vendor != "sqlite":
+        return
+    rows = [(fts_rowid(product.pk), product.pk.hex, product.name, product.description or "") for product in products]
+    with connection.cursor() as cursor:
+        cursor.executemany(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [row[:1] for row in rows])
+        cursor.executemany(
+            f"INSERT INTO {FTS_TABLE} (rowid, product_id, name, description) VALUES (%s, %s, %s, %s)",
+            rows,
+        )
+
+
+def unindex_product(product):
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [fts_rowid(product.pk)])
+
+
+def search_products(terms, after=None, limit=10, using=None):
+    """Return [(product_id hex, score)] of the listed products matching every term, best match
+    first, starting after the (score, product_id) of the last result of the previous page.
+    Each page is one query on the inverted index, whatever its position."""
+    # A raw query, so pick the database the way the ORM would for a product read
+    db = connections[using or router.db_for_read(Product)]
+    hidden = ", ".join(["%s"] * len(HIDDEN_CATEGORIES))
+    if db.vendor == "sqlite":
+        # bm25() is lower for better matches; negate it so every backend sorts by descending score
+        sql = (
+            f"SELECT f.product_id, -bm25({FTS_TABLE}, 0.0, %s, 1.0) AS score "
+            f"FROM {FTS_TABLE} f JOIN namas_product p ON p.product_id = f.product_id "
+            f"WHERE {FTS_TABLE} MATCH %s"
+        )
+        params = [NAME_WEIGHT, " ".join(f'"{term}"' for term in terms)]
+        score, score_params, product_id = "score", [], "f.product_id"
+    elif db.vendor == "mysql":
+        match = "MATCH (p.name, p.description) AGAINST (%s IN BOOLEAN MODE)"
+        expression = " ".join(f"+{term}" for term in terms)
+        sql = f"SELECT p.product_id, {match} AS score FROM namas_product p WHERE {match}"
+        params = [expression, expression]
+        # MySQL can't refer to the score alias in WHERE, so repeat the expression
+        score, score_params, product_id = match, [expression], "p.product_id"
+    else:
+        # No inverted index on other databases: match every term anywhere, unranked
+        sql = "SELECT p.product_id, 0 AS score FROM namas_product p WHERE 1 = 1"
+        params = []
+        for term in terms:
+            sql += " AND (LOWER(p.name) LIKE %s OR LOWER(p.description) LIKE %s)"
+            params += [f"%{term}%", f"%{term}%"]
+        score, score_params, product_id = "0", [], "p.product_id"
+
+    sql += f" AND p.inventory > 0 AND p.category NOT IN ({hidden})"
+    params += HIDDEN_CATEGORIES
+    if after is not None:
+        sql += f" AND ({score} < %s OR ({score} = %s AND {product_id} > %s))"
+        params += [*score_params, after[0], *score_params, after[0], after[1]]
+    sql += f" ORDER BY score DESC, {product_id} LIMIT %s"
+    params.append(limit)
+
+    with db.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [(str(row[0]).replace("-", ""), float(row[1])) for row in cursor.fetchall()]
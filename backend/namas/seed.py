@@ -0,0 +1,241 @@
+import random
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+
+from .beads import BRACELET_BEAD_COUNT, bead_registry
+from .catalog import HIDDEN_CATEGORIES, bump_catalog_version
+from .images import image_manifest
+from .models import Cart, CartItem, Order, Product, ProductImage, bead_sequence_hash
+from .orders import write_order_lines
+from .search import index_products
+
+# Seeded accounts, all with SEED_PASSWORD
+SEED_USER_EMAIL = "seed-user-{}@example.com"
+SEED_STAFF_EMAIL = "seed-staff@example.com"
+SEED_PASSWORD = "Seedpass1!"
+# Rows written per INSERT or UPDATE statement
+BATCH_SIZE = 500
+
+STONES = [
+    "Amethyst", "Aquamarine", "Citrine", "Garnet", "Jade", "Lapis", "Moonstone", "Obsidian",
+    "Onyx", "Opal", "Peridot", "Quartz", "Ruby", "Sapphire", "Tiger Eye", "Topaz", "Turquoise",
+]
+WORDS = [
+    "handmade", "polished", "natural", "silver", "gold", "elastic", "adjustable", "faceted",
+    "smooth", "round", "healing", "calming", "gift", "classic", "minimal", "layered", "charm",
+]
+DEFAULT_CUSTOM_IMAGE = "product_images/CustomizedBracelet_default.webp"
+
+
+def seeded_users_exist():
+    return User.objects.filter(username__in=[SEED_STAFF_EMAIL, SEED_USER_EMAIL.format(0)]).exists()
+
+
+def flush():
+    # Delete the whole catalog, every cart and order, and the seeded accounts
+    Order.objects.all().delete()
+    Cart.objects.all().delete()
+    Product.objects.all().delete()
+    User.objects.filter(username__startswith="seed-", username__endswith="@example.com").delete()
+
+
+class Seeder:
+    """Writes a deterministic synthetic data set: the same options and seed always give the
+    same ids, names, prices, carts and orders, with dates at the same offsets before `now`.
+    Everything is written in bulk, so the model signals don't run; the denormalized fields
+    and the search index are filled here."""
+
+    def __init__(self, seed=0, now=None, log=None):
+        self.rng = random.Random(seed)
+        # Dates are spread over the year before `now`
+        self.now = now or timezone.now()
+        self.log = log or (lambda message: None)
+        self.counts = {}
+
+    def uuid(self):
+        return uuid.UUID(int=self.rng.getrandbits(128), version=4)
+
+    def past(self, days=365):
+        return self.now - timedelta(seconds=self.rng.randrange(days * 24 * 3600))
+
+    def price(self, low, high):
+        return Decimal(self.rng.randrange(low * 100, high * 100)) / 100
+
+    def description(self, stone, category):
+        words = self.rng.sample(WORDS, 4)
+        return f"{' '.join(words).capitalize()} {stone.lower()} {category}."
+
+    def image_names(self):
+        # Reuse the uploaded product images so the seeded URLs resolve
+        try:
+            names = sorted(default_storage.listdir("product_images")[1])
+        except FileNotFoundError:
+            names = []
+        return [f"product_images/{name}" for name in names] or [DEFAULT_CUSTOM_IMAGE]
+
+    def run(self, products_per_category, beads, custom_bracelets, images_per_product,
+            users, carts, orders_per_user, heavy_users, heavy_user_orders):
+        with transaction.atomic():
+            catalog = self.seed_products(products_per_category, beads, custom_bracelets, images_per_product)
+            accounts = self.seed_users(users)
+            listed = [product for product in catalog if product.category not in HIDDEN_CATEGORIES and product.inventory]
+            self.seed_carts(accounts[:carts], listed)
+            order_counts = [heavy_user_orders] * heavy_users + [orders_per_user] * (len(accounts) - heavy_users)
+            self.seed_orders(accounts, order_counts, catalog)
+        bump_catalog_version()
+        bead_registry.invalidate()
+        return self.counts
+
+    def attach_images(self, product, names, images):
+        # Add the product's images and fill the denormalized fields the ProductImage signals would have written
+        product_images = [ProductImage(product=product, image=name) for name in names]
+        product.image_manifest = image_manifest(product_images)
+        product.primary_image = product.image_manifest[0]["url"] if product.image_manifest else ""
+        images += product_images
+
+    def seed_products(self, products_per_category, bead_count, custom_bracelets, images_per_product):
+        image_names = self.image_names()
+        products = []
+        for category in (Product.BRACELET, Product.NECKLACE, Product.RING):
+            for index in range(products_per_category):
+                stone = self.rng.choice(STONES)
+                products.append(Product(
+                    product_id=self.uuid(),
+                    name=f"{stone} {category.capitalize()} #{index:05d}",
+                    price=self.price(15, 400),
+                    category=category,
+                    description=self.description(stone, category),
+                    # About one product in ten is sold out
+                    inventory=0 if self.rng.random() < 0.1 else self.rng.randrange(1, 100),
+                    sales_count=self.rng.randrange(500),
+                    rating=Decimal(self.rng.randrange(100, 501)) / 100,
+                ))
+        beads = []
+        for index in range(bead_count):
+            stone = STONES[index % len(STONES)]
+            beads.append(Product(
+                product_id=self.uuid(),
+                name=f"{stone} Bead #{index:03d}",
+                price=self.price(1, 12),
+                category=Product.BEAD,
+                description=self.description(stone, "bead"),
+                inventory=self.rng.randrange(100, 1000),
+            ))
+        products += beads
+
+        images = []
+        for product in products:
+            self.attach_images(product, [self.rng.choice(image_names) for _ in range(images_per_product)], images)
+
+        if beads:
+            for _ in range(custom_bracelets):
+                chosen = [self.rng.choice(beads) for _ in range(BRACELET_BEAD_COUNT)]
+                rendered = [
+                    {"bead_id": str(bead.pk), "name": bead.name, "imgPath": bead.primary_image}
+                    for bead in chosen
+                ]
+                product = Product(
+                    product_id=self.uuid(),
+                    name="Custom Bracelet",
+                    price=sum((bead.price for bead in chosen), Decimal("0")),
+                    category=Product.CUSTOMIZED_BRACELET,
+                    inventory=self.rng.randrange(1, 4),
+                    beads=rendered,
+                    bead_hash=bead_sequence_hash(rendered),
+                )
+                products.append(product)
+                self.attach_images(product, [DEFAULT_CUSTOM_IMAGE], images)
+
+        Product.objects.bulk_create(products, batch_size=BATCH_SIZE)
+        ProductImage.objects.bulk_create(images, batch_size=BATCH_SIZE)
+        # created_at is set on insert, so spread it afterwards for the newest-first sort
+        for product in products:
+            product.created_at = self.past()
+        Product.objects.bulk_update(products, ["created_at"], batch_size=BATCH_SIZE)
+        index_products(products)
+        self.counts.update(products=len(products), images=len(images))
+        self.log(f"Seeded {len(products)} products and {len(images)} images")
+        return products
+
+    def seed_users(self, count):
+        # Hash the shared password once instead of once per account
+        password = make_password(SEED_PASSWORD)
+        accounts = [
+            User(
+                username=SEED_USER_EMAIL.format(index), email=SEED_USER_EMAIL.format(index),
+                first_name="Seed", last_name=f"User {index}", password=password,
+            )
+            for index in range(count)
+        ]
+        accounts.append(User(
+            username=SEED_STAFF_EMAIL, email=SEED_STAFF_EMAIL, first_name="Seed", last_name="Staff",
+            password=password, is_staff=True,
+        ))
+        User.objects.bulk_create(accounts, batch_size=BATCH_SIZE)
+        # bulk_create doesn't return the auto-increment ids on every database, so load them back
+        ids = dict(User.objects.filter(username__in=[user.username for user in accounts]).values_list("username", "id"))
+        for user in accounts:
+            user.id = ids[user.username]
+        self.counts.update(users=len(accounts))
+        self.log(f"Seeded {len(accounts)} users")
+        return accounts[:-1]
+
+    def seed_carts(self, accounts, products):
+        carts, items = [], []
+        for user in accounts:
+            cart = Cart(id=self.uuid(), user=user)
+            carts.append(cart)
+            for product in self.rng.sample(products, min(self.rng.randrange(1, 5), len(products))):
+                items.append(CartItem(cart=cart, product=product, quantity=1))
+        Cart.objects.bulk_create(carts, batch_size=BATCH_SIZE)
+        CartItem.objects.bulk_create(items, batch_size=BATCH_SIZE)
+        self.counts.update(carts=len(carts), cart_items=len(items))
+        self.log(f"Seeded {len(carts)} carts with {len(items)} items")
+
+    def seed_orders(self, accounts, order_counts, products):
+        total = lines = 0
+        orders = []
+
+        def write():
+            nonlocal orders, lines
+            Order.objects.bulk_create(orders, batch_size=BATCH_SIZE)
+            for order in orders:
+                order.created_at = self.past()
+            Order.objects.bulk_update(orders, ["created_at"], batch_size=BATCH_SIZE)
+            lines += write_order_lines(orders)
+            orders = []
+
+        for user, count in zip(accounts, order_counts):
+            for _ in range(count):
+                items = []
+                for product in self.rng.sample(products, min(self.rng.randrange(1, 4), len(products))):
+                    items.append({
+                        "product_id": str(product.pk),
+                        "name": product.name,
+                        "price": str(product.price),
+                        "quantity": self.rng.randrange(1, 3),
+                        "image": product.primary_image or None,
+                        "image_variants": {},
+                        "beads": product.beads,
+                    })
+                orders.append(Order(
+                    order_id=self.uuid(),
+                    user=user,
+                    amount=sum(Decimal(item["price"]) * item["quantity"] for item in items),
+                    status=self.rng.choice(Order.Status.values),
+                    items=items,
+                ))
+                total += 1
+                if len(orders) >= BATCH_SIZE:
+                    write()
+        if orders:
+            write()
+        self.counts.update(orders=total, order_items=lines)
+        self.log(f"Seeded {total} orders with {lines} lines")
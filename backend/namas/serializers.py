@@ -1,12 +1,93 @@
+from functools import cached_property
+
 from rest_framework import serializers
+from rest_framework.fields import SkipField
+from rest_framework.relations import PKOnlyObject
 from django.core.validators import RegexValidator
-from .models import Product, ProductImage, Cart, CartItem, Order
+from .models import Product, Cart, CartItem, Order
+from .images import srcset
+from .metrics import timed
+
+def normalize_email(email):
+    # Accounts are keyed by the lower-case email, so lookups can use the username index
+    return email.strip().lower()
+
+class TimedRepresentationMixin:
+    # Count rendering the response serializers as serialization time in the request metrics
+    def to_representation(self, instance):
+        with timed("serialize"):
+            return super().to_representation(instance)
+
+_MISSING = object()
+
+def _read(instance, attrs):
+    # Follow a plain source path through model attributes or values() row keys. Returns _MISSING
+    # where DRF's get_attribute does something special: missing keys and attributes, None on the
+    # way, related objects that don't exist, callables.
+    for attr in attrs:
+        if instance is None:
+            return _MISSING
+        if type(instance) is dict:
+            instance = instance.get(attr, _MISSING)
+        else:
+            instance = getattr(instance, attr, _MISSING)
+        if instance is _MISSING or callable(instance):
+            return _MISSING
+    return instance
+
+class FastRepresentationMixin:
+    """Serializer.to_representation without its per-object field lookups: the readable fields are
+    listed once per serializer, which a many=True serializer shares across its objects, and plain
+    attribute sources are read directly. Values are still converted by each field's
+    to_representation, so the output is the same."""
+
+    @cached_property
+    def _representation_fields(self):
+        # (name, field, source attribute, source path): the attribute for single-step sources,
+        # the path for dotted ones, neither for the fields DRF reads in its own way
+        fields = []
+        for field in self._readable_fields:
+            attr = attrs = None
+            if type(field).get_attribute is serializers.Field.get_attribute and field.source != "*":
+                if len(field.source_attrs) == 1:
+                    attr = field.source_attrs[0]
+                else:
+                    attrs = field.source_attrs
+            fields.append((field.field_name, field, attr, attrs))
+        return fields
+
+    def to_representation(self, instance):
+        ret = {}
+        row = type(instance) is dict
+        for name, field, attr, attrs in self._representation_fields:
+            if attr is not None:
+                attribute = instance.get(attr, _MISSING) if row else getattr(instance, attr, _MISSING)
+                if callable(attribute):
+                    attribute = _MISSING
+            elif attrs is not None:
+                attribute = _read(instance, attrs)
+            else:
+                attribute = _MISSING
+            if attribute is _MISSING:
+                # Related, method and nested fields, and the special cases, go through DRF
+                try:
+                    attribute = field.get_attribute(instance)
+                except SkipField:
+                    continue
+                check_for_none = attribute.pk if isinstance(attribute, PKOnlyObject) else attribute
+            else:
+                check_for_none = attribute
+            ret[name] = None if check_for_none is None else field.to_representation(attribute)
+        return ret
 
 class LoginSerializer(serializers.Serializer):
     email = serializers.EmailField(required=True)
     # write_only prevents the password from being returned in any response
     password = serializers.CharField(write_only=True, required=True)
 
+    def validate_email(self, value):
+        return normalize_email(value)
+
 class RegisterSerializer(serializers.Serializer):
     first_name = serializers.CharField(required=True)
     last_name = serializers.CharField(required=True)
@@ -20,6 +101,9 @@ class RegisterSerializer(serializers.Serializer):
     ])
     confirm_password = serializers.CharField(write_only=True, required=True)
 
+    def validate_email(self, value):
+        return normalize_email(value)
+
     def validate(self, data):
         errors = {}
         if data['password'] != data['confirm_password']:
@@ -31,9 +115,11 @@ class RegisterSerializer(serializers.Serializer):
         
         return data
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(TimedRepresentationMixin, FastRepresentationMixin, serializers.ModelSerializer):
     # Use SerializerMethodField to get image URL
     images = serializers.SerializerMethodField()
+    # Resized copies of each image as srcset strings by format
+    image_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = Product
@@ -41,6 +127,7 @@ class ProductSerializer(serializers.ModelSerializer):
         fields = ['product_id', 
                   'name', 
                   'images',
+                  'image_variants',
                   'price', 
                   'category', 
                   'description', 
@@ -49,17 +136,21 @@ class ProductSerializer(serializers.ModelSerializer):
                   'beads',]
         
     def get_images(self, obj):
-        # Get all related ProductImage instances and return their URLs
-        images = ProductImage.objects.filter(product=obj)
-        return [image.image.url for image in images if image.image]
+        # Read the image URLs from the product's denormalized image manifest
+        return [image["url"] for image in obj.image_manifest]
 
-class CartItemSerializer(serializers.ModelSerializer):
+    def get_image_variants(self, obj):
+        # Build the srcset strings of the manifest images, in the same order as images
+        return [srcset(image["variants"]) for image in obj.image_manifest]
+
+class CartItemSerializer(TimedRepresentationMixin, FastRepresentationMixin, serializers.ModelSerializer):
     product_id = serializers.ReadOnlyField(source='product.product_id')
     name = serializers.ReadOnlyField(source='product.name')
     price = serializers.ReadOnlyField(source='product.price')
     category = serializers.ReadOnlyField(source='product.category')
     beads = serializers.ReadOnlyField(source='product.beads')
     images = serializers.SerializerMethodField()
+    image_variants = serializers.SerializerMethodField()
     inventory = serializers.ReadOnlyField(source='product.inventory')
 
     class Meta:
@@ -71,14 +162,18 @@ class CartItemSerializer(serializers.ModelSerializer):
                   'quantity',
                   'inventory',
                   'images',
+                  'image_variants',
                   'beads',]
     
     def get_images(self, obj):
-        # Get all related ProductImage instances and return their URLs
-        images = ProductImage.objects.filter(product=obj.product)
-        return [image.image.url for image in images if image.image]
+        # Read the image URLs from the product (joined by CartItem.objects.with_product())
+        return [image["url"] for image in obj.product.image_manifest]
+
+    def get_image_variants(self, obj):
+        # Build the srcset strings of the manifest images, in the same order as images
+        return [srcset(image["variants"]) for image in obj.product.image_manifest]
 
-class CartSerializer(serializers.ModelSerializer):
+class CartSerializer(TimedRepresentationMixin, serializers.ModelSerializer):
     cart_items = serializers.SerializerMethodField()
 
     class Meta:
@@ -87,10 +182,18 @@ class CartSerializer(serializers.ModelSerializer):
 
     def get_cart_items(self, obj):
         # Get all related CartItem instances and return their serialized data
-        cart_items = CartItem.objects.filter(cart=obj)
+        cart_items = CartItem.objects.filter(cart=obj).with_product()
         return CartItemSerializer(cart_items, many=True).data
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(TimedRepresentationMixin, FastRepresentationMixin, serializers.ModelSerializer):
     class Meta:
         model = Order
-        fields = ['order_id', 'user', 'amount', 'shipping_address', 'status', 'created_at', 'items']
\ No newline at end of file
+        fields = ['order_id', 'user', 'amount', 'shipping_address', 'status', 'created_at', 'items']
+
+class OrderSummarySerializer(TimedRepresentationMixin, FastRepresentationMixin, serializers.Serializer):
+    # Serializes the values() rows of the order history summary, which never load the items JSON
+    order_id = serializers.UUIDField()
+    amount = serializers.DecimalField(max_digits=10, decimal_places=2)
+    status = serializers.CharField()
+    created_at = serializers.DateTimeField()
+    item_count = serializers.IntegerField()
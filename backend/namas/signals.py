@@ -0,0 +1,86 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .beads import bead_registry
+from .catalog import bump_catalog_version
+from .identity import invalidate_user
+from .images import refresh_image_manifests, refresh_variants, variants_match
+from .models import Product, ProductImage
+from .search import index_product, unindex_product
+
+
+# Images are part of a product's representation, so rebuild the product's denormalized
+# image fields and touch its updated_at to keep the Last-Modified and ETag of catalog
+# responses honest. Registered first so the product is updated before the catalog version moves on.
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def product_image_changed(sender, instance, **kwargs):
+    refresh_image_manifests([instance.product_id])
+
+
+# Fields a cart writes on a customized bracelet it reuses without changing how it reads
+MADE_TO_ORDER_FIELDS = {"inventory", "updated_at"}
+
+
+# Any change to a product or its images invalidates the cached catalog reads, except a cart
+# creating a customized bracelet or its default image, or raising its made-to-order inventory:
+# customized bracelets are never listed, so those writes leave every cached read as it is
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def catalog_changed(sender, instance, created=False, update_fields=None, **kwargs):
+    if kwargs["signal"] is post_save:
+        product = instance if sender is Product else instance.product
+        if product.category == Product.CUSTOMIZED_BRACELET and (
+            created or (update_fields is not None and set(update_fields) <= MADE_TO_ORDER_FIELDS)
+        ):
+            return
+    bump_catalog_version()
+
+
+# Keep the full-text search index in step with the product names and descriptions
+@receiver(post_save, sender=Product)
+def product_saved_search(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or {"name", "description"} & set(update_fields):
+        index_product(instance)
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted_search(sender, instance, **kwargs):
+    unindex_product(instance)
+
+
+# Reload the bead registry when a bead or one of its images changes
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def bead_changed(sender, instance, **kwargs):
+    if instance.category == Product.BEAD or bead_registry.contains(instance.pk):
+        bead_registry.invalidate()
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def bead_image_changed(sender, instance, **kwargs):
+    if bead_registry.contains(instance.product_id):
+        bead_registry.invalidate()
+
+
+# Generate the resized copies of a newly uploaded or replaced image once it is committed.
+# Customized bracelets all share the default image, whose copies the generate_image_variants
+# command makes, so their carts never resize it on the request thread.
+@receiver(post_save, sender=ProductImage)
+def product_image_saved(sender, instance, created, **kwargs):
+    if instance.product.category == Product.CUSTOMIZED_BRACELET:
+        return
+    if instance.image and (created or not variants_match(instance)):
+        transaction.on_commit(lambda: refresh_variants([instance]))
+
+
+# Drop the cached identity of a user when the user changes, e.g. a new password or staff flag
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def user_changed(sender, instance, **kwargs):
+    invalidate_user(instance.pk)
@@ -0,0 +1,158 @@
+"""A local stand-in for the parts of the Stripe API used by namas.payments, so the payment
+path can be run and tested offline, optionally with injected latency and errors. Start it
+with python manage.py run_stripe_stub and set STRIPE_API_BASE to its URL."""
+import json
+import random
+import re
+import secrets
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+INTENT_PATH = re.compile(r"^/v1/payment_intents(?:/(?P<intent_id>[\w]+))?$")
+
+
+def _parse_form(body):
+    # Decode Stripe's form encoding, turning a[b]=c into {"a": {"b": "c"}}
+    params = {}
+    for key, value in parse_qsl(body, keep_blank_values=True):
+        parts = re.findall(r"[^\[\]]+", key)
+        target = params
+        for part in parts[:-1]:
+            target = target.setdefault(part, {})
+        target[parts[-1]] = value
+    return params
+
+
+class StubStripeHandler(BaseHTTPRequestHandler):
+    server_version = "StubStripe/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status, message):
+        self._send(status, {"error": {"type": "invalid_request_error", "message": message}})
+
+    def _handle(self, method):
+        stub = self.server.stub
+        match = INTENT_PATH.match(self.path.split("?")[0])
+        if match is None:
+            return self._error(404, f"Unrecognized request URL ({method}: {self.path}).")
+        length = int(self.headers.get("Content-Length") or 0)
+        params = _parse_form(self.rfile.read(length).decode()) if length else {}
+        intent_id = match.group("intent_id")
+        idempotency_key = self.headers.get("Idempotency-Key")
+
+        # Injected faults: a delay before answering and server errors
+        if stub.latency:
+            time.sleep(stub.latency)
+        with stub.lock:
+            stub.requests.append((method, self.path, params))
+            if stub.fail_next > 0 or (stub.error_rate and random.random() < stub.error_rate):
+                stub.fail_next = max(stub.fail_next - 1, 0)
+                return self._send(500, {"error": {"type": "api_error", "message": "Injected fault."}})
+            if idempotency_key and idempotency_key in stub.responses:
+                # Stripe replays the first response of a request with the same idempotency key
+                return self._send(*stub.responses[idempotency_key])
+
+            if method == "POST" and intent_id is None:
+                status, payload = 200, stub.create_intent(params)
+            elif intent_id not in stub.intents:
+                return self._error(404, f"No such payment_intent: '{intent_id}'")
+            elif method == "POST":
+                intent = stub.intents[intent_id]
+                if intent["status"] in ("succeeded", "canceled"):
+                    return self._error(400, f"This PaymentIntent's amount could not be updated because it has a status of {intent['status']}.")
+                if "amount" in params:
+                    intent["amount"] = int(params["amount"])
+                status, payload = 200, intent
+            else:
+                status, payload = 200, stub.intents[intent_id]
+
+            if idempotency_key:
+                stub.responses[idempotency_key] = (status, dict(payload))
+        self._send(status, payload)
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients giving up on a delayed answer are expected when injecting latency
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class StubStripeServer:
+    """Serves the PaymentIntent create, update and retrieve endpoints from memory on a background thread"""
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0, error_rate=0):
+        # Faults to inject: seconds to wait before answering, the share of requests
+        # answered with a 500 error and a number of upcoming requests to fail
+        self.latency = latency
+        self.error_rate = error_rate
+        self.fail_next = 0
+        self.intents = {}
+        # Responses by idempotency key
+        self.responses = {}
+        # (method, path, params) of every request received
+        self.requests = []
+        self.lock = threading.Lock()
+        self._server = _Server((host, port), StubStripeHandler)
+        self._server.stub = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def reset(self):
+        # Forget every intent, replayable response, recorded request and fault
+        with self.lock:
+            self.latency = self.error_rate = self.fail_next = 0
+            self.intents.clear()
+            self.responses.clear()
+            self.requests.clear()
+
+    def create_intent(self, params):
+        intent_id = f"pi_stub{secrets.token_hex(8)}"
+        intent = {
+            "id": intent_id,
+            "object": "payment_intent",
+            "amount": int(params.get("amount", 0)),
+            "currency": params.get("currency", "usd"),
+            "status": "requires_payment_method",
+            "client_secret": f"{intent_id}_secret_{secrets.token_hex(8)}",
+            "metadata": params.get("metadata", {}),
+        }
+        self.intents[intent_id] = intent
+        return intent
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
@@ -1,3 +1,1015 @@
-from django.test import TestCase
+import base64
+import json
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from importlib import import_module
+from io import BytesIO, StringIO
+from unittest.mock import patch
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.apps import apps as django_apps
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, router
+from django.http import HttpResponse
+from rest_framework import serializers
+from PIL import Image as PILImage
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+
+from .models import Product, ProductImage, Cart, CartItem, Order, OrderItem, OrderItemBead, bead_sequence_hash
+from .orders import write_order_lines
+from .catalog import catalog_cache_key, get_catalog_cache_stats, get_catalog_version
+from .gateway import payment_gateway
+from .images import variant_name, variants_match
+from .routers import PIN_COOKIE, replica_reads, replica_routing_middleware
+from .search import search_products
+from .seed import Seeder, flush
+from .metrics import registry
+from .pagination import order_orders, order_products
+from .responses import JsonResponse, dumps
+from .serializers import OrderSerializer, ProductSerializer
+from .stripe_stub import StubStripeServer
+from .throttling import auth_account_limiter, auth_ip_limiter
+
+
+class ConcurrentCheckoutTests(TransactionTestCase):
+    """Parallel checkouts against a small stock must never oversell"""
+
+    STOCK = 5
+    BUYERS = 20
+
+    def setUp(self):
+        self.product = Product.objects.create(
+            name="Amethyst Bracelet", price=50, category=Product.BRACELET, inventory=self.STOCK
+        )
+        self.users = []
+        for i in range(self.BUYERS):
+            user = User.objects.create(username=f"buyer{i}@example.com")
+            cart = Cart.objects.create(user=user)
+            CartItem.objects.create(cart=cart, product=self.product, quantity=1)
+            self.users.append(user)
+
+    def test_parallel_checkouts_do_not_oversell(self):
+        statuses = []
+        barrier = threading.Barrier(self.BUYERS)
+
+        def checkout(user):
+            client = Client()
+            client.force_login(user)
+            try:
+                # Start every checkout at the same time
+                barrier.wait()
+                response = client.post(
+                    "/checkout",
+                    json.dumps({"shipping_address": "5000 Forbes Ave"}),
+                    content_type="application/json",
+                )
+                statuses.append(response.status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=checkout, args=(user,)) for user in self.users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.product.refresh_from_db()
+        self.assertEqual(statuses.count(200), self.STOCK)
+        self.assertEqual(statuses.count(409), self.BUYERS - self.STOCK)
+        self.assertEqual(self.product.inventory, 0)
+        self.assertEqual(self.product.sales_count, self.STOCK)
+        self.assertEqual(Order.objects.count(), self.STOCK)
+        # Only the successful buyers' carts were cleared
+        self.assertEqual(CartItem.objects.count(), self.BUYERS - self.STOCK)
+
+
+class CustomBraceletTests(TestCase):
+    """Identical bracelet designs share one made-to-order product, priced from the current beads"""
+
+    def setUp(self):
+        self.beads = [
+            Product.objects.create(name=f"Bead {i}", price="2.50", category=Product.BEAD, inventory=100)
+            for i in range(12)
+        ]
+        self.users = [User.objects.create(username=f"designer{i}@example.com") for i in range(2)]
+
+    def add_design(self, user, quantity):
+        self.client.force_login(user)
+        item = {
+            "product_id": "",
+            "category": Product.CUSTOMIZED_BRACELET,
+            "beads": [{"bead_id": str(bead.pk)} for bead in self.beads],
+            "quantity": quantity,
+        }
+        response = self.client.post("/cart", json.dumps({"cart_items": [item]}), content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_carts_share_a_design(self):
+        self.add_design(self.users[0], 3)
+        self.beads[0].price = "4.50"
+        self.beads[0].save()
+        data = self.add_design(self.users[1], 2)
+        self.assertEqual(data["messages"], [])
+
+        product = Product.objects.get(category=Product.CUSTOMIZED_BRACELET)
+        self.assertEqual(product.price, Decimal("32.00"))
+        self.assertEqual(
+            sorted(CartItem.objects.filter(product=product).values_list("quantity", flat=True)), [2, 3]
+        )
+
+        # Both carts check out, neither against the other's quantity
+        for user in self.users:
+            self.client.force_login(user)
+            response = self.client.post(
+                "/checkout", json.dumps({"shipping_address": "5000 Forbes Ave"}), content_type="application/json"
+            )
+            self.assertEqual(response.status_code, 200)
+        product.refresh_from_db()
+        self.assertEqual(product.inventory, 3)
+        self.assertEqual(product.sales_count, 5)
+
+    def test_carts_keep_the_catalog_cache(self):
+        version = get_catalog_version()
+        self.add_design(self.users[0], 1)
+        self.add_design(self.users[1], 3)
+        self.add_design(self.users[0], 2)
+        self.assertEqual(get_catalog_version(), version)
+
+    def test_edited_beads_are_rehashed(self):
+        self.add_design(self.users[0], 1)
+        product = Product.objects.get(category=Product.CUSTOMIZED_BRACELET)
+        product.beads = list(reversed(product.beads))
+        product.save()
+        self.add_design(self.users[1], 1)
+        self.assertEqual(Product.objects.filter(category=Product.CUSTOMIZED_BRACELET).count(), 2)
+
+
+class ProductListingTests(TestCase):
+    """Cursor paging walks the whole listing once, and tampered cursors are rejected"""
+
+    def setUp(self):
+        ratings = [None, "4.50", None, "3.00", "4.50", None, "5.00"]
+        for i in range(23):
+            Product.objects.create(
+                name=f"Bracelet {i}", price=f"{10 + i % 4}.00", category=Product.BRACELET,
+                inventory=5, rating=ratings[i % len(ratings)],
+            )
+
+    def walk(self, sort_by, order):
+        # The product ids of every page, following next_cursor from the first page
+        ids, params = [], {"sort_by": sort_by, "order": order}
+        while True:
+            data = self.client.get("/products/listing", params).json()
+            ids += [product["product_id"] for product in data["products"]]
+            if data["next_cursor"] is None:
+                return ids
+            params["cursor"] = data["next_cursor"]
+
+    def test_cursor_pages_cover_the_listing(self):
+        for sort_by, order in [("rating", "asc"), ("rating", "desc"), ("price", "asc"), ("created_at", "desc")]:
+            with self.subTest(sort_by=sort_by, order=order):
+                expected = order_products(Product.objects.all(), sort_by, order).values_list("product_id", flat=True)
+                self.assertEqual(self.walk(sort_by, order), [str(pk) for pk in expected])
+
+    def test_tampered_cursor_is_rejected(self):
+        def cursor(*payload):
+            return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+        product_id = str(Product.objects.first().pk)
+        for sort_by, payload in [
+            ("price", ["price", "desc", "cheap", product_id]),
+            ("price", ["price", "desc", {"a": 1}, product_id]),
+            ("price", ["price", "desc", "10.00", "not-a-uuid"]),
+            ("rating", ["rating", "desc", "NaN", product_id]),
+            ("rating", ["rating", "desc", None, 42]),
+            ("sales_count", ["sales_count", "desc", None, product_id]),
+        ]:
+            with self.subTest(payload=payload):
+                response = self.client.get(
+                    "/products/listing", {"sort_by": sort_by, "order": "desc", "cursor": cursor(*payload)}
+                )
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json()["message"], "Invalid cursor.")
+
+
+class OrderHistoryTests(TestCase):
+    """The order history is paged by cursor, newest first, and tampered cursors are rejected"""
+
+    def setUp(self):
+        self.user = User.objects.create(username="history@example.com")
+        self.orders = [Order.objects.create(user=self.user, amount="10.00", items=[]) for _ in range(5)]
+        self.client.force_login(self.user)
+
+    def test_cursor_pages_cover_the_history(self):
+        ids, params = [], {"limit": 2, "summary": 1}
+        while True:
+            data = self.client.get("/orders", params).json()
+            ids += [order["order_id"] for order in data["orders"]]
+            if data["next_cursor"] is None:
+                break
+            params["cursor"] = data["next_cursor"]
+        expected = order_orders(Order.objects.filter(user=self.user)).values_list("order_id", flat=True)
+        self.assertEqual(ids, [str(pk) for pk in expected])
+
+    def test_tampered_cursor_is_rejected(self):
+        order_id = str(self.orders[0].pk)
+        for payload in [
+            ["orders", "garbage", "x"],
+            ["orders", "2024-05-01T12:00:00+00:00", "x"],
+            ["orders", "2024-05-01T12:00:00", order_id],
+            ["orders", 20240501, order_id],
+        ]:
+            with self.subTest(payload=payload):
+                cursor = base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+                response = self.client.get("/orders", {"cursor": cursor})
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json()["message"], "Invalid cursor.")
+
+
+class PaymentIntentTests(TestCase):
+    """PaymentIntents are priced from the server-side cart and reused across checkout page loads"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.stripe = StubStripeServer().start()
+        cls.settings_override = override_settings(
+            STRIPE_SECRET_KEY="sk_test_stub", STRIPE_API_BASE=cls.stripe.url, STRIPE_MAX_NETWORK_RETRIES=0,
+            STRIPE_READ_TIMEOUT=0.5, PAYMENT_GATEWAY_FAILURE_THRESHOLD=3, PAYMENT_GATEWAY_RESET_TIMEOUT=60,
+        )
+        cls.settings_override.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.stripe.stop()
+        cls.settings_override.disable()
+        payment_gateway.reset()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.stripe.reset()
+        payment_gateway.reset()
+        self.product = Product.objects.create(
+            name="Amethyst Bracelet", price="49.99", category=Product.BRACELET, inventory=10
+        )
+        self.user = User.objects.create(username="buyer@example.com")
+        self.cart = Cart.objects.create(user=self.user)
+        self.item = CartItem.objects.create(cart=self.cart, product=self.product, quantity=2)
+        self.client.force_login(self.user)
+
+    def post_create_payment(self):
+        # The client-sent prices must be ignored
+        items = [{"product_id": str(self.product.pk), "price": 0.01, "quantity": 2}]
+        return self.client.post(
+            "/checkout/create-payment", json.dumps({"items": items}), content_type="application/json"
+        )
+
+    def create_payment(self):
+        response = self.post_create_payment()
+        self.assertEqual(response.status_code, 200)
+        return response.json()["clientSecret"]
+
+    def test_reloads_reuse_the_intent(self):
+        secret = self.create_payment()
+        self.assertEqual(self.create_payment(), secret)
+        self.assertEqual(len(self.stripe.requests), 1)
+        (intent,) = self.stripe.intents.values()
+        self.assertEqual(intent["amount"], 9998)
+        self.assertEqual(intent["client_secret"], secret)
+
+    def test_cart_changes_update_the_intent(self):
+        secret = self.create_payment()
+        self.item.quantity = 3
+        self.item.save()
+        self.assertEqual(self.create_payment(), secret)
+        (intent,) = self.stripe.intents.values()
+        self.assertEqual(intent["amount"], 14997)
+
+    def test_toggled_quantities_update_the_intent(self):
+        secret = self.create_payment()
+        for quantity in (3, 2, 3):
+            self.item.quantity = quantity
+            self.item.save()
+            self.assertEqual(self.create_payment(), secret)
+            (intent,) = self.stripe.intents.values()
+            self.assertEqual(intent["amount"], 4999 * quantity)
+
+    def test_paid_intent_is_replaced(self):
+        self.create_payment()
+        for intent in self.stripe.intents.values():
+            intent["status"] = "succeeded"
+        self.item.quantity = 1
+        self.item.save()
+        self.create_payment()
+        self.assertEqual(len(self.stripe.intents), 2)
+
+    def test_empty_cart(self):
+        self.item.delete()
+        response = self.client.post("/checkout/create-payment", "{}", content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.stripe.requests, [])
+
+    def test_circuit_opens_after_repeated_errors(self):
+        self.stripe.fail_next = 3
+        for _ in range(3):
+            self.assertEqual(self.post_create_payment().status_code, 502)
+        # The circuit is open: fail fast without calling Stripe
+        response = self.post_create_payment()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "60")
+        self.assertEqual(len(self.stripe.requests), 3)
+        stats = payment_gateway.get_stats()
+        self.assertEqual((stats["circuit"], stats["provider_errors"], stats["rejected_open"]), ("open", 3, 1))
+
+        # After the reset timeout one trial call closes it again
+        payment_gateway.breaker.opened_at -= 60
+        self.assertEqual(self.post_create_payment().status_code, 200)
+        self.assertEqual(payment_gateway.get_stats()["circuit"], "closed")
+
+    def test_slow_provider_times_out(self):
+        self.stripe.latency = 1
+        self.assertEqual(self.post_create_payment().status_code, 502)
+        self.assertLess(payment_gateway.get_stats()["latency_max_ms"], 1000)
+
+
+class IdentityCacheTests(TestCase):
+    """The session user is served from the cache without stale profiles or surviving a password change"""
+
+    def setUp(self):
+        self.user = User.objects.create_user("reader@example.com", "reader@example.com", "old-password")
+        self.client.force_login(self.user)
+
+    def test_current_user_is_cached(self):
+        self.assertEqual(self.client.get("/account/user").status_code, 200)
+        with self.assertNumQueries(0):
+            response = self.client.get("/account/user")
+        self.assertEqual(response.json()["user"]["email"], "reader@example.com")
+
+        self.user.first_name = "Rea"
+        self.user.save()
+        self.assertEqual(self.client.get("/account/user").json()["user"]["first_name"], "Rea")
+
+    def test_password_change_ends_sessions(self):
+        self.assertEqual(self.client.get("/account/user").status_code, 200)
+        self.user.password = make_password("new-password")
+        self.user.save()
+        self.assertEqual(self.client.get("/account/user").status_code, 401)
+        self.assertEqual(self.client.get("/orders").status_code, 401)
+
+
+@override_settings(DATABASE_REPLICAS=["replica_0"])
+class ReplicaRoutingTests(SimpleTestCase):
+    """Read-only views read from a replica unless their client wrote recently; writes go to the primary"""
+
+    def get(self, write=False, **cookies):
+        # Run a read-only view through the routing middleware; it answers with the database it read from
+        @replica_reads()
+        async def view(request):
+            if write:
+                router.db_for_write(Order)
+            return HttpResponse(f"{router.db_for_read(Order)} {router.db_for_read(User)}")
+
+        request = RequestFactory().get("/orders")
+        request.COOKIES.update(cookies)
+        return async_to_sync(replica_routing_middleware(view))(request)
+
+    def test_reads_go_to_the_replica(self):
+        response = self.get()
+        # Sessions and users are always read from the primary
+        self.assertEqual(response.content, b"replica_0 default")
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+        self.assertEqual(router.db_for_read(Order), "default")
+
+    def test_writers_are_pinned_to_the_primary(self):
+        response = self.get(write=True)
+        self.assertEqual(response.cookies[PIN_COOKIE]["max-age"], 5)
+        self.assertEqual(self.get(**{PIN_COOKIE: "1"}).content, b"default default")
+
+
+class SeedDataTests(TestCase):
+    """The benchmark data set is reproducible and the benchmark covers every route"""
+
+    def seed(self):
+        counts = Seeder(seed=7).run(
+            products_per_category=5, beads=12, custom_bracelets=2, images_per_product=1,
+            users=4, carts=2, orders_per_user=1, heavy_users=1, heavy_user_orders=5,
+        )
+        return counts, sorted(Product.objects.values_list("pk", "name", "price"))
+
+    def test_seeding_is_deterministic(self):
+        counts, products = self.seed()
+        self.assertEqual(counts["products"], 5 * 3 + 12 + 2)
+        self.assertEqual(Order.objects.count(), 5 + 3)
+        self.assertEqual(OrderItem.objects.count(), counts["order_items"])
+        flush()
+        self.assertEqual(self.seed(), (counts, products))
+
+    def test_every_route_is_benchmarked(self):
+        from .management.commands.bench_endpoints import uncovered_routes
+
+        self.assertEqual(uncovered_routes(), [])
+
+
+@override_settings(METRICS_TOKEN="scrape-token")
+class MetricsTests(TestCase):
+    """Requests report their timings in Server-Timing and are aggregated per route on /metrics"""
+
+    def setUp(self):
+        registry.reset()
+
+    def test_requests_are_measured(self):
+        user = User.objects.create(username="metrics@example.com")
+        Order.objects.create(user=user, amount="10.00", items=[])
+        self.client.force_login(user)
+        order_id = Order.objects.get().pk
+        # Warm the identity cache, so the order is the only query
+        self.client.get("/account/user")
+        response = self.client.get(f"/orders/{order_id}")
+        self.assertRegex(response["Server-Timing"], r'^db;dur=[\d.]+;desc="1 queries", serialize;dur=[\d.]+, total;dur=')
+
+        self.client.logout()
+        self.assertEqual(self.client.get("/metrics").status_code, 403)
+        metrics = self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer scrape-token").content.decode()
+        # Series are labelled with the route, not the order id
+        self.assertIn('namas_requests_total{endpoint="orders/<uuid:order_id>",method="GET",status="200"} 1', metrics)
+        self.assertIn('namas_request_queries_bucket{endpoint="orders/<uuid:order_id>",method="GET",le="1"} 1', metrics)
+        self.assertNotIn(str(order_id), metrics)
+
+
+class ProfilingTests(TestCase):
+    """Staff can profile a request with the X-Profile header and download the capture"""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        settings_override = override_settings(PROFILING_DIR=directory, PROFILING_SAMPLE_RATE=0)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_staff_profile_a_request(self):
+        user = User.objects.create(username="shopper@example.com")
+        self.client.force_login(user)
+        self.assertNotIn("X-Profile-Id", self.client.get("/orders", HTTP_X_PROFILE="1"))
+        self.assertEqual(self.client.get("/profiles").status_code, 403)
+
+        staff = User.objects.create(username="staff@example.com", is_staff=True)
+        self.client.force_login(staff)
+        capture_id = self.client.get("/orders", HTTP_X_PROFILE="1")["X-Profile-Id"]
+        self.assertNotIn("X-Profile-Id", self.client.get("/orders"))
+
+        profiles = self.client.get("/profiles").json()["profiles"]
+        self.assertEqual([(p["id"], p["route"], p["trigger"]) for p in profiles], [(capture_id, "orders", "header")])
+        profile = self.client.get(f"/profiles/{capture_id}").json()["profile"]
+        self.assertIn('FROM "namas_order"', " ".join(query["sql"] for query in profile["queries"]))
+        folded = self.client.get(f"/profiles/{capture_id}", {"format": "folded"})
+        self.assertEqual(folded["Content-Disposition"], f'attachment; filename="{capture_id}.folded"')
+        self.assertEqual(self.client.get("/profiles/../settings").status_code, 404)
+
+
+class JsonResponseTests(TestCase):
+    """Both JSON backends write the same bytes, and the serializers' fast path renders like DRF"""
+
+    def test_backends_write_the_same_bytes(self):
+        payload = {
+            "price": Decimal("12.50"),
+            "id": uuid.UUID("9f1c3b0e-8a4e-4c1d-9a55-0d3b3f6b2a10"),
+            "at": datetime(2024, 5, 1, 12, 30, 15, 123456, tzinfo=timezone.utc),
+            "name": "Opal \u2728 \"bead\"\n",
+            1: [None, True, 2.5],
+        }
+        encoded = dumps(payload, backend="json")
+        self.assertEqual(encoded, dumps(payload, backend="orjson"))
+        self.assertEqual(
+            encoded,
+            '{"price":"12.50","id":"9f1c3b0e-8a4e-4c1d-9a55-0d3b3f6b2a10","at":"2024-05-01T12:30:15.123Z",'
+            '"name":"Opal \u2728 \\"bead\\"\\n","1":[null,true,2.5]}'.encode(),
+        )
+        self.assertEqual(JsonResponse(payload).content, encoded)
+
+    def test_fast_representation_matches_drf(self):
+        user = User.objects.create(username="history@example.com")
+        orders = [
+            Order.objects.create(user=user, amount="19.90", items=[{"name": "Jade Ring", "price": "19.90"}]),
+            Order.objects.create(user=user, amount="5.00", items=[], shipping_address=None),
+        ]
+        serializer = OrderSerializer(orders, many=True)
+        drf = [serializers.Serializer.to_representation(OrderSerializer(), order) for order in orders]
+        self.assertEqual(list(serializer.data), drf)
+
+
+class CatalogConditionalTests(TestCase):
+    """Catalog reads answer revalidations with 304 until a product changes"""
+
+    def setUp(self):
+        self.product = Product.objects.create(
+            name="Rose Quartz Bracelet", price="30.00", category=Product.BRACELET, inventory=5
+        )
+
+    def test_revalidation_and_invalidation(self):
+        for path, params in [("/products/listing", {}), ("/products", {"product_id": str(self.product.pk)})]:
+            with self.subTest(path=path):
+                response = self.client.get(path, params)
+                self.assertEqual(response.status_code, 200)
+                etag, last_modified = response["ETag"], response["Last-Modified"]
+                self.assertIn("max-age", response["Cache-Control"])
+
+                response = self.client.get(path, params, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response.content, b"")
+                self.assertEqual(self.client.get(path, params, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+
+                self.product.name = f"{self.product.name}!"
+                self.product.save()
+                response = self.client.get(path, params, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+                self.assertNotEqual(response["ETag"], etag)
+                # The cached read was invalidated too
+                self.assertIn(self.product.name, response.content.decode())
+
+
+class CatalogCacheTests(TestCase):
+    """Every catalog cache lookup is counted, under keys any cache backend accepts"""
+
+    def setUp(self):
+        Product.objects.create(name="Rose Quartz Bracelet", price="30.00", category=Product.BRACELET, inventory=5)
+
+    def stats_after(self, *paths):
+        before = get_catalog_cache_stats()
+        for path in paths:
+            self.assertEqual(self.client.get(path).status_code, 200)
+        after = get_catalog_cache_stats()
+        return after["hits"] - before["hits"], after["misses"] - before["misses"]
+
+    def test_lookups_are_counted(self):
+        # The validators, the listing and its count miss, then the validators and the listing hit
+        self.assertEqual(self.stats_after("/products/listing"), (0, 3))
+        self.assertEqual(self.stats_after("/products/listing"), (2, 0))
+        # The page count misses its own validators and payload, and hits the listing's cached count
+        self.assertEqual(self.stats_after("/products/page-count"), (1, 2))
+
+    def test_keys_are_short_and_safe(self):
+        key = catalog_cache_key("search", "opal ring\n" * 100, None)
+        self.assertLessEqual(len(key), 250)
+        self.assertRegex(key, r"^[\x21-\x7e]+$")
+        self.assertNotEqual(key, catalog_cache_key("search", "opal ring", None))
+
+
+class CartDiffTests(TestCase):
+    """A cart POST creates, updates and deletes only the items that changed, clamped to the stock"""
+
+    def setUp(self):
+        self.products = [
+            Product.objects.create(name=f"Jade Ring {i}", price="20.00", category=Product.RING, inventory=inventory)
+            for i, inventory in enumerate([10, 10, 10, 2, 0])
+        ]
+        self.user = User.objects.create(username="cart@example.com")
+        self.cart = Cart.objects.create(user=self.user)
+        self.kept = CartItem.objects.create(cart=self.cart, product=self.products[0], quantity=1)
+        self.updated = CartItem.objects.create(cart=self.cart, product=self.products[1], quantity=1)
+        self.removed = CartItem.objects.create(cart=self.cart, product=self.products[2], quantity=1)
+        self.client.force_login(self.user)
+
+    def test_post_applies_the_difference(self):
+        items = [
+            {"product_id": str(self.products[0].pk), "quantity": 1},
+            {"product_id": str(self.products[1].pk), "quantity": 4},
+            {"product_id": str(self.products[3].pk), "quantity": 5},
+            {"product_id": str(self.products[4].pk), "quantity": 1},
+        ]
+        response = self.client.post("/cart", json.dumps({"cart_items": items}), content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["messages"], [
+            f"Product {self.products[3].name} quantity adjusted to available stock: 2.",
+            f"Product {self.products[4].name} is out of stock and removed from the cart.",
+        ])
+
+        quantities = dict(self.cart.items.values_list("product_id", "quantity"))
+        self.assertEqual(quantities, {self.products[0].pk: 1, self.products[1].pk: 4, self.products[3].pk: 2})
+        # Unchanged and updated items keep their rows
+        self.assertTrue(CartItem.objects.filter(pk=self.kept.pk, quantity=1).exists())
+        self.assertTrue(CartItem.objects.filter(pk=self.updated.pk, quantity=4).exists())
+        self.assertFalse(CartItem.objects.filter(pk=self.removed.pk).exists())
+
+
+class MergeDuplicateBraceletsTests(TestCase):
+    """The bead_hash data migration merges identical bracelet designs and their cart items"""
+
+    def test_duplicates_are_merged(self):
+        beads = [{"bead_id": f"bead-{i}"} for i in range(12)]
+        bracelets = [
+            Product.objects.create(
+                name="Custom Bracelet", price="30.00", category=Product.CUSTOMIZED_BRACELET,
+                inventory=inventory, beads=[{"bead_id": f"draft-{n}"}],
+            )
+            for n, inventory in enumerate([1, 2, 1])
+        ]
+        legacy = Product.objects.create(
+            name="Custom Bracelet", price="30.00", category=Product.CUSTOMIZED_BRACELET, inventory=1, beads=["x"],
+        )
+        # Rows written before bead_hash existed: identical beads, no hash
+        Product.objects.filter(category=Product.CUSTOMIZED_BRACELET).exclude(pk=legacy.pk).update(
+            beads=beads, bead_hash=None
+        )
+        Product.objects.filter(pk=legacy.pk).update(bead_hash=None)
+        carts = [Cart.objects.create(user=User.objects.create(username=f"merge{i}@example.com")) for i in range(2)]
+        CartItem.objects.create(cart=carts[0], product=bracelets[0], quantity=1)
+        CartItem.objects.create(cart=carts[0], product=bracelets[1], quantity=2)
+        CartItem.objects.create(cart=carts[0], product=bracelets[2], quantity=3)
+        CartItem.objects.create(cart=carts[1], product=bracelets[2], quantity=1)
+
+        import_module("namas.migrations.0004_product_bead_hash").merge_duplicate_bracelets(django_apps, None)
+
+        canonical = Product.objects.get(pk=bracelets[0].pk)
+        self.assertFalse(Product.objects.filter(pk__in=[bracelets[1].pk, bracelets[2].pk]).exists())
+        self.assertEqual(canonical.bead_hash, bead_sequence_hash(beads))
+        self.assertEqual(
+            sorted(CartItem.objects.filter(product=canonical).values_list("cart_id", "quantity")),
+            sorted([(carts[0].pk, 6), (carts[1].pk, 1)]),
+        )
+        # Room for the largest merged cart item
+        self.assertEqual(canonical.inventory, 6)
+        self.assertEqual(Product.objects.get(pk=legacy.pk).bead_hash, bead_sequence_hash(["x"]))
+
+
+class SearchTests(TestCase):
+    """Search ranks name matches first, skips unlisted products and pages by cursor"""
+
+    def setUp(self):
+        self.named = Product.objects.create(
+            name="Opal Bracelet", description="A bracelet.", price="40.00", category=Product.BRACELET, inventory=5
+        )
+        self.described = [
+            Product.objects.create(
+                name=f"Silver Ring {i}", description="Set with a small opal.", price="25.00",
+                category=Product.RING, inventory=5,
+            )
+            for i in range(11)
+        ]
+        Product.objects.create(
+            name="Opal Ring", description="Sold out.", price="25.00", category=Product.RING, inventory=0
+        )
+        Product.objects.create(name="Opal Bead", price="2.00", category=Product.BEAD, inventory=100)
+
+    def test_ranking_and_paging(self):
+        ids, params = [], {"q": "OPAL!"}
+        while True:
+            response = self.client.get("/products/search", params)
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            ids += [product["product_id"] for product in data["products"]]
+            if data["next_cursor"] is None:
+                break
+            params["cursor"] = data["next_cursor"]
+
+        self.assertEqual(ids[0], str(self.named.pk))
+        self.assertEqual(sorted(ids[1:]), sorted(str(product.pk) for product in self.described))
+        # Every term must match
+        products = self.client.get("/products/search", {"q": "opal bracelet"}).json()["products"]
+        self.assertEqual([product["product_id"] for product in products], [str(self.named.pk)])
+        self.assertEqual(self.client.get("/products/search", {"q": "?"}).status_code, 400)
+
+    def test_products_deleted_meanwhile_are_skipped(self):
+        def search_then_delete(*args, **kwargs):
+            results = search_products(*args, **kwargs)
+            Product.objects.filter(pk=self.named.pk).delete()
+            return results
+
+        with patch("namas.views.search_products", search_then_delete):
+            response = self.client.get("/products/search", {"q": "bracelet"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["products"], [])
+
+
+class FacetTests(TestCase):
+    """Facet counts apply every filter but their own and skip unlisted products"""
+
+    def setUp(self):
+        for name, price, category, inventory in [
+            ("Citrine Bracelet", "20.00", Product.BRACELET, 5),
+            ("Garnet Bracelet", "60.00", Product.BRACELET, 5),
+            ("Onyx Bracelet", "45.00", Product.BRACELET, 0),
+            ("Jade Ring", "30.00", Product.RING, 5),
+            ("Pearl Necklace", "250.00", Product.NECKLACE, 5),
+            ("Lava Bead", "2.00", Product.BEAD, 100),
+            ("Custom Bracelet", "35.00", Product.CUSTOMIZED_BRACELET, 1),
+        ]:
+            Product.objects.create(name=name, price=price, category=category, inventory=inventory)
+
+    def test_facet_counts(self):
+        data = self.client.get("/products/facets", {"price_max": "100"}).json()
+        self.assertEqual(data["total"], 3)
+        self.assertEqual(
+            [(facet["category"], facet["count"], facet["total"]) for facet in data["categories"]],
+            [(Product.BRACELET, 2, 3), (Product.NECKLACE, 0, 0), (Product.RING, 1, 1), (Product.BEAD, 1, 1)],
+        )
+        # The price range and histogram ignore the price filter
+        self.assertEqual(data["price"], {"min": "20.00", "max": "250.00"})
+        self.assertEqual([band["count"] for band in data["price_histogram"]], [1, 1, 1, 0, 1])
+
+        data = self.client.get("/products/facets", {"type": Product.RING}).json()
+        self.assertEqual(data["total"], 1)
+        self.assertEqual(data["price"], {"min": "30.00", "max": "30.00"})
+
+
+class AuthThrottleTests(TestCase):
+    """Bursts of login and registration attempts are answered with 429 and Retry-After"""
+
+    def setUp(self):
+        auth_ip_limiter.reset()
+        auth_account_limiter.reset()
+        self.addCleanup(auth_ip_limiter.reset)
+        self.addCleanup(auth_account_limiter.reset)
+        User.objects.create(
+            username="throttled@example.com", email="throttled@example.com", password=make_password("correct horse")
+        )
+
+    def post(self, path, data, ip="10.0.0.1"):
+        return self.client.post(path, json.dumps(data), content_type="application/json", REMOTE_ADDR=ip)
+
+    def test_login_is_throttled_per_account(self):
+        attempt = {"email": "Throttled@example.com", "password": "wrong"}
+        with patch.object(auth_account_limiter, "burst", 3):
+            statuses = [self.post("/account/login", attempt, ip=f"10.0.0.{i}").status_code for i in range(4)]
+            self.assertNotIn(429, statuses[:3])
+            response = self.post("/account/login", {**attempt, "password": "correct horse"}, ip="10.0.1.1")
+        self.assertEqual(statuses[3], 429)
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response["Retry-After"]), 0)
+
+    def test_register_is_throttled_per_ip(self):
+        with patch.object(auth_ip_limiter, "burst", 2):
+            # An existing account, so the allowed attempts stop at the duplicate check
+            attempt = {
+                "email": "throttled@example.com", "password": "Str0ng!pass", "confirm_password": "Str0ng!pass",
+                "first_name": "Ada", "last_name": "Lovelace",
+            }
+            statuses = [self.post("/account/register", attempt).status_code for _ in range(3)]
+            response = self.post("/account/login", {"email": "other@example.com", "password": "x"}, ip="10.0.0.2")
+        self.assertEqual(statuses, [400, 400, 429])
+        # Login attempts have their own buckets
+        self.assertNotEqual(response.status_code, 429)
+
+
+class OrderLinesTests(TestCase):
+    """Checkout and the backfill write one OrderItem per ordered line, which the sales analytics aggregate"""
+
+    def setUp(self):
+        self.beads = [
+            Product.objects.create(name=f"Bead {i}", price="1.00", category=Product.BEAD, inventory=100)
+            for i in range(12)
+        ]
+        self.ring = Product.objects.create(name="Jade Ring", price="20.00", category=Product.RING, inventory=10)
+        self.bracelet = Product.objects.create(
+            name="Custom Bracelet", price="12.00", category=Product.CUSTOMIZED_BRACELET, inventory=1,
+            beads=[{"bead_id": str(bead.pk), "name": bead.name, "imgPath": None} for bead in self.beads],
+        )
+        self.user = User.objects.create(username="lines@example.com")
+
+    def snapshot(self, product, quantity, **extra):
+        # An Order.items entry as checkout writes it
+        return {
+            "product_id": str(product.pk), "name": product.name, "price": str(product.price),
+            "quantity": quantity, "beads": product.beads, **extra,
+        }
+
+    def test_checkout_writes_the_lines(self):
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.ring, quantity=2)
+        CartItem.objects.create(cart=cart, product=self.bracelet, quantity=3)
+        self.client.force_login(self.user)
+        response = self.client.post(
+            "/checkout", json.dumps({"shipping_address": "5000 Forbes Ave"}), content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 200)
+
+        order = Order.objects.get(user=self.user)
+        lines = {line.product_id: line for line in order.lines.all()}
+        self.assertEqual(
+            {pk: (line.quantity, line.price) for pk, line in lines.items()},
+            {self.ring.pk: (2, Decimal("20.00")), self.bracelet.pk: (3, Decimal("12.00"))},
+        )
+        self.assertFalse(lines[self.ring.pk].beads.exists())
+        beads = list(lines[self.bracelet.pk].beads.order_by("position").values_list("bead_id", "position", "quantity"))
+        self.assertEqual(beads, [(bead.pk, i, 3) for i, bead in enumerate(self.beads)])
+        self.assertTrue(all(line.created_at == order.created_at for line in lines.values()))
+
+    def test_backfill_resumes_and_skips_existing_lines(self):
+        deleted = Product.objects.create(name="Old Necklace", price="50.00", category=Product.NECKLACE, inventory=0)
+        orders = [
+            Order.objects.create(user=self.user, amount="40.00", items=[self.snapshot(self.ring, 2)]),
+            Order.objects.create(user=self.user, amount="12.00", items=[self.snapshot(self.bracelet, 1)]),
+            Order.objects.create(user=self.user, amount="50.00", items=[self.snapshot(deleted, 1)]),
+            Order.objects.create(user=self.user, amount="0.00", items=[]),
+        ]
+        deleted.delete()
+        # Already written at checkout
+        write_order_lines([orders[0]])
+
+        # Interrupted after the first chunk: that chunk stays written
+        written = []
+
+        def write_then_fail(chunk):
+            if written:
+                raise RuntimeError("interrupted")
+            written.extend(chunk)
+            return write_order_lines(chunk)
+
+        with patch("namas.management.commands.backfill_order_items.write_order_lines", write_then_fail):
+            with self.assertRaises(RuntimeError):
+                call_command("backfill_order_items", chunk_size=1, stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(OrderItem.objects.count(), 1 + len(written[0].items))
+        # Resumed, then run again with nothing left to write
+        call_command("backfill_order_items", chunk_size=1, stdout=StringIO(), stderr=StringIO())
+        call_command("backfill_order_items", chunk_size=1, stdout=StringIO(), stderr=StringIO())
+        call_command("backfill_order_items", chunk_size=1, stdout=StringIO(), stderr=StringIO())
+
+        self.assertEqual(
+            sorted((line.order_id, line.product_id, line.name) for line in OrderItem.objects.all()),
+            sorted([
+                (orders[0].pk, self.ring.pk, "Jade Ring"),
+                (orders[1].pk, self.bracelet.pk, "Custom Bracelet"),
+                (orders[2].pk, None, "Old Necklace"),
+            ]),
+        )
+        self.assertEqual(OrderItemBead.objects.count(), 12)
+
+    def test_sales_analytics(self):
+        now = datetime.now(timezone.utc)
+        recent = Order.objects.create(
+            user=self.user, amount="64.00", items=[self.snapshot(self.ring, 2), self.snapshot(self.bracelet, 2)]
+        )
+        other = Order.objects.create(user=self.user, amount="20.00", items=[self.snapshot(self.ring, 1)])
+        old = Order.objects.create(user=self.user, amount="20.00", items=[self.snapshot(self.ring, 5)])
+        Order.objects.filter(pk=old.pk).update(created_at=now - timedelta(days=60))
+        old.refresh_from_db()
+        write_order_lines([recent, other, old])
+
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get("/orders/analytics").status_code, 403)
+        self.client.force_login(User.objects.create(username="analyst@example.com", is_staff=True))
+        data = self.client.get("/orders/analytics", {"days": 30}).json()
+        self.assertEqual(
+            [(row["product_id"], row["units"], Decimal(str(row["revenue"]))) for row in data["products"]],
+            [(str(self.ring.pk), 3, Decimal("60.00")), (str(self.bracelet.pk), 2, Decimal("24.00"))],
+        )
+        self.assertEqual(len(data["beads"]), 12)
+        self.assertTrue(all((row["units"], row["bracelets"]) == (2, 1) for row in data["beads"]))
+        self.assertEqual(self.client.get("/orders/analytics", {"days": 90}).json()["products"][0]["units"], 8)
+
+
+def make_image(size, orientation=None, color="purple"):
+    # A JPEG of the given (width, height) as stored, with an optional EXIF orientation
+    buffer = BytesIO()
+    exif = PILImage.Exif()
+    if orientation:
+        exif[0x0112] = orientation
+    PILImage.new("RGB", size, color).save(buffer, "JPEG", exif=exif.tobytes())
+    return buffer.getvalue()
+
+
+class ImageVariantTests(TestCase):
+    """Uploaded images get resized WebP and JPEG copies, never upscaled, served as srcset strings"""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.media_root = media_root
+        self.product = Product.objects.create(
+            name="Amethyst Bracelet", price="50.00", category=Product.BRACELET, inventory=5
+        )
+
+    def upload(self, name, content):
+        with self.captureOnCommitCallbacks(execute=True):
+            return ProductImage.objects.create(product=self.product, image=SimpleUploadedFile(name, content))
+
+    def test_variants_of_a_rotated_image(self):
+        # Stored 300x600 but shown 600x300: only the widths up to 600 are generated
+        image = self.upload("amethyst.jpg", make_image((300, 600), orientation=6))
+        image.refresh_from_db()
+        expected = {
+            extension: {str(width): variant_name(image.image.name, width, extension) for width in (240, 480)}
+            for extension in ("webp", "jpeg")
+        }
+        self.assertEqual(image.variants, expected)
+        self.assertTrue(variants_match(image))
+        with PILImage.open(os.path.join(self.media_root, image.variants["jpeg"]["480"])) as resized:
+            self.assertEqual(resized.size, (480, 240))
+
+        self.product.refresh_from_db()
+        (variants,) = ProductSerializer(self.product).data["image_variants"]
+        self.assertEqual(
+            variants["webp"],
+            f"/media/{image.variants['webp']['240']} 240w, /media/{image.variants['webp']['480']} 480w",
+        )
+
+    def test_small_images_keep_the_smallest_width(self):
+        image = self.upload("bead.jpg", make_image((100, 100)))
+        image.refresh_from_db()
+        self.assertEqual(list(image.variants["webp"]), ["240"])
+        with PILImage.open(os.path.join(self.media_root, image.variants["webp"]["240"])) as resized:
+            self.assertEqual(resized.size, (100, 100))
+
+    def test_replaced_file_is_resized_again(self):
+        image = self.upload("amethyst.jpg", make_image((1200, 600)))
+        image.refresh_from_db()
+        self.assertEqual(list(image.variants["jpeg"]), ["240", "480", "960"])
+
+        image.image = SimpleUploadedFile("citrine.jpg", make_image((500, 500), color="yellow"))
+        with self.captureOnCommitCallbacks(execute=True):
+            image.save()
+        image.refresh_from_db()
+        self.assertTrue(variants_match(image))
+        self.assertIn("citrine", image.variants["jpeg"]["480"])
+        self.assertEqual(list(image.variants["jpeg"]), ["240", "480"])
+
+
+class ImageManifestTests(TestCase):
+    """A product's denormalized images follow its ProductImage rows, and the catalog cache follows them"""
+
+    def setUp(self):
+        self.product = Product.objects.create(
+            name="Amethyst Bracelet", price="50.00", category=Product.BRACELET, inventory=5
+        )
+
+    def test_manifest_follows_the_images(self):
+        version = get_catalog_version()
+        first = ProductImage.objects.create(product=self.product, image="product_images/amethyst_front.jpg")
+        ProductImage.objects.create(product=self.product, image="product_images/amethyst_side.jpg")
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.primary_image, "/media/product_images/amethyst_front.jpg")
+        self.assertEqual(
+            [image["url"] for image in self.product.image_manifest],
+            ["/media/product_images/amethyst_front.jpg", "/media/product_images/amethyst_side.jpg"],
+        )
+        self.assertNotEqual(get_catalog_version(), version)
+
+        # Cache the product read before the deletion
+        self.assertIn("amethyst_front", self.client.get("/products", {"product_id": str(self.product.pk)}).content.decode())
+        version = get_catalog_version()
+        first.delete()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.primary_image, "/media/product_images/amethyst_side.jpg")
+        self.assertEqual(len(self.product.image_manifest), 1)
+        self.assertNotEqual(get_catalog_version(), version)
+        # The cached reads serve the new manifest
+        product = self.client.get("/products", {"product_id": str(self.product.pk)}).json()
+        self.assertIn("/media/product_images/amethyst_side.jpg", json.dumps(product))
+        self.assertNotIn("amethyst_front", json.dumps(product))
+
+    def test_backfill(self):
+        ProductImage.objects.create(product=self.product, image="product_images/amethyst_front.jpg")
+        ProductImage.objects.create(product=self.product, image="product_images/amethyst_side.jpg")
+        self.product.refresh_from_db()
+        manifest = self.product.image_manifest
+        Product.objects.filter(pk=self.product.pk).update(primary_image="", image_manifest=[])
+
+        import_module("namas.migrations.0006_product_image_manifest").backfill_image_manifests(django_apps, None)
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.primary_image, "/media/product_images/amethyst_front.jpg")
+        self.assertEqual(self.product.image_manifest, manifest)
+
+
+class NormalizeAccountEmailsTests(TestCase):
+    """Accounts differing only in the case of their email are merged when the emails are lower-cased"""
+
+    def test_colliding_accounts_are_merged(self):
+        earlier = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        old = User.objects.create(username="Ada@Example.com", email="Ada@Example.com", last_login=earlier)
+        recent = User.objects.create(
+            username="ada@example.com", email="ada@example.com", last_login=earlier + timedelta(days=30)
+        )
+        other = User.objects.create(username="Bob@Example.com", email="Bob@Example.com")
+        ring = Product.objects.create(name="Jade Ring", price="20.00", category=Product.RING, inventory=10)
+        necklace = Product.objects.create(name="Pearl Necklace", price="80.00", category=Product.NECKLACE, inventory=10)
+        order = Order.objects.create(user=old, amount="20.00", items=[])
+        cart = Cart.objects.create(user=old)
+        CartItem.objects.create(cart=cart, product=ring, quantity=1)
+        CartItem.objects.create(cart=cart, product=necklace, quantity=2)
+        CartItem.objects.create(cart=Cart.objects.create(user=recent), product=ring, quantity=3)
+
+        with redirect_stdout(StringIO()) as output:
+            import_module("namas.migrations.0011_normalize_account_emails").normalize_account_emails(django_apps, None)
+
+        self.assertIn(f"'Ada@Example.com' (id {old.pk}) into id {recent.pk}", output.getvalue())
+        self.assertFalse(User.objects.filter(pk=old.pk).exists())
+        self.assertEqual(Order.objects.get(pk=order.pk).user_id, recent.pk)
+        self.assertEqual(
+            dict(CartItem.objects.filter(cart__user=recent).values_list("product_id", "quantity")),
+            {ring.pk: 4, necklace.pk: 2},
+        )
+        other.refresh_from_db()
+        self.assertEqual((other.username, other.email), ("bob@example.com", "bob@example.com"))
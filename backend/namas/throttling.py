@@ -0,0 +1,81 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+class TokenBucketLimiter:
+    """In-process token buckets, one per key: each request takes a token, buckets hold at
+    most `burst` tokens and refill at `per_minute` tokens a minute. Only the `max_keys`
+    most recently used buckets are kept."""
+
+    def __init__(self, name, burst, per_minute, max_keys=10000):
+        self.name = name
+        self.burst = burst
+        self.rate = per_minute / 60
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.rejected = 0
+
+    def take(self, key):
+        # Take a token from the key's bucket. Returns 0 if allowed, or the seconds until a token is available.
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+                self.allowed += 1
+            else:
+                wait = (1 - tokens) / self.rate
+                self.rejected += 1
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
+            self.allowed = self.rejected = 0
+
+    def get_stats(self):
+        with self._lock:
+            return {"allowed": self.allowed, "rejected": self.rejected, "tracked_keys": len(self._buckets)}
+
+
+# Login and registration attempts, per client IP and per account (the normalized email)
+auth_ip_limiter = TokenBucketLimiter(
+    "auth_ip", settings.AUTH_THROTTLE_IP_BURST, settings.AUTH_THROTTLE_IP_PER_MINUTE
+)
+auth_account_limiter = TokenBucketLimiter(
+    "auth_account", settings.AUTH_THROTTLE_ACCOUNT_BURST, settings.AUTH_THROTTLE_ACCOUNT_PER_MINUTE
+)
+
+
+def client_ip(request):
+    # The client address, read from the header set by the reverse proxy when configured
+    if settings.AUTH_THROTTLE_IP_HEADER:
+        forwarded = request.META.get(settings.AUTH_THROTTLE_IP_HEADER)
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.META.get("REMOTE_ADDR", "")
+
+
+def throttle_auth(request, action, email=None):
+    """Take a token for an auth attempt from the client's IP bucket and, when given, the
+    account's bucket. Returns the seconds to wait if either is empty, else 0. Runs before
+    any password hashing."""
+    wait = auth_ip_limiter.take(f"{action}:{client_ip(request)}")
+    if not wait and email:
+        wait = auth_account_limiter.take(f"{action}:{email}")
+    return math.ceil(wait)
+
+
+def get_auth_throttle_stats():
+    return {limiter.name: limiter.get_stats() for limiter in (auth_ip_limiter, auth_account_limiter)}
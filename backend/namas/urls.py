@@ -6,10 +6,21 @@ urlpatterns = [
     path('account/register', views.register_action, name='register'),
     path('account/logout', views.logout_action, name='logout'),
     path('account/user', views.get_curr_user_action, name='get_curr_user'),
+    path('account/throttle-stats', views.get_auth_throttle_stats_action, name='get_auth_throttle_stats'),
     path('checkout/create-payment', views.create_payment_intent),
+    path('checkout/gateway-stats', views.get_payment_gateway_stats_action, name='get_payment_gateway_stats'),
     path('products', views.get_products_action, name='get_products'),
     path('products/page-count', views.get_page_count_action, name='get_page_count'),
+    path('products/listing', views.get_product_listing_action, name='get_product_listing'),
+    path('products/search', views.search_products_action, name='search_products'),
+    path('products/facets', views.get_facets_action, name='get_facets'),
+    path('products/cache-stats', views.get_catalog_cache_stats_action, name='get_catalog_cache_stats'),
     path('cart', views.cart_action, name='cart'),
     path('checkout', views.checkout_action, name='checkout'),
     path('orders', views.get_orders_action, name='get_orders'),
+    path('orders/<uuid:order_id>', views.get_order_action, name='get_order'),
+    path('orders/analytics', views.get_sales_analytics_action, name='get_sales_analytics'),
+    path('metrics', views.metrics_action, name='metrics'),
+    path('profiles', views.get_profiles_action, name='get_profiles'),
+    path('profiles/<str:capture_id>', views.get_profile_action, name='get_profile'),
 ]
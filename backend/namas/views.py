@@ -1,22 +1,95 @@
-from .serializers import LoginSerializer, RegisterSerializer, CartSerializer, OrderSerializer, ProductSerializer, CartItemSerializer
+from .serializers import LoginSerializer, RegisterSerializer, CartSerializer, OrderSerializer, OrderSummarySerializer, ProductSerializer, CartItemSerializer
 import json
-import os
+import logging
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate, login, logout
-from django.http import JsonResponse
+from django.conf import settings
+from django.http import HttpResponse
+from .responses import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 import stripe
+import hmac
 import math
-
-from .models import Product, Cart, CartItem, Order
+import uuid
+from django.db import router, transaction
+
+from .models import Product, Cart, CartItem, Order, bead_sequence_hash
+from .beads import bead_registry
+from .images import srcset
+from .orders import write_order_lines
+from .analytics import units_sold, popular_beads
+from .payments import get_or_create_payment_intent, clear_payment_intent
+from .gateway import GatewayUnavailable, payment_gateway
+from .routers import replica_reads
+from .identity import get_identity, aget_identity
+from .throttling import throttle_auth, get_auth_throttle_stats
+from .metrics import render_metrics
+from .profiling import list_captures, load_capture, load_folded
+from .pagination import SORT_FIELDS, order_products, after_cursor, encode_cursor, decode_cursor
+from .pagination import InvalidCursor, order_orders, after_order_cursor, encode_order_cursor
+from .pagination import encode_search_cursor, decode_search_cursor
+from .search import search_terms, search_products
+from .functions import JSONArrayLength
+from .catalog import (
+    parse_filters, filter_products, get_cached_count, set_cached_count, bump_catalog_version,
+    catalog_cache_key, acached_catalog_read, get_catalog_cache_stats, acatalog_validators,
+    acatalog_facets, catalog_recently_changed, RESPONSE_FORMAT,
+)
+from functools import wraps
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ValidationError
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.views.decorators.cache import cache_control
+from django.db.models import Case, Count, F, IntegerField, Q, Value, When, Window
+from django.utils import timezone
+from datetime import timedelta
+
+logger = logging.getLogger(__name__)
 
 PAGE_SIZE = 10
+# Default and largest number of orders per page of the order history
+ORDER_PAGE_SIZE = 10
+ORDER_MAX_PAGE_SIZE = 50
+# Seconds browsers and proxies may reuse a catalog response before revalidating it
+CATALOG_MAX_AGE = 30
 
 from django.middleware.csrf import get_token
 # get the CSRF token
 def get_csrf_action(request):
     return JsonResponse({"csrfToken": get_token(request)})
 
+# Reply to a throttled login or registration attempt
+def _throttled_response(wait):
+    response = JsonResponse(
+        {"success": False,
+         "message": "Too many attempts. Please try again later.",
+         "errors": {
+             "non_field_errors": ["Too many attempts. Please try again later."]
+         }},
+        status=429,
+    )
+    response["Retry-After"] = str(wait)
+    return response
+
+
+# Return the allowed and rejected login and registration attempts (staff only)
+def get_auth_throttle_stats_action(request):
+    if request.method != "GET":
+        return JsonResponse(
+            {"success": False, "message": "Invalid request method."}, status=405
+        )
+
+    if not request.user.is_staff:
+        return JsonResponse(
+            {"success": False, "message": "Permission denied."}, status=403
+        )
+
+    return JsonResponse(
+        {"success": True, "stats": get_auth_throttle_stats()}, status=200
+    )
+
+
 # manage the login action, verify and authenticate the user
 # @csrf_exempt  # Disable CSRF protection just for test purposes
 def login_action(request):
@@ -57,6 +130,11 @@ def login_action(request):
     email = serializer.validated_data["email"]
     password = serializer.validated_data["password"]
 
+    # Reject bursts of attempts before spending any time on password hashing
+    wait = throttle_auth(request, "login", email)
+    if wait:
+        return _throttled_response(wait)
+
     # Authenticate the user
     user = authenticate(username=email, password=password)
 
@@ -128,9 +206,12 @@ def register_action(request):
     first_name = serializer.validated_data["first_name"]
     last_name = serializer.validated_data["last_name"]
 
-    # Check if user already exists
-    user = authenticate(username=email, password=password)
-    if user is not None:
+    wait = throttle_auth(request, "register", email)
+    if wait:
+        return _throttled_response(wait)
+
+    # Check if user already exists, with index lookups on the normalized email instead of a password check
+    if User.objects.filter(Q(username=email) | Q(email=email)).exists():
         # Return an error response for existing user
         return JsonResponse(
             {"success": False, 
@@ -180,22 +261,24 @@ def logout_action(request):
 
 # manage the get current user action, return the current user
 # @csrf_exempt  # Disable CSRF protection just for test purposes
-def get_curr_user_action(request):
+async def get_curr_user_action(request):
     if request.method != "GET":
         return JsonResponse(
             {"success": False, "message": "Invalid request method."}, status=405
         )
 
-    if request.user.is_authenticated:
+    # Read the session user from the identity cache, falling back to the database on a miss
+    identity = await aget_identity(request)
+    if identity is not None:
         return JsonResponse(
             {
                 "success": True,
                 "message": "User is authenticated.",
                 "user": {
-                    "id": request.user.id,
-                    "email": request.user.email,
-                    "first_name": request.user.first_name,
-                    "last_name": request.user.last_name,
+                    "id": identity["id"],
+                    "email": identity["email"],
+                    "first_name": identity["first_name"],
+                    "last_name": identity["last_name"],
                 },
             },
             status=200,
@@ -207,7 +290,7 @@ def get_curr_user_action(request):
         )
 
 
-# Extract the items from the request body and create a payment intent
+# Create or reuse the payment intent of the user's cart, priced from the server-side cart
 # @csrf_exempt  # Disable CSRF protection just for test purposes
 def create_payment_intent(request):
     if request.method != "POST":
@@ -215,68 +298,343 @@ def create_payment_intent(request):
             {"success": False, "message": "Invalid request method."}, status=405
         )
 
+    identity = get_identity(request)
+    if identity is None:
+        return JsonResponse(
+            {"success": False, "message": "User is not authenticated."}, status=401
+        )
+
     try:
-        # Parse the incoming request data
-        cart_items = json.loads(request.body)
-        items = cart_items.get("items", [])
+        cart = Cart.objects.get(user_id=identity["id"])
+        # Send the client secret back to the frontend
+        client_secret = get_or_create_payment_intent(cart)
+        return JsonResponse({"clientSecret": client_secret})
+    except (Cart.DoesNotExist, ValueError):
+        return JsonResponse(
+            {"success": False, "message": "Cart is empty."}, status=400
+        )
+    except GatewayUnavailable as e:
+        # Fail fast instead of tying up the worker while the provider is struggling
+        response = JsonResponse(
+            {"success": False, "message": str(e)}, status=503
+        )
+        response["Retry-After"] = str(math.ceil(e.retry_after))
+        return response
+    except stripe.StripeError as e:
+        logger.warning("Error creating payment intent: %s", e)
+        return JsonResponse(
+            {"success": False, "message": "PaymentIntent creation failed"},
+            status=502,
+        )
 
-        # Calculate the order amount in cents
-        amount = sum(int(float(item["price"]) * 100) * item["quantity"] for item in items)
 
-        # Get the Stripe secret key from the environment variables
-        stripe.api_key = os.getenv("STRIPE_SECRET_KEY")
+# Return the latency and error counters and circuit state of the payment gateway (staff only)
+def get_payment_gateway_stats_action(request):
+    if request.method != "GET":
+        return JsonResponse(
+            {"success": False, "message": "Invalid request method."}, status=405
+        )
 
-        # Create a PaymentIntent
-        payment_intent = stripe.PaymentIntent.create(
-            amount=amount,
-            currency="usd",
-            automatic_payment_methods={"enabled": True},
+    if not request.user.is_staff:
+        return JsonResponse(
+            {"success": False, "message": "Permission denied."}, status=403
         )
 
-        # Send the client secret back to the frontend
-        return JsonResponse({"clientSecret": payment_intent.client_secret})
-    except Exception as e:
-        print("Error creating payment intent:", e)
+    return JsonResponse(
+        {"success": True, "stats": payment_gateway.get_stats()}, status=200
+    )
+
+
+# Return the request metrics and the in-process counters in the Prometheus text format, to staff
+# or to a scraper sending "Authorization: Bearer <METRICS_TOKEN>"
+def metrics_action(request):
+    if request.method != "GET":
         return JsonResponse(
-            {"success": False, "message": "PaymentIntent creation failed"},
-            status=500,
+            {"success": False, "message": "Invalid request method."}, status=405
         )
-    
 
-# @csrf_exempt
-def get_page_count_action(request):
+    # Check the token first so scrapes never load a session
+    token = settings.METRICS_TOKEN
+    authorized = token and hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}")
+    if not authorized and not request.user.is_staff:
+        return JsonResponse(
+            {"success": False, "message": "Permission denied."}, status=403
+        )
+
+    gateway = payment_gateway.get_stats()
+    gateway["circuit_open"] = int(gateway.pop("circuit") != payment_gateway.breaker.CLOSED)
+    catalog = get_catalog_cache_stats()
+    catalog.pop("version")
+    throttles = {
+        f"{limiter}_{name}": value
+        for limiter, stats in get_auth_throttle_stats().items() for name, value in stats.items()
+    }
+    extra = {
+        "namas_payment_gateway": ("Payment gateway counters, latencies in milliseconds.", gateway),
+        "namas_catalog_cache": ("Catalog read cache hits and misses in this process.", catalog),
+        "namas_auth_throttle": ("Login and registration throttle counters.", throttles),
+    }
+    return HttpResponse(render_metrics(extra), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+
+# List the stored request profiles, newest first (staff only)
+def get_profiles_action(request):
+    if request.method != "GET":
+        return JsonResponse(
+            {"success": False, "message": "Invalid request method."}, status=405
+        )
+
+    if not request.user.is_staff:
+        return JsonResponse(
+            {"success": False, "message": "Permission denied."}, status=403
+        )
+
+    return JsonResponse({"success": True, "profiles": list_captures()}, status=200)
+
+
+# Download a stored request profile (staff only): its metadata and queries as JSON, or with
+# ?format=folded its collapsed stacks, for flamegraph.pl or speedscope
+def get_profile_action(request, capture_id):
     if request.method != "GET":
         return JsonResponse(
             {"success": False, "message": "Invalid request method."}, status=405
         )
 
+    if not request.user.is_staff:
+        return JsonResponse(
+            {"success": False, "message": "Permission denied."}, status=403
+        )
+
+    if request.GET.get("format") == "folded":
+        folded = load_folded(capture_id)
+        if folded is None:
+            return JsonResponse(
+                {"success": False, "message": "Profile not found."}, status=404
+            )
+        response = HttpResponse(folded, content_type="text/plain; charset=utf-8")
+        response["Content-Disposition"] = f'attachment; filename="{capture_id}.folded"'
+        return response
+
+    profile = load_capture(capture_id)
+    if profile is None:
+        return JsonResponse(
+            {"success": False, "message": "Profile not found."}, status=404
+        )
+    return JsonResponse({"success": True, "profile": profile}, status=200)
+
+# Read and normalize the filter, sort and page parameters of a listing request.
+# Raises ValueError with a user-facing message for invalid parameters.
+def _listing_params(request):
     # Get filter and sort parameters
-    product_type = request.GET.get("type", None)
-    price_min = request.GET.get("price_min", None)
-    price_max = request.GET.get("price_max", None)
-
-    # Filter products
-    products = Product.objects.all()
-    if product_type:
-        products = products.filter(category=product_type)
-    else:
-        # Exclude customized_bracelet and bead products when the type is not specified
-        products = Product.objects.exclude(category__in=["customized_bracelet", "bead"])
-    if price_min:
-        products = products.filter(price__gte=price_min)
-    if price_max:
-        products = products.filter(price__lte=price_max)
-    # Discard products with inventory 0
-    products = products.filter(inventory__gt=0)
-    # Get the total number of products
-    total_products = products.count()
-    # Calculate the total number of pages
-    page_count = math.ceil(total_products / PAGE_SIZE)
-
-    return JsonResponse({"success": True, "pages": page_count}, status=200)
+    params = parse_filters(request.GET)
+    params["sort_by"] = request.GET.get("sort_by", "sales_count") # price, rating, sales_count (default), created_at
+    params["order"] = "asc" if request.GET.get("order", "desc") == "asc" else "desc" # asc or desc
+    if params["sort_by"] not in SORT_FIELDS:
+        raise ValueError("Invalid sort field.")
+    # get page number, or the cursor returned with the previous page
+    try:
+        params["page"] = max(int(request.GET.get("page", 1)), 1)
+    except ValueError:
+        raise ValueError("Invalid page.")
+    params["cursor"] = request.GET.get("cursor") or None
+    if params["cursor"]:
+        decode_cursor(params["cursor"], params["sort_by"], params["order"])
+    return params
+
+
+# The normalized listing parameters, in a fixed order for building cache keys
+def _listing_key_parts(params):
+    return (
+        params["type"], params["price_min"], params["price_max"],
+        params["sort_by"], params["order"], params["page"], params["cursor"],
+    )
+
+
+# Build the product listing shared by /products, /products/page-count and /products/listing.
+# The page of products and the total count are each computed only when requested.
+async def _product_listing(params, with_products=True, with_count=True):
+    sort_by, order, cursor = params["sort_by"], params["order"], params["cursor"]
+
+    # Get products based on the filters
+    products = filter_products(params)
+    payload = {"success": True}
+
+    # Counts are cached per filter combination until the catalog changes
+    total_products = get_cached_count(params) if with_count else None
+
+    if with_products:
+        # Sort the products, using product_id as the tie-breaker so every row has a unique position.
+        # Images are read from the denormalized manifest, so the page costs a single query.
+        products = order_products(products, sort_by, order)
+
+        # Only return the products for the requested page. A cursor continues right after the
+        # last product of the previous page; the page number is kept for numbered pagination.
+        if cursor:
+            products = after_cursor(products, sort_by, order, cursor)
+            start = 0
+        else:
+            start = (params["page"] - 1) * PAGE_SIZE
+            if with_count and total_products is None:
+                # Count the whole filtered set in the same query with COUNT(*) OVER ()
+                products = products.annotate(total_count=Window(Count("product_id")))
+        # Fetch one extra row to know whether there is a next page
+        products = [product async for product in products[start:start + PAGE_SIZE + 1]]
+        next_cursor = None
+        if len(products) > PAGE_SIZE:
+            products = products[:PAGE_SIZE]
+            next_cursor = encode_cursor(products[-1], sort_by, order)
+        if with_count and total_products is None and products and not cursor:
+            total_products = products[0].total_count
+            set_cached_count(params, total_products)
+
+        # Serialize the products (their images are prefetched, so this runs no query)
+        serializer = ProductSerializer(products, many=True)
+        payload["products"] = serializer.data
+        payload["next_cursor"] = next_cursor
+
+    if with_count:
+        if total_products is None:
+            # Count separately when no row carried the window count (count only, cursor page or past the last page)
+            total_products = await filter_products(params).acount()
+            set_cached_count(params, total_products)
+        payload["total"] = total_products
+        # Calculate the total number of pages
+        payload["pages"] = math.ceil(total_products / PAGE_SIZE)
+
+    return payload
+
+
+# Serve a listing from the catalog cache, building it on a miss.
+# Returns the response payload and status code.
+async def _cached_product_listing(request, with_products=True, with_count=True):
+    try:
+        params = _listing_params(request)
+    except ValueError as e:
+        return {"success": False, "message": str(e)}, 400
+
+    key = catalog_cache_key("listing", with_products, with_count, *_listing_key_parts(params))
+    payload = await acached_catalog_read(
+        key, lambda: _product_listing(params, with_products, with_count)
+    )
+    return payload, 200
+
+
+# Compute the ETag and Last-Modified of a catalog request. They are cached under the
+# catalog version, so answering a revalidation with 304 costs no query at all.
+async def _catalog_validators(request):
+    product_id = request.GET.get("product_id", None)
+    try:
+        if product_id:
+            products = Product.objects.filter(product_id=product_id)
+            parts = ("product", product_id)
+        else:
+            params = _listing_params(request)
+            products = filter_products(params)
+            parts = (request.path, *_listing_key_parts(params))
+        return await acached_catalog_read(
+            catalog_cache_key("validators", RESPONSE_FORMAT, *parts),
+            lambda: acatalog_validators(products, *parts),
+        )
+    except (ValueError, ValidationError):
+        # Invalid parameters are answered by the view itself
+        return None, None
+
+
+# Conditional GET support for the async catalog views. Works like
+# django.views.decorators.http.condition, whose ETag and Last-Modified
+# callables are synchronous and so cannot use the async ORM.
+def catalog_conditional(view):
+    @wraps(view)
+    async def inner(request, *args, **kwargs):
+        etag, last_modified = await _catalog_validators(request)
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = await view(request, *args, **kwargs)
+        # Set the validators on the response if the request method is safe
+        if request.method in ("GET", "HEAD"):
+            if timestamp and not response.has_header("Last-Modified"):
+                response.headers["Last-Modified"] = http_date(timestamp)
+            if etag:
+                response.headers.setdefault("ETag", etag)
+        return response
+
+    return inner
+
+
+# Catalog responses may be reused by browsers and the nginx proxy for a short time,
+# and are revalidated with If-None-Match / If-Modified-Since afterwards
+catalog_cache_control = cache_control(public=True, max_age=CATALOG_MAX_AGE)
+# Catalog reads go to the read replicas, except right after a catalog change
+catalog_replica_reads = replica_reads(unless=catalog_recently_changed)
+
+
+# Return a page of products together with the total count and page count
+# @csrf_exempt  # Disable CSRF protection just for test purposes
+@catalog_replica_reads
+@catalog_cache_control
+@catalog_conditional
+async def get_product_listing_action(request):
+    if request.method != "GET":
+        return JsonResponse(
+            {"success": False, "message": "Invalid request method."}, status=405
+        )
+
+    payload, status = await _cached_product_listing(request)
+    return JsonResponse(payload, status=status)
+
+
+# @csrf_exempt
+@catalog_replica_reads
+@catalog_cache_control
+@catalog_conditional
+async def get_page_count_action(request):
+    if request.method != "GET":
+        return JsonResponse(
+            {"success": False, "message": "Invalid request method."}, status=405
+        )
+
+    payload, status = await _cached_product_listing(request, with_products=False)
+    if status == 200:
+        payload = {"success": True, "pages": payload["pages"]}
+    return JsonResponse(payload, status=status)
+
+
+# Return the category counts, price range and price histogram of a listing, for filter UIs
+# @csrf_exempt
+@catalog_replica_reads
+@catalog_cache_control
+async def get_facets_action(request):
+    if request.method != "GET":
+        return JsonResponse(
+            {"success": False, "message": "Invalid request method."}, status=405
+        )
+
+    try:
+        filters = parse_filters(request.GET)
+    except ValueError as e:
+        return JsonResponse({"success": False, "message": str(e)}, status=400)
+
+    key = catalog_cache_key("facets", filters["type"], filters["price_min"], filters["price_max"])
+    payload = await acached_catalog_read(key, lambda: acatalog_facets(filters))
+    return JsonResponse(payload, status=200)
+
+
+# Serialize a single product, or return None if it does not exist
+async def _product_detail(product_id):
+    try:
+        product = await Product.objects.aget(product_id=product_id)
+    except Product.DoesNotExist:
+        return None
+    serializer = ProductSerializer(product)
+    return {"success": True, "product": serializer.data}
 
 @csrf_exempt  # Disable CSRF protection just for test purposes
-def get_products_action(request):
+@catalog_replica_reads
+@catalog_cache_control
+@catalog_conditional
+async def get_products_action(request):
     if request.method != "GET":
         return JsonResponse(
             {"success": False, "message": "Invalid request method."}, status=405
@@ -285,77 +643,132 @@ def get_products_action(request):
     # Return the information of a single product if the product_id is provided
     product_id = request.GET.get("product_id", None)
     if product_id:
-        try:
-            product = Product.objects.get(product_id=product_id)
-            serializer = ProductSerializer(product)
-            return JsonResponse(
-                {"success": True, "product": serializer.data}, status=200
-            )
-        except Product.DoesNotExist:
+        payload = await acached_catalog_read(
+            catalog_cache_key("product", product_id), lambda: _product_detail(product_id)
+        )
+        if payload is None:
             return JsonResponse(
                 {"success": False, "message": "Product not found."}, status=404)
-    
-    # Get filter and sort parameters
-    product_type = request.GET.get("type", None)
-    price_min = request.GET.get("price_min", None)
-    price_max = request.GET.get("price_max", None)
-    sort_by = request.GET.get("sort_by", "sales_count") # price, rating, sales_count (default), created_at
-    order = request.GET.get("order", "desc") # asc or desc
-    # get page number
-    page = request.GET.get("page", 1)
+        return JsonResponse(payload, status=200)
+
+    payload, status = await _cached_product_listing(request, with_count=False)
+    return JsonResponse(payload, status=status)
+
+
+# Find one page of the listed products matching every word of the query, best match first
+def _search_page(terms, cursor):
+    after = decode_search_cursor(cursor) if cursor else None
+    # Fetch one extra result to know whether there is a next page. Both queries read the same
+    # database, the router may pick a different replica for each read.
+    db = router.db_for_read(Product)
+    results = search_products(terms, after, PAGE_SIZE + 1, using=db)
+    next_cursor = None
+    if len(results) > PAGE_SIZE:
+        results = results[:PAGE_SIZE]
+        next_cursor = encode_search_cursor(results[-1][1], results[-1][0])
+    products = Product.objects.using(db).in_bulk([uuid.UUID(product_id) for product_id, _ in results])
+    # Skip products deleted since the index was read
+    ranked = [
+        products[uuid.UUID(product_id)] for product_id, _ in results if uuid.UUID(product_id) in products
+    ]
+    serializer = ProductSerializer(ranked, many=True)
+    return {"success": True, "products": serializer.data, "next_cursor": next_cursor}
 
-    # Get products based on the filters
-    products = Product.objects.all()
-    if product_type:
-        products = products.filter(category=product_type)
-    else:
-        # Exclude customized_bracelet and bead products when the type is not specified
-        products = Product.objects.exclude(category__in=["customized_bracelet", "bead"])
-    if price_min:
-        products = products.filter(price__gte=price_min) 
-    if price_max:
-        products = products.filter(price__lte=price_max)
-
-    # discard products with inventory 0
-    products = products.filter(inventory__gt=0)
-
-    # Sort the products
-    if order == "asc":
-        products = products.order_by(sort_by)
-    else:
-        products = products.order_by(f"-{sort_by}")
 
-    # only return the products for the requested page
-    if product_type != "bead":
-        page = int(page)
-        start = (page - 1) * PAGE_SIZE
-        end = start + PAGE_SIZE
-        products = products[start:end]
+# @csrf_exempt  # Disable CSRF protection just for test purposes
+@catalog_replica_reads
+@catalog_cache_control
+async def search_products_action(request):
+    if request.method != "GET":
+        return JsonResponse(
+            {"success": False, "message": "Invalid request method."}, status=405
+        )
+
+    terms = search_terms(request.GET.get("q"))
+    if not terms:
+        return JsonResponse(
+            {"success": False, "message": "Missing search query."}, status=400
+        )
+    cursor = request.GET.get("cursor") or None
+
+    # Cached under the catalog version like the other catalog reads
+    try:
+        payload = await acached_catalog_read(
+            catalog_cache_key("search", "+".join(terms), cursor),
+            lambda: sync_to_async(_search_page)(terms, cursor),
+        )
+    except InvalidCursor as e:
+        return JsonResponse(
+            {"success": False, "message": str(e)}, status=400
+        )
+    return JsonResponse(payload, status=200)
+
+
+# Return the hit and miss counters of the catalog read cache (staff only)
+def get_catalog_cache_stats_action(request):
+    if request.method != "GET":
+        return JsonResponse(
+            {"success": False, "message": "Invalid request method."}, status=405
+        )
+
+    if not request.user.is_staff:
+        return JsonResponse(
+            {"success": False, "message": "Permission denied."}, status=403
+        )
+
+    return JsonResponse(
+        {"success": True, "stats": get_catalog_cache_stats()}, status=200
+    )
+
+
+# Return the best selling products and most used beads of the last `days` days (staff only)
+def get_sales_analytics_action(request):
+    if request.method != "GET":
+        return JsonResponse(
+            {"success": False, "message": "Invalid request method."}, status=405
+        )
+
+    if not request.user.is_staff:
+        return JsonResponse(
+            {"success": False, "message": "Permission denied."}, status=403
+        )
 
-    # Serialize the products
-    serializer = ProductSerializer(products, many=True)
+    try:
+        days = max(int(request.GET.get("days", 30)), 1)
+    except ValueError:
+        return JsonResponse(
+            {"success": False, "message": "Invalid number of days."}, status=400
+        )
+    since = timezone.now() - timedelta(days=days)
 
     return JsonResponse(
-        {"success": True, "products": serializer.data}, status=200
+        {"success": True, "products": units_sold(since), "beads": popular_beads(since)}, status=200
     )
 
 
 # @csrf_exempt  # Disable CSRF protection just for test purposes
 def cart_action(request):
+    # The session user, without loading the User row
+    identity = get_identity(request)
+    if identity is None:
+        return JsonResponse(
+            {"success": False, "message": "User is not authenticated."}, status=401
+        )
+
     try:
         # Get the user's cart
-        user = User.objects.get(id=request.user.id)
+        user_id = identity["id"]
 
         if request.method == "GET":
             try:
-                cart = Cart.objects.get(user=user)
+                cart = Cart.objects.get(user_id=user_id)
             except Cart.DoesNotExist:
                 return JsonResponse({'success': True, 
                                     'cart_items': []}, 
                                     status=200)
 
-            # Get the cart items
-            cart_items = cart.items.all()
+            # Get the cart items together with their products
+            cart_items = cart.items.with_product()
 
             # Serialize the cart items
             serializer = CartItemSerializer(cart_items, many=True)
@@ -369,7 +782,7 @@ def cart_action(request):
             data = json.loads(request.body)
 
             try:
-                cart, created = Cart.objects.get_or_create(user=user)
+                cart, created = Cart.objects.get_or_create(user_id=user_id)
             except Exception as e:
                 return JsonResponse({'success': False, 
                                     'message': str(e)}, 
@@ -378,49 +791,108 @@ def cart_action(request):
             items = data.get('cart_items', [])  # Expecting 'cart_items' in the request body
             response_messages = []  # To track updates and mismatches
 
-            # delete all old items in the cart
-            cart.items.all().delete()
-            
-            for item in items:
-                product_id = item.get('product_id')
-                quantity = item.get('quantity')
-
-                # Create a new product for new customized bracelet
-                if (not product_id or product_id == '') and item.get('category') == Product.CUSTOMIZED_BRACELET:
-                    product = Product.objects.create(
-                        name="Custom Bracelet",
-                        price=120, # each bead 10 USD, 12 bead in total
-                        category=Product.CUSTOMIZED_BRACELET,
-                        # description=item.get('description', 'Customized bracelet'),
-                        inventory=quantity,
-                        beads=item.get('beads', []),
-                    )
-                    product_id = product.product_id
-
-                # Validate product existence
-                try:
-                    product = Product.objects.get(product_id=product_id)
-                except Product.DoesNotExist:
-                    continue  # Skip invalid products
-
-                # Check stock and adjust quantity
-                if product.inventory == 0:
-                    # Remove item if product is out of stock
-                    CartItem.objects.filter(cart=cart, product=product).delete()
-                    response_messages.append(f"Product {product.name} is out of stock and removed from the cart.")
-                    continue
-
-                if quantity > product.inventory:
-                    # Adjust quantity to match stock
-                    quantity = product.inventory
-                    response_messages.append(f"Product {product.name} quantity adjusted to available stock: {quantity}.")
-
-                # Update or create the cart item
-                CartItem.objects.update_or_create(
-                    cart=cart,
-                    product=product,
-                    defaults={'quantity': quantity}
-                )
+            with transaction.atomic():
+                # Create a new product for each new customized bracelet
+                product_ids = []
+                for item in items:
+                    product_id = item.get('product_id')
+                    if (not product_id or product_id == '') and item.get('category') == Product.CUSTOMIZED_BRACELET:
+                        # Validate, price and render the beads from the bead registry
+                        beads = item.get('beads', [])
+                        try:
+                            price = bead_registry.price(beads)
+                        except ValidationError:
+                            response_messages.append("Custom bracelet has invalid beads and was not added to the cart.")
+                            product_ids.append(None)
+                            continue
+                        # Reuse the product of an identical design, keyed by the hash of its bead sequence
+                        beads = bead_registry.render(beads)
+                        quantity = item.get('quantity')
+                        product, created = Product.objects.get_or_create(
+                            bead_hash=bead_sequence_hash(beads),
+                            defaults={
+                                'name': "Custom Bracelet",
+                                'price': price, # sum of the bead prices
+                                'category': Product.CUSTOMIZED_BRACELET,
+                                # 'description': item.get('description', 'Customized bracelet'),
+                                'inventory': quantity,
+                                'beads': beads,
+                            },
+                        )
+                        if not created:
+                            # Keep a reused design priced and rendered from the current beads, and let its
+                            # made-to-order inventory cap allow the requested quantity
+                            changed = []
+                            if product.price != price:
+                                product.price = price
+                                changed.append('price')
+                            if product.beads != beads:
+                                product.beads = beads
+                                changed.append('beads')
+                            if product.inventory < quantity:
+                                product.inventory = quantity
+                                changed.append('inventory')
+                            if changed:
+                                product.save(update_fields=[*changed, 'updated_at'])
+                        product_id = product.product_id
+                    try:
+                        product_ids.append(uuid.UUID(str(product_id)))
+                    except ValueError:
+                        product_ids.append(None)  # Skip invalid products
+
+                # Load every referenced product and the current cart items in one query each
+                products = Product.objects.in_bulk([pk for pk in product_ids if pk])
+                existing_items = {}
+                removed = []  # ids of the cart items to delete
+                for cart_item in cart.items.all():
+                    if cart_item.product_id in existing_items:
+                        removed.append(cart_item.pk)  # Drop duplicate rows of the same product
+                    else:
+                        existing_items[cart_item.product_id] = cart_item
+
+                # Compute the new quantity of each product; a repeated product keeps its last quantity
+                quantities = {}
+                for item, product_id in zip(items, product_ids):
+                    product = products.get(product_id)
+                    if product is None:
+                        continue  # Skip invalid products
+                    quantity = item.get('quantity')
+
+                    # Check stock and adjust quantity; made-to-order products are shared, so another
+                    # cart may already hold the whole inventory cap
+                    if product.made_to_order:
+                        quantities[product_id] = quantity
+                        continue
+                    if product.inventory == 0:
+                        # Remove item if product is out of stock
+                        quantities.pop(product_id, None)
+                        response_messages.append(f"Product {product.name} is out of stock and removed from the cart.")
+                        continue
+
+                    if quantity > product.inventory:
+                        # Adjust quantity to match stock
+                        quantity = product.inventory
+                        response_messages.append(f"Product {product.name} quantity adjusted to available stock: {quantity}.")
+
+                    quantities[product_id] = quantity
+
+                # Apply the difference with the current cart items
+                removed += [item.pk for pk, item in existing_items.items() if pk not in quantities]
+                created_items = []
+                updated_items = []
+                for product_id, quantity in quantities.items():
+                    cart_item = existing_items.get(product_id)
+                    if cart_item is None:
+                        created_items.append(CartItem(cart=cart, product=products[product_id], quantity=quantity))
+                    elif cart_item.quantity != quantity:
+                        cart_item.quantity = quantity
+                        updated_items.append(cart_item)
+                if removed:
+                    CartItem.objects.filter(pk__in=removed).delete()
+                if created_items:
+                    CartItem.objects.bulk_create(created_items)
+                if updated_items:
+                    CartItem.objects.bulk_update(updated_items, ['quantity'])
 
             # Serialize the updated cart
             serializer = CartSerializer(cart)
@@ -439,6 +911,15 @@ def cart_action(request):
             {"success": False, "message": str(e)}, status=500
         )
 
+class InsufficientStock(Exception):
+    """Raised inside the checkout transaction to roll it back when a product runs out of stock"""
+
+    def __init__(self, product, quantity):
+        super().__init__(product, quantity)
+        self.product = product
+        self.quantity = quantity
+
+
 # @csrf_exempt  # Disable CSRF protection just for test purposes
 def checkout_action(request):
     if request.method != "POST":
@@ -446,10 +927,16 @@ def checkout_action(request):
             {"success": False, "message": "Invalid request method."}, status=405
         )
 
+    identity = get_identity(request)
+    if identity is None:
+        return JsonResponse(
+            {"success": False, "message": "User is not authenticated."}, status=401
+        )
+
     # Get the user's cart
-    user = User.objects.get(id=request.user.id)
+    user_id = identity["id"]
     try:
-        cart = Cart.objects.get(user=user)
+        cart = Cart.objects.get(user_id=user_id)
     except Cart.DoesNotExist:
         return JsonResponse(
             {"success": False, "message": "Cart not found."}, status=404
@@ -457,41 +944,103 @@ def checkout_action(request):
 
     data = json.loads(request.body)
 
-    # Get the cart items
-    cart_items = cart.items.all()
+    try:
+        with transaction.atomic():
+            # Get the cart items, then lock their products (in primary key order, so concurrent
+            # checkouts can't deadlock) and load them with their images in one query each
+            cart_items = list(cart.items.all())
+
+            # Check if the cart is empty
+            if not cart_items:
+                return JsonResponse(
+                    {"success": False, "message": "Cart is empty."}, status=400
+                )
 
-    # Compute the order price
-    total_price = sum(item.product.price * item.quantity for item in cart_items)
+            quantities = {}
+            for item in cart_items:
+                quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
+            products = {
+                product.pk: product
+                for product in Product.objects.select_for_update()
+                .filter(pk__in=quantities)
+                .order_by("pk")
+            }
+
+            # Make sure every product still has enough stock
+            for product_id, quantity in quantities.items():
+                product = products.get(product_id)
+                if product is None or (not product.made_to_order and product.inventory < quantity):
+                    raise InsufficientStock(product, quantity)
+
+            # Decrement the inventory and increment the sales count of every product in one
+            # statement. The inventory guard keeps it from overselling even where the database
+            # ignores row locks. Made-to-order products keep their inventory.
+            def delta(stocked_only):
+                return Case(
+                    *[
+                        When(pk=product_id, then=Value(quantity))
+                        for product_id, quantity in quantities.items()
+                        if not (stocked_only and products[product_id].made_to_order)
+                    ],
+                    default=Value(0),
+                    output_field=IntegerField(),
+                )
+            in_stock = Q()
+            for product_id, quantity in quantities.items():
+                if products[product_id].made_to_order:
+                    in_stock |= Q(pk=product_id)
+                else:
+                    in_stock |= Q(pk=product_id, inventory__gte=quantity)
+            updated = Product.objects.filter(in_stock).update(
+                inventory=F("inventory") - delta(stocked_only=True),
+                sales_count=F("sales_count") + delta(stocked_only=False),
+                updated_at=timezone.now(),
+            )
+            if updated != len(quantities):
+                raise InsufficientStock(None, None)
+            # The bulk update skips the model signals, so invalidate the catalog cache here
+            transaction.on_commit(bump_catalog_version)
+
+            # Compute the order price
+            total_price = sum(products[item.product_id].price * item.quantity for item in cart_items)
+
+            # Prepare items for the order
+            order_items = []
+            for item in cart_items:
+                product = products[item.product_id]
+                manifest = product.image_manifest
+                order_items.append({
+                    "product_id": str(product.product_id),
+                    "name": product.name,
+                    "price": str(product.price),
+                    "quantity": item.quantity,
+                    "image": product.primary_image or None,
+                    "image_variants": srcset(manifest[0]["variants"]) if manifest else {},
+                    "beads": product.beads,
+                })
+
+            # Create the order
+            order = Order.objects.create(
+                user_id=user_id,
+                amount=total_price,
+                items=order_items,
+                shipping_address=data.get('shipping_address', None)
+            )
+            # Write the normalized order lines next to the snapshot
+            write_order_lines([order])
 
-    # Check if the cart is empty
-    if not cart_items:
+            # Clear the cart and its payment intent
+            cart.items.all().delete()
+            clear_payment_intent(cart)
+    except InsufficientStock as e:
+        if e.product is None:
+            message = "Some products in the cart are out of stock."
+        else:
+            message = f"Product {e.product.name} has only {e.product.inventory} left in stock."
         return JsonResponse(
-            {"success": False, "message": "Cart is empty."}, status=400
+            {"success": False, "message": message}, status=409
         )
 
-    # Prepare items for the order
-    order_items = []
-    for item in cart_items:
-        order_items.append({
-            "product_id": str(item.product.product_id),
-            "name": item.product.name,
-            "price": str(item.product.price),
-            "quantity": item.quantity,
-            "image": item.product.images.first().image.url if item.product.images.exists() else None,
-            "beads": item.product.beads,
-        })
-
-    # Create the order
-    order = Order.objects.create(
-        user=user,
-        amount=total_price,
-        items=order_items,
-        shipping_address=data.get('shipping_address', None)
-    )
-
-    # Clear the cart
-    cart.items.all().delete()
-
     # Serialize and return the order
     serializer = OrderSerializer(order)
     return JsonResponse(
@@ -500,24 +1049,88 @@ def checkout_action(request):
 
 
 # @csrf_exempt  # Disable CSRF protection just for test purposes
-def get_orders_action(request):
+@replica_reads()
+async def get_orders_action(request):
     if request.method != "GET":
         return JsonResponse(
             {"success": False, "message": "Invalid request method."}, status=405
         )
 
+    # Get the page size, the cursor returned with the previous page and the mode
+    try:
+        limit = min(max(int(request.GET.get("limit", ORDER_PAGE_SIZE)), 1), ORDER_MAX_PAGE_SIZE)
+    except ValueError:
+        return JsonResponse({"success": False, "message": "Invalid limit."}, status=400)
+    cursor = request.GET.get("cursor") or None
+    summary = request.GET.get("summary") in ("1", "true")
+
+    identity = await aget_identity(request)
+    if identity is None:
+        return JsonResponse(
+            {"success": False, "message": "User is not authenticated."}, status=401
+        )
+
     try: 
         # Get the user's orders
-        user = User.objects.get(id=request.user.id)
-        orders = Order.objects.filter(user=user).order_by('-created_at')  # Sort by created_at in descending order
+        orders = order_orders(Order.objects.filter(user_id=identity["id"]))  # Sort by created_at in descending order
+        if cursor:
+            orders = after_order_cursor(orders, cursor)
+        if summary:
+            # Count the items in the database instead of loading and parsing the items JSON
+            orders = orders.annotate(item_count=JSONArrayLength("items")).values(
+                "order_id", "amount", "status", "created_at", "item_count"
+            )
+
+        # Fetch one extra order to know whether there is a next page
+        orders = [order async for order in orders[:limit + 1]]
+        next_cursor = None
+        if len(orders) > limit:
+            orders = orders[:limit]
+            last = orders[-1]
+            if summary:
+                next_cursor = encode_order_cursor(last["created_at"], last["order_id"])
+            else:
+                next_cursor = encode_order_cursor(last.created_at, last.order_id)
 
         # Serialize the orders
-        serializer = OrderSerializer(orders, many=True)
+        serializer = (OrderSummarySerializer if summary else OrderSerializer)(orders, many=True)
 
         return JsonResponse(
-            {"success": True, "orders": serializer.data}, status=200
+            {"success": True, "orders": serializer.data, "next_cursor": next_cursor}, status=200
+        )
+    except InvalidCursor as e:
+        return JsonResponse(
+            {"success": False, "message": str(e)}, status=400
         )
     except Exception as e:
         return JsonResponse(
             {"success": False, "message": str(e)}, status=500
         )
+
+
+# Get a single order of the current user, with its items
+# @csrf_exempt  # Disable CSRF protection just for test purposes
+@replica_reads()
+async def get_order_action(request, order_id):
+    if request.method != "GET":
+        return JsonResponse(
+            {"success": False, "message": "Invalid request method."}, status=405
+        )
+
+    identity = await aget_identity(request)
+    if identity is None:
+        return JsonResponse(
+            {"success": False, "message": "User is not authenticated."}, status=401
+        )
+
+    try:
+        order = await Order.objects.aget(order_id=order_id, user_id=identity["id"])
+    except Order.DoesNotExist:
+        return JsonResponse(
+            {"success": False, "message": "Order not found."}, status=404
+        )
+
+    serializer = OrderSerializer(order)
+    return JsonResponse(
+        {"success": True, "order": serializer.data}, status=200
+    )
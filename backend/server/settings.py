@@ -23,6 +23,10 @@ load_dotenv()
 # Ensure the session expires after the specified time
 # SESSION_EXPIRE_AT_BROWSER_CLOSE = False
 
+# Read sessions from the cache and only fall back to the database on a miss. Sessions are
+# still written through to the database, so they survive a cache restart.
+SESSION_ENGINE = os.getenv("DJANGO_SESSION_ENGINE", "django.contrib.sessions.backends.cached_db")
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -59,7 +63,11 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so it measures the whole request
+    "namas.metrics.metrics_middleware",
     "django.middleware.security.SecurityMiddleware",
+    # Outside the session middleware so session writes pin the client to the primary
+    "namas.routers.replica_routing_middleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -68,6 +76,9 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     "social_django.middleware.SocialAuthExceptionMiddleware",
     "corsheaders.middleware.CorsMiddleware",
+    # Last, so under ASGI it runs on the event loop next to the views rather than in the thread of
+    # the sync middleware above
+    "namas.profiling.profiling_middleware",
 ]
 
 ROOT_URLCONF = "server.urls"
@@ -98,6 +109,56 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        # SQLite ignores SELECT ... FOR UPDATE; taking the write lock when a transaction
+        # begins serializes concurrent checkouts instead of failing them with "database is locked"
+        "OPTIONS": {
+            "transaction_mode": "IMMEDIATE",
+            "timeout": 20,
+        },
+        # Use a file for the test database so tests can run transactions from several threads
+        "TEST": {
+            "NAME": BASE_DIR / "test_db.sqlite3",
+        },
+        # Seconds to keep a connection open between requests, checked before reuse. Keep 0 under
+        # daphne: ASGI requests run on short-lived threads that can't share persistent connections.
+        "CONN_MAX_AGE": int(os.getenv("DJANGO_CONN_MAX_AGE", "0")),
+        "CONN_HEALTH_CHECKS": True,
+    }
+}
+
+# Read replicas (optional): a comma-separated list of database files kept in step with the primary,
+# e.g. SQLite copies refreshed with python3 manage.py sync_sqlite_replicas. Views marked with
+# namas.routers.replica_reads read from them; every write goes to the primary.
+DATABASE_REPLICAS = []
+for index, name in enumerate(filter(None, os.getenv("DJANGO_DB_REPLICAS", "").split(","))):
+    alias = f"replica_{index}"
+    DATABASES[alias] = {
+        **DATABASES["default"],
+        "NAME": name.strip(),
+        # Tests read the replicas through the test primary
+        "TEST": {"MIRROR": "default"},
+    }
+    DATABASE_REPLICAS.append(alias)
+
+# Seconds a client that wrote, and every client after a catalog change, reads from the primary,
+# longer than the replicas take to catch up
+DATABASE_REPLICA_PIN_SECONDS = int(os.getenv("DJANGO_DB_REPLICA_PIN_SECONDS", "5"))
+
+DATABASE_ROUTERS = ["namas.routers.ReplicaRouter"]
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# Local memory by default; set DJANGO_CACHE_BACKEND=django.core.cache.backends.filebased.FileBasedCache
+# and DJANGO_CACHE_LOCATION to a directory to share the catalog cache between worker processes
+
+CACHES = {
+    "default": {
+        "BACKEND": os.getenv("DJANGO_CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": os.getenv("DJANGO_CACHE_LOCATION", "namas"),
+        "OPTIONS": {
+            "MAX_ENTRIES": 10000,
+        },
     }
 }
 
@@ -153,6 +214,14 @@ AUTHENTICATION_BACKENDS = (
     "social_core.backends.google.GoogleOAuth2",
 )
 
+# Login and registration throttling, per client IP and per account (see namas.throttling).
+# Behind the nginx proxy set AUTH_THROTTLE_IP_HEADER=HTTP_X_REAL_IP, otherwise every client shares the proxy's address.
+AUTH_THROTTLE_IP_HEADER = os.getenv("AUTH_THROTTLE_IP_HEADER", "")
+AUTH_THROTTLE_IP_BURST = int(os.getenv("AUTH_THROTTLE_IP_BURST", "20"))
+AUTH_THROTTLE_IP_PER_MINUTE = float(os.getenv("AUTH_THROTTLE_IP_PER_MINUTE", "10"))
+AUTH_THROTTLE_ACCOUNT_BURST = int(os.getenv("AUTH_THROTTLE_ACCOUNT_BURST", "5"))
+AUTH_THROTTLE_ACCOUNT_PER_MINUTE = float(os.getenv("AUTH_THROTTLE_ACCOUNT_PER_MINUTE", "2"))
+
 # Google OAuth
 SOCIAL_AUTH_GOOGLE_OAUTH2_KEY = os.getenv("GOOGLE_OAUTH2_KEY")
 SOCIAL_AUTH_GOOGLE_OAUTH2_SECRET = os.getenv("GOOGLE_OAUTH2_SECRET")
@@ -164,9 +233,43 @@ LOGOUT_REDIRECT_URL = os.getenv("FRONTEND_URL")
 # Redirect to HTTPS if not in debug mode
 SOCIAL_AUTH_REDIRECT_IS_HTTPS = os.getenv("DJANGO_DEBUG") != "true"
 
+# Stripe
+STRIPE_SECRET_KEY = os.getenv("STRIPE_SECRET_KEY")
+# Point at a local stub server (python manage.py run_stripe_stub) to run the payment path offline
+STRIPE_API_BASE = os.getenv("STRIPE_API_BASE", "https://api.stripe.com")
+# Seconds to wait for a connection and for a response from Stripe
+STRIPE_CONNECT_TIMEOUT = float(os.getenv("STRIPE_CONNECT_TIMEOUT", "3"))
+STRIPE_READ_TIMEOUT = float(os.getenv("STRIPE_READ_TIMEOUT", "10"))
+# Retries of failed requests; safe because every write carries an idempotency key
+STRIPE_MAX_NETWORK_RETRIES = int(os.getenv("STRIPE_MAX_NETWORK_RETRIES", "2"))
+# Payment calls allowed in flight per process, and seconds a request waits for a free slot
+PAYMENT_GATEWAY_MAX_CONCURRENCY = int(os.getenv("PAYMENT_GATEWAY_MAX_CONCURRENCY", "8"))
+PAYMENT_GATEWAY_QUEUE_TIMEOUT = float(os.getenv("PAYMENT_GATEWAY_QUEUE_TIMEOUT", "1"))
+# Consecutive provider errors that open the circuit, and seconds before a trial call is let through
+PAYMENT_GATEWAY_FAILURE_THRESHOLD = int(os.getenv("PAYMENT_GATEWAY_FAILURE_THRESHOLD", "5"))
+PAYMENT_GATEWAY_RESET_TIMEOUT = float(os.getenv("PAYMENT_GATEWAY_RESET_TIMEOUT", "30"))
+
 # Media URL and Root
 # URL prefix for accessing media files
 MEDIA_URL = "/media/"
 
 # Absolute path to the directory where media files are stored
 MEDIA_ROOT = os.path.join(BASE_DIR, "media")
+
+# Request metrics: a Server-Timing header on every response, and /metrics for staff or for a
+# scraper sending "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_SERVER_TIMING = os.getenv("METRICS_SERVER_TIMING") != "false"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+# Request profiling: a PROFILING_SAMPLE_RATE fraction of requests, and requests of staff users
+# sending "X-Profile: 1", are sampled every PROFILING_INTERVAL seconds and stored in PROFILING_DIR
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", "0"))
+PROFILING_INTERVAL = float(os.getenv("PROFILING_INTERVAL", "0.002"))
+PROFILING_DIR = os.getenv("PROFILING_DIR", os.path.join(BASE_DIR, "profiles"))
+PROFILING_MAX_CAPTURES = int(os.getenv("PROFILING_MAX_CAPTURES", "200"))
+# Requests profiled at the same time per process, further ones aren't
+PROFILING_MAX_ACTIVE = int(os.getenv("PROFILING_MAX_ACTIVE", "2"))
+
+# Encoder of the JSON responses: "orjson" when it is installed, or "json" for the standard library.
+# Both write the same bytes.
+JSON_RESPONSE_BACKEND = os.getenv("JSON_RESPONSE_BACKEND", "orjson")
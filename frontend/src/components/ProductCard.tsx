@@ -19,13 +19,24 @@ export default function ProductCard({ product }: { product: IProduct }) {
         className="m-0 rounded-none h-64"
       >
         <Carousel className="h-full">
-          {product.images.map((image) => (
-            <img
-              src={image}
-              alt={product.name}
-              key={image}
-              className="h-full w-full object-cover"
-            />
+          {product.images.map((image, i) => (
+            <picture key={image}>
+              {product.image_variants?.[i]?.webp && (
+                <source
+                  type="image/webp"
+                  srcSet={product.image_variants[i].webp}
+                  sizes="384px"
+                />
+              )}
+              <img
+                src={image}
+                srcSet={product.image_variants?.[i]?.jpeg}
+                sizes="384px"
+                alt={product.name}
+                loading="lazy"
+                className="h-full w-full object-cover"
+              />
+            </picture>
           ))}
         </Carousel>
       </CardHeader>
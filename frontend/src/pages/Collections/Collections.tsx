@@ -1,6 +1,6 @@
 import ProductCard from '@components/ProductCard';
 import ProductSkeleton from '@components/ProductSkeleton';
-import { getProducts, getTotalPages } from '@services/productService';
+import { getProductListing } from '@services/productService';
 import { useParams, useSearchParams } from 'react-router-dom';
 import { useEffect, useState } from 'react';
 
@@ -265,22 +265,20 @@ function Collections() {
         const priceMax = Number(searchParams.get('price_max')) || null;
         const page = Number(searchParams.get('page')) || 1;
 
-        // Get total number of pages
-        const totalPages = await getTotalPages(type, priceMin, priceMax);
+        // Fetch products and the total number of pages in one request
+        const { products: fetchedProducts, pages: totalPages } =
+          await getProductListing(
+            type,
+            sortBy,
+            order,
+            priceMin,
+            priceMax,
+            page,
+          );
         // Set total number of pages
         setTotalPages(totalPages);
         // Set current page
         setCurrentPage(page);
-
-        // Fetch products
-        const fetchedProducts = await getProducts(
-          type,
-          sortBy,
-          order,
-          priceMin,
-          priceMax,
-          page,
-        );
         // Set product list
         setProductList(fetchedProducts);
         // Set state to success
@@ -1,6 +1,6 @@
 import { Button } from '@material-tailwind/react';
 import { useState, useEffect } from 'react';
-import { getProducts } from '@services/productService';
+import { getAllProducts } from '@services/productService';
 import { IBraceletSlot, IBead } from 'types/customize.interface';
 import BraceletDisplay from './BraceletDisplay';
 import BeadSelector from './BeadSelector';
@@ -22,7 +22,7 @@ const Customize = () => {
     // Fetch all beads from the backend and set them to the available beads
     const fetchBeadProducts = async () => {
       try {
-        const fetchedBeads = await getProducts('bead');
+        const fetchedBeads = await getAllProducts('bead');
         setAvailableBeads(
           fetchedBeads.map((bead) => ({
             bead_id: bead.product_id,
@@ -1,5 +1,5 @@
 import { Button } from '@material-tailwind/react';
-import { useEffect, useState } from 'react';
+import { useCallback, useEffect, useState } from 'react';
 import { getCurrentUser, logout } from '@services/userService';
 import { IUser } from 'types/user.interface';
 import { getOrders } from '@services/orderService';
@@ -84,6 +84,32 @@ export default function Profile() {
     last_name: '',
   });
   const [orders, setOrders] = useState<IOrder[]>([]);
+  // Cursor of the next page of orders, null once every order is loaded
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [loadingOrders, setLoadingOrders] = useState(false);
+
+  // Load one page of orders, appending it to the orders already shown
+  const fetchOrders = useCallback(async (cursor: string | null = null) => {
+    setLoadingOrders(true);
+    try {
+      const page = await getOrders(cursor);
+      setOrders((current) => (cursor ? [...current, ...page.orders] : page.orders));
+      setNextCursor(page.next_cursor);
+    } catch (error) {
+      console.error(error);
+      // Show bottom alert
+      window.dispatchEvent(
+        new CustomEvent('show-bottom-alert', {
+          detail: {
+            message: 'Failed to fetch past orders.',
+            timeout: 2000,
+          },
+        }),
+      );
+    } finally {
+      setLoadingOrders(false);
+    }
+  }, []);
 
   useEffect(() => {
     const fetchUser = async () => {
@@ -120,27 +146,9 @@ export default function Profile() {
       }
     };
 
-    const fetchOrders = async () => {
-      try {
-        const orders = await getOrders();
-        setOrders(orders);
-      } catch (error) {
-        console.error(error);
-        // Show bottom alert
-        window.dispatchEvent(
-          new CustomEvent('show-bottom-alert', {
-            detail: {
-              message: 'Failed to fetch past orders.',
-              timeout: 2000,
-            },
-          }),
-        );
-      }
-    };
-
     void fetchUser();
     void fetchOrders();
-  }, []);
+  }, [fetchOrders]);
 
   const handleLogout = async () => {
     try {
@@ -178,6 +186,16 @@ export default function Profile() {
         ) : (
           <div className="text-center text-lg font-normal">No orders found.</div>
         )}
+        {nextCursor && (
+          <Button
+            variant="outlined"
+            className="w-fit self-center"
+            disabled={loadingOrders}
+            onClick={() => void fetchOrders(nextCursor)}
+          >
+            {loadingOrders ? 'Loading...' : 'Load more'}
+          </Button>
+        )}
       </div>
     </div>
   );
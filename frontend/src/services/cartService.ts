@@ -1,5 +1,25 @@
 import { ICartItem, ICartResponse } from 'types/cart.interface';
 import { getCookie } from './getCookie';
+
+/**
+ * Add backend address to the bead images of a customized bracelet, which the backend
+ * stores as media paths like the product images
+ */
+const addBackendUrlToBeadImages = (item: ICartItem): ICartItem => {
+  if (import.meta.env.VITE_PROD || !item.beads) {
+    return item;
+  }
+  return {
+    ...item,
+    beads: item.beads.map((bead) => ({
+      ...bead,
+      imgPath: bead.imgPath?.startsWith('/')
+        ? `${import.meta.env.VITE_BACKEND_URL}${bead.imgPath}`
+        : bead.imgPath,
+    })),
+  };
+};
+
 /**
  * Get the current user's cart from backend
  * @returns The cart
@@ -19,7 +39,7 @@ export async function getCart(): Promise<ICartItem[]> {
   if (!response.ok) {
     throw new Error(data.messages?.[0] ?? 'Failed to get cart');
   }
-  return data.cart_items;
+  return data.cart_items.map(addBackendUrlToBeadImages);
 }
 
 /**
@@ -2,7 +2,6 @@ import {
   ICheckoutResponse,
   IShippingAddress,
   IOrdersResponse,
-  IOrder,
 } from 'types/order.interface';
 import { getCookie } from './getCookie';
 
@@ -39,11 +38,17 @@ export async function checkout(
 }
 
 /**
- * Get all orders for the current user
- * @returns The orders
+ * Get one page of the current user's orders, newest first
+ * @param cursor The next_cursor of the previous page, or null for the first page
+ * @returns The orders of the page and the cursor of the next page
  */
-export async function getOrders(): Promise<IOrder[]> {
-  const url = `${import.meta.env.VITE_BACKEND_URL}/orders`;
+export async function getOrders(
+  cursor: string | null = null,
+): Promise<IOrdersResponse> {
+  const baseUrl = `${import.meta.env.VITE_BACKEND_URL}/orders`;
+  const url = cursor
+    ? `${baseUrl}?cursor=${encodeURIComponent(cursor)}`
+    : baseUrl;
   const response = await fetch(url, {
     credentials: 'include',
     headers: {
@@ -55,7 +60,5 @@ export async function getOrders(): Promise<IOrder[]> {
     throw new Error(`Get orders failed: ${response.statusText}`);
   }
 
-  const data = (await response.json()) as IOrdersResponse;
-
-  return data.orders;
+  return (await response.json()) as IOrdersResponse;
 }
@@ -17,6 +17,8 @@ export const createPayment = async (
       `${import.meta.env.VITE_BACKEND_URL}/checkout/create-payment`,
       {
         method: 'POST',
+        // The amount is computed from the session's cart on the server
+        credentials: 'include',
         headers: {
           'Content-Type': 'application/json',
           'X-CSRFToken': getCookie('csrftoken'),
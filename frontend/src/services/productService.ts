@@ -1,6 +1,7 @@
 import {
   IProduct,
   IProductResponse,
+  IProductListingResponse,
   IProductDetailsResponse,
   IPageCountResponse,
 } from '../types/product.interface';
@@ -65,6 +66,98 @@ export const getProducts = async (
     : data.products.map(addBackendUrlToProductImages);
 };
 
+/**
+ * Fetches a page of products together with the total number of pages in one request.
+ * @param type - The type of products (e.g., 'bracelet', 'necklace', 'ring', 'bead').
+ * @param sortBy - Field to sort products by (e.g., 'price', 'created_at', 'sales_count').
+ * @param orderBy - Order of sorting (e.g., 'asc', 'desc').
+ * @param priceMin - Minimum price filter.
+ * @param priceMax - Maximum price filter.
+ * @param page - The page number to fetch.
+ * @returns The products of the page with updated image URLs and the total number of pages.
+ */
+export const getProductListing = async (
+  type: 'bracelet' | 'necklace' | 'ring' | 'bead' | null = null,
+  sortBy: 'price' | 'created_at' | 'sales_count' | null = null,
+  orderBy: 'asc' | 'desc' | null = null,
+  priceMin: number | null = null,
+  priceMax: number | null = null,
+  page: number = 1,
+): Promise<{ products: IProduct[]; pages: number }> => {
+  const baseUrl = `${import.meta.env.VITE_BACKEND_URL}/products/listing`;
+  // Construct URL parameters
+  const params = new URLSearchParams();
+  if (type) params.append('type', type);
+  if (sortBy) params.append('sort_by', sortBy);
+  if (orderBy) params.append('order', orderBy);
+  if (priceMin !== null) params.append('price_min', priceMin.toString());
+  if (priceMax !== null) params.append('price_max', priceMax.toString());
+  if (page) params.append('page', page.toString());
+
+  const url = params.toString() ? `${baseUrl}?${params.toString()}` : baseUrl;
+
+  const response = await fetch(url, {
+    headers: {
+      'Content-Type': 'application/json',
+      'X-CSRFToken': getCookie('csrftoken'),
+    },
+  });
+  if (!response.ok) {
+    throw new Error(`Failed to get products: ${response.statusText}`);
+  }
+
+  const data = (await response.json()) as IProductListingResponse;
+
+  // Map products to include backend image URLs if not in production
+  return {
+    products: import.meta.env.VITE_PROD
+      ? data.products
+      : data.products.map(addBackendUrlToProductImages),
+    pages: data.pages,
+  };
+};
+
+/**
+ * Fetches every product of a type by following the backend pagination cursor.
+ * @param type - The type of products (e.g., 'bracelet', 'necklace', 'ring', 'bead').
+ * @returns All products of the type with updated image URLs.
+ */
+export const getAllProducts = async (
+  type: 'bracelet' | 'necklace' | 'ring' | 'bead' | null = null,
+): Promise<IProduct[]> => {
+  const baseUrl = `${import.meta.env.VITE_BACKEND_URL}/products`;
+  const products: IProduct[] = [];
+  let cursor: string | null = null;
+
+  do {
+    // Construct URL parameters
+    const params = new URLSearchParams();
+    if (type) params.append('type', type);
+    if (cursor) params.append('cursor', cursor);
+
+    const url = params.toString() ? `${baseUrl}?${params.toString()}` : baseUrl;
+
+    const response = await fetch(url, {
+      headers: {
+        'Content-Type': 'application/json',
+        'X-CSRFToken': getCookie('csrftoken'),
+      },
+    });
+    if (!response.ok) {
+      throw new Error(`Failed to get products: ${response.statusText}`);
+    }
+
+    const data = (await response.json()) as IProductResponse;
+    products.push(...data.products);
+    cursor = data.next_cursor;
+  } while (cursor);
+
+  // Map products to include backend image URLs if not in production
+  return import.meta.env.VITE_PROD
+    ? products
+    : products.map(addBackendUrlToProductImages);
+};
+
 /**
  * Fetches a single product details from the backend API.
  * @param productId - The ID of the product to fetch.
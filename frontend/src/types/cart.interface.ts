@@ -1,4 +1,5 @@
 import { IBead } from 'types/customize.interface';
+import { IImageVariants } from 'types/product.interface';
 
 export interface ICartItem {
   product_id: string;
@@ -8,6 +9,7 @@ export interface ICartItem {
   price: number;
   category?: string;
   images?: string[];
+  image_variants?: IImageVariants[];
   beads?: IBead[];
 }
 
@@ -30,4 +30,5 @@ export interface ICheckoutResponse {
 export interface IOrdersResponse {
   success: boolean;
   orders: IOrder[];
+  next_cursor: string | null;
 }
@@ -1,9 +1,13 @@
 import { IBead } from 'types/customize.interface';
 
+// srcset strings of the resized copies of an image, keyed by format (webp, jpeg)
+export type IImageVariants = Record<string, string>;
+
 export interface IProduct {
   product_id: string;
   name: string;
   images: string[];
+  image_variants: IImageVariants[];
   price: number;
   category: string;
   description: string;
@@ -15,6 +19,12 @@ export interface IProduct {
 export interface IProductResponse {
   success: boolean;
   products: IProduct[];
+  next_cursor: string | null;
+}
+
+export interface IProductListingResponse extends IProductResponse {
+  total: number;
+  pages: number;
 }
 
 export interface IProductDetailsResponse {